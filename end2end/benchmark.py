@@ -0,0 +1,161 @@
+import copy
+import itertools
+import json
+import logging
+import multiprocessing
+import resource
+import socket
+import time
+from functools import partial
+
+import click
+from tornado import gen
+from tornado.ioloop import IOLoop
+
+from end2end import security
+from end2end.connectors import registry
+from end2end.connectors.factory import load_connectors
+from end2end.fake import server as fake_server
+from end2end.metric import Histogram
+
+# Part of scheduled rate that should be achieved for rate to be considered as sustainable
+SUSTAINABLE_RATIO = 0.95
+
+
+def _int_list(value):
+    return [int(x) for x in value.split(',') if x]
+
+
+def _free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def _cpu_time():
+    usage = resource.getrusage(resource.RUSAGE_SELF)
+    return usage.ru_utime + usage.ru_stime
+
+
+def _connectors_config(host, connector_type, connectors, receivers, trash_size, rate, max_wait):
+    return {
+        'bench_{}_{}_{}'.format(trash_size, receivers, i): {
+            'type': connector_type,
+            'host': host,
+            'verify': False,
+            'topic': 'end2end_benchmark.{}_{}_{}'.format(trash_size, receivers, i),
+            'receivers': receivers,
+            'trash-size': trash_size,
+            'rate': float(rate) / connectors,
+            'max_wait': max_wait,
+        } for i in range(connectors)}
+
+
+def _measure(connectors, elapsed, cpu, sent_before, latency_before):
+    latency = Histogram()
+    sent = 0
+    for c in connectors:
+        # Only latencies measured after warmup are taken
+        latency.merge(c.async_metric.histogram.difference(latency_before[c.name]))
+        sent += c.send_rpm.calls - sent_before.get(c.name, 0)
+    return {
+        'achieved_rps': sent / elapsed,
+        'cpu_per_event_ms': 1000. * cpu / sent if sent else None,
+        'async_p50': latency.percentile(50),
+        'async_p99': latency.percentile(99),
+    }
+
+
+@gen.coroutine
+def _run_benchmark(host, connector_type, connectors_list, receivers_list, trash_sizes, rates, warmup, duration,
+                   max_wait, slo):
+    results = []
+    for connectors_count, receivers, trash_size in itertools.product(connectors_list, receivers_list, trash_sizes):
+        steps = []
+        for rate in rates:
+            registry.instance().set_items(load_connectors(
+                _connectors_config(host, connector_type, connectors_count, receivers, trash_size, rate, max_wait)))
+            yield gen.sleep(warmup)
+            connectors = registry.instance().items()
+            sent_before = {c.name: c.send_rpm.calls for c in connectors}
+            latency_before = {c.name: copy.deepcopy(c.async_metric.histogram) for c in connectors}
+            started, cpu_started = time.time(), _cpu_time()
+            yield gen.sleep(duration)
+            step = _measure(connectors, time.time() - started, _cpu_time() - cpu_started, sent_before,
+                            latency_before)
+            step['rate'] = rate
+            step['sustainable'] = step['achieved_rps'] >= SUSTAINABLE_RATIO * rate and \
+                step['async_p99'] is not None and step['async_p99'] <= slo
+            logging.warning('connectors={} receivers={} trash-size={} {}'.format(
+                connectors_count, receivers, trash_size, json.dumps(step)))
+            steps.append(step)
+            if not step['sustainable']:
+                break
+        sustainable = [x for x in steps if x['sustainable']]
+        results.append({
+            'connectors': connectors_count,
+            'receivers': receivers,
+            'trash_size': trash_size,
+            'max_sustainable_rps': sustainable[-1]['achieved_rps'] if sustainable else None,
+            'cpu_per_event_ms': sustainable[-1]['cpu_per_event_ms'] if sustainable else None,
+            # Fake nakadi has no latency, so latency on the lowest rate is added by checker itself
+            'latency_floor': steps[0]['async_p50'],
+            'steps': steps,
+        })
+    registry.instance().set_items([])
+    return results
+
+
+def _report(results):
+    lines = ['{:>10} {:>9} {:>10} {:>12} {:>12} {:>14}'.format(
+        'connectors', 'receivers', 'trash-size', 'max rps', 'cpu/event ms', 'latency floor')]
+    for r in results:
+        lines.append('{:>10} {:>9} {:>10} {:>12} {:>12} {:>14}'.format(
+            r['connectors'], r['receivers'], r['trash_size'],
+            *('n/a' if r[k] is None else '{:.3f}'.format(r[k])
+              for k in ('max_sustainable_rps', 'cpu_per_event_ms', 'latency_floor'))))
+    return '\n'.join(lines)
+
+
+@click.command()
+@click.option('--type', 'connector_type', type=click.Choice(['nakadi', 'nakadi_subscription']), default='nakadi',
+              help='Type of connectors to check')
+@click.option('--connectors', default='1,4', help='Comma-separated numbers of connectors to check')
+@click.option('--receivers', default='1,5', help='Comma-separated numbers of receivers per connector to check')
+@click.option('--trash-sizes', default='512,8192', help='Comma-separated payload sizes to check')
+@click.option('--rates', default='10,50,100,200,500,1000', help='Comma-separated total publish rates to ramp')
+@click.option('--warmup', type=float, default=5, help='Seconds to wait before measuring every step')
+@click.option('--duration', type=float, default=20, help='Seconds to measure every step')
+@click.option('--max-wait', type=float, default=10, help='Timeout for every message')
+@click.option('--slo', type=float, default=1., help='p99 async latency (seconds) for rate to be sustainable')
+@click.option('--partitions', type=int, default=1, help='Number of partitions of fake nakadi event types')
+@click.option('--publish-latency', type=float, default=0., help='Latency injected by fake nakadi for publishing')
+@click.option('--stream-latency', type=float, default=0., help='Latency injected by fake nakadi for streaming')
+@click.option('--fanout', type=int, default=0, help='Foreign events stored by fake nakadi for every published one')
+@click.option('--output', help='File to write json results to')
+def benchmark(connector_type, connectors, receivers, trash_sizes, rates, warmup, duration, max_wait, slo, partitions,
+              publish_latency, stream_latency, fanout, output):
+    """
+    Finds throughput ceiling of checker itself using fake nakadi, that is run in separate process
+    """
+    logging.basicConfig(level=logging.WARN, format='%(asctime)s\t%(levelname)s\t%(message)s')
+    port = _free_port()
+    fake = multiprocessing.get_context('spawn').Process(
+        target=fake_server.run, args=(port, partitions, publish_latency, stream_latency, fanout), daemon=True)
+    fake.start()
+    try:
+        time.sleep(1)
+        security.use_static_token('benchmark')
+        results = IOLoop.instance().run_sync(partial(
+            _run_benchmark, 'http://127.0.0.1:{}'.format(port), connector_type, _int_list(connectors),
+            _int_list(receivers), _int_list(trash_sizes), _int_list(rates), warmup, duration, max_wait, slo))
+    finally:
+        fake.terminate()
+    click.echo(_report(results))
+    if output:
+        with open(output, 'w') as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == '__main__':
+    benchmark()
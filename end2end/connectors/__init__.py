@@ -1,24 +1,119 @@
+import collections
+import time
+
 from end2end import metric
+from end2end.inflight import InFlightTable
+
+
+def _interval(config):
+    interval = float(config.get('interval', 10))
+    if 'rate' in config and float(config['rate']) > 0:
+        interval = 1. / float(config['rate'])
+    return interval if interval > 0 else 1
 
 
 class Connector(object):
+    # Whether connector is able to measure time for receiving using full initialization of consumer
+    supports_sync = True
+
+    # Options, that could be changed without recreating connector
+    reconfigurable = ('interval', 'rate', 'max_wait', 'max_publishes_in_flight')
+
     def __init__(self, name, **kwargs):
         self.config = kwargs
         self.name = name
-        self.interval = float(kwargs.get('interval', 10))
+        self.interval = _interval(kwargs)
         self.max_wait = float(kwargs.get('max_wait', 60))
-        if self.interval <= 0:
-            self.interval = 1
-        self.sync_metric = metric.instance().create_metric('connector.{}.sync'.format(name), 60. / self.interval)
-        self.async_metric = metric.instance().create_metric('connector.{}.async'.format(name), 60. / self.interval)
+        self.batch_size = max(int(kwargs.get('batch_size', 1)), 1)
+        self.sync_metric = metric.instance().create_metric('connector.{}.sync'.format(name), 60. / self.interval,
+                                                           history=True)
+        self.async_metric = metric.instance().create_metric('connector.{}.async'.format(name), 60. / self.interval,
+                                                            history=True)
         self.async_max_metric = metric.instance().create_metric('connector.{}.async_max'.format(name),
                                                                 60. / self.interval)
         self.send_metric = metric.instance().create_metric('connector.{}.send'.format(name), 60. / self.interval)
-        self.send_rpm = metric.instance().create_call_counter('connector.{}.rps'.format(name))
+        self.send_rpm = metric.instance().create_call_counter('connector.{}.rps'.format(name), history=True)
+        self.schedule_lag_metric = metric.instance().create_metric('connector.{}.schedule_lag'.format(name),
+                                                                   60. / self.interval)
+        self.batch_send_metric = metric.instance().create_metric(
+            'connector.{}.batch_send'.format(name), 60. / self.interval) if self.batch_size > 1 else None
+        self.in_flight = InFlightTable()
+        self.receivers = 0
+        # Number of receipts (receivers) that are expected for each sent message
+        self.expected_receipts = 0
+        self.in_flight_gauge = metric.instance().create_gauge(
+            'connector.{}.in_flight'.format(name),
+            lambda: {'count': len(self.in_flight), 'memory': self.in_flight.memory()})
         self.active = True
+        # Schedule of sends, set by registry once connector is initialized
+        self.schedule = None
+        # Limit of publish requests waiting for response (0 - unlimited), sends over limit are deferred
+        self.max_publishes_in_flight = int(kwargs.get('max_publishes_in_flight', 0))
+        self.publishes_in_flight = 0
+        self._deferred = collections.deque()
+        self._admission = {'deferred': 0, 'skipped': 0}
+        self.admission_gauge = metric.instance().create_gauge(
+            'connector.{}.admission'.format(name),
+            lambda: dict(self._admission, in_flight=self.publishes_in_flight, waiting=len(self._deferred)))
+
+    def reconfigure(self, config):
+        """
+        Applies new configuration in place. Returns False if options, that can't be changed in place, were changed
+        """
+        def _fixed(c):
+            return {k: v for k, v in c.items() if k not in self.reconfigurable}
+
+        if _fixed(config) != _fixed(self.config):
+            return False
+        self.config = config
+        self.interval = _interval(config)
+        self.max_wait = float(config.get('max_wait', 60))
+        self.max_publishes_in_flight = int(config.get('max_publishes_in_flight', 0))
+        self._send_deferred()
+        return True
+
+    def _admitted(self):
+        return not self.max_publishes_in_flight or self.publishes_in_flight < self.max_publishes_in_flight
+
+    def admit(self, intended_time, send):
+        """
+        Calls send(intended_time) if limit of publishes in flight allows it. Otherwise send is deferred till one of
+        publishes is completed (latency is still measured from intended_time), or skipped if there are already
+        max_publishes_in_flight deferred sends.
+        """
+        if self._admitted():
+            return send(intended_time)
+        if len(self._deferred) >= self.max_publishes_in_flight:
+            self._admission['skipped'] += 1
+            return
+        self._admission['deferred'] += 1
+        self._deferred.append((intended_time, send))
+
+    def on_publish_started(self):
+        self.publishes_in_flight += 1
+
+    def on_publish_completed(self):
+        self.publishes_in_flight -= 1
+        self._send_deferred()
+
+    def _send_deferred(self):
+        while self._deferred and self._admitted() and self.active:
+            intended_time, send = self._deferred.popleft()
+            if time.time() - intended_time > self.max_wait:
+                # Message would be reported as timed out right after sending
+                self._admission['skipped'] += 1
+                continue
+            send(intended_time)
+
+    def track(self, data):
+        self.in_flight.add(data.value, data, self.expected_receipts)
+
+    def untrack(self, data):
+        self.in_flight.remove(data.value)
 
-    def send_and_receive(self, data, use_sync):
-        self.send_rpm.on_call()
+    def send_and_receive(self, batch, use_sync):
+        for _ in batch:
+            self.send_rpm.on_call()
 
     def deinitialize(self):
         metric.instance().delete(self.sync_metric)
@@ -26,4 +121,10 @@ class Connector(object):
         metric.instance().delete(self.async_max_metric)
         metric.instance().delete(self.send_metric)
         metric.instance().delete(self.send_rpm)
+        metric.instance().delete(self.schedule_lag_metric)
+        if self.batch_send_metric:
+            metric.instance().delete(self.batch_send_metric)
+        metric.instance().delete(self.in_flight_gauge)
+        metric.instance().delete(self.admission_gauge)
+        self._deferred.clear()
         self.active = False
@@ -0,0 +1,84 @@
+import time
+import zlib
+
+ENCODINGS = ('gzip', 'deflate', 'zstd')
+
+_WBITS = {
+    'gzip': 16 + zlib.MAX_WBITS,
+    'deflate': zlib.MAX_WBITS,
+}
+
+
+def _zstandard():
+    try:
+        import zstandard
+    except ImportError:
+        raise Exception('zstd compression requires zstandard package (pip install nakadi-end2end[zstd])')
+    return zstandard
+
+
+def check_encoding(encoding):
+    if encoding not in ENCODINGS:
+        raise Exception('Compression {} is not supported. Supported are: {}'.format(encoding, ENCODINGS))
+    if encoding == 'zstd':
+        _zstandard()
+    return encoding
+
+
+def compress(encoding, data):
+    if encoding == 'zstd':
+        return _zstandard().ZstdCompressor().compress(data)
+    c = zlib.compressobj(wbits=_WBITS[encoding])
+    return c.compress(data) + c.flush()
+
+
+def decompressor(encoding):
+    """
+    Returns function, that decompresses stream chunk by chunk, or None if encoding is not supported
+    """
+    if encoding == 'zstd':
+        try:
+            return _zstandard().ZstdDecompressor().decompressobj().decompress
+        except Exception:
+            return None
+    if encoding in _WBITS:
+        return zlib.decompressobj(_WBITS[encoding]).decompress
+    return None
+
+
+class CompressionStats(object):
+    """
+    Bytes on the wire and before compression, cpu time spent on compression and decompression
+    """
+
+    def __init__(self):
+        self.values = {
+            'publish_bytes': 0,
+            'publish_raw_bytes': 0,
+            'receive_bytes': 0,
+            'receive_raw_bytes': 0,
+            'compress_cpu': 0.,
+            'decompress_cpu': 0.,
+        }
+
+    def compress(self, encoding, data):
+        if not encoding:
+            result = data
+        else:
+            started = time.process_time()
+            result = compress(encoding, data)
+            self.values['compress_cpu'] += time.process_time() - started
+        self.values['publish_raw_bytes'] += len(data)
+        self.values['publish_bytes'] += len(result)
+        return result
+
+    def decompress(self, decompress, chunk):
+        if decompress is None:
+            result = chunk
+        else:
+            started = time.process_time()
+            result = decompress(chunk)
+            self.values['decompress_cpu'] += time.process_time() - started
+        self.values['receive_bytes'] += len(chunk)
+        self.values['receive_raw_bytes'] += len(result)
+        return result
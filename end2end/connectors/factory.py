@@ -1,17 +1,31 @@
 from end2end.connectors.nakadi import NakadiConnector
+from end2end.connectors.subscription import NakadiSubscriptionConnector
 
 CONNECTORS = {
-    'nakadi': NakadiConnector
+    'nakadi': NakadiConnector,
+    'nakadi_subscription': NakadiSubscriptionConnector
 }
 
 
-def __load_connector(name, spec):
+def __check_type(spec):
     type_ = spec.get('type')
     if type_ not in CONNECTORS:
         raise Exception('Connector type {} is not supported. Supported types are: {}'.format(type_, CONNECTORS.keys()))
+    return type_
 
-    return CONNECTORS[type_](name, **spec)
+
+def load_connector(name, spec):
+    return CONNECTORS[__check_type(spec)](name, **spec)
 
 
 def load_connectors(json):
-    return [__load_connector(x, y) for x, y in json.items()]
+    return [load_connector(x, y) for x, y in json.items()]
+
+
+def validate_connectors(json):
+    """
+    Checks connectors configuration without creating connectors
+    """
+    for spec in json.values():
+        __check_type(spec)
+    return json
@@ -0,0 +1,92 @@
+import math
+import os
+
+from end2end import metric
+
+# Phases reported by curl, every phase time is counted from the start of request
+CURL_PHASES = ('namelookup', 'connect', 'appconnect', 'pretransfer', 'starttransfer')
+
+# Phases that are made only for new connections
+_CONNECTION_PHASES = ('namelookup', 'connect', 'appconnect')
+
+# Bounds of http client pool (number of concurrent requests), that is resized by observed concurrency
+MIN_POOL_SIZE = int(os.getenv('HTTP_POOL_MIN_SIZE', 2))
+
+MAX_POOL_SIZE = int(os.getenv('HTTP_POOL_MAX_SIZE', 100))
+
+# Queue wait, that makes pool grow
+POOL_QUEUE_WAIT_THRESHOLD = 0.005
+
+# Pool is sized for peak concurrency with this headroom
+POOL_HEADROOM = 1.25
+
+
+def phase_durations(time_info, appconnect=0., new_connection=True):
+    """
+    Converts cumulative curl times to durations of phases (namelookup - dns, connect - tcp handshake, appconnect - tls
+    handshake, pretransfer - time before sending request, starttransfer - waiting for the first byte of response).
+    Connection phases are skipped for reused connections, appconnect is skipped for plain http.
+    """
+    result = {}
+    previous = 0.
+    for phase in CURL_PHASES:
+        value = appconnect if phase == 'appconnect' else time_info.get(phase)
+        if not value:
+            continue
+        if new_connection or phase not in _CONNECTION_PHASES:
+            result[phase] = max(value - previous, 0.)
+        previous = max(value, previous)
+    return result
+
+
+def pool_size(size, peak_demand, max_queue_wait, min_size=MIN_POOL_SIZE, max_size=MAX_POOL_SIZE):
+    """
+    Returns new size of http client pool for peak number of requests (running and queued) and max queue wait
+    observed since previous resize. Pool grows when requests were waiting in queue, shrinks when less than half of it
+    was used.
+    """
+    if peak_demand > size or max_queue_wait > POOL_QUEUE_WAIT_THRESHOLD:
+        size = max(int(math.ceil(peak_demand * POOL_HEADROOM)), size + 1)
+    elif peak_demand * 2 < size:
+        size = int(math.ceil(peak_demand * POOL_HEADROOM))
+    return min(max(size, min_size), max_size)
+
+
+class HttpTimings(object):
+    """
+    Per-endpoint histograms of curl phases (connector.X.http.<endpoint>.<phase>) and counters of connection reuse
+    (connector.X.http.connections). Metrics are created on the first response from endpoint.
+    """
+
+    def __init__(self, name):
+        self.name = name
+        self._metrics = {}
+        self._connections = {'new': 0, 'reused': 0}
+        self.connections_gauge = metric.instance().create_gauge(
+            'connector.{}.http.connections'.format(name), lambda: dict(self._connections))
+
+    def _metric(self, endpoint, phase):
+        key = (endpoint, phase)
+        m = self._metrics.get(key)
+        if m is None:
+            m = self._metrics[key] = metric.instance().create_metric(
+                'connector.{}.http.{}.{}'.format(self.name, endpoint, phase), 60.)
+        return m
+
+    def on_response(self, endpoint, time_info, appconnect=0., num_connects=None):
+        """
+        num_connects is None if number of new connections is unknown
+        """
+        if not time_info:
+            return
+        new_connection = num_connects is None or num_connects > 0
+        if num_connects is not None:
+            self._connections['new' if new_connection else 'reused'] += 1
+        for phase, value in phase_durations(time_info, appconnect, new_connection).items():
+            self._metric(endpoint, phase).on_value(value)
+
+    def delete(self):
+        for m in self._metrics.values():
+            metric.instance().delete(m)
+        self._metrics.clear()
+        metric.instance().delete(self.connections_gauge)
@@ -2,49 +2,47 @@ import json
 import logging
 import random
 import string
-import threading
+import time
 import uuid
-from contextlib import closing
-from datetime import datetime, tzinfo, timedelta
 
-import requests
+import pycurl
 from tornado.curl_httpclient import CurlAsyncHTTPClient
 from tornado.ioloop import IOLoop
 
 from end2end import metric
-from end2end.connectors import Connector
-from end2end.connectors.registry import DataToSend
+from end2end.instrumentation import timed, on_response
+from end2end.connectors import Connector, partition_stats
+from end2end.connectors.compression import CompressionStats, check_encoding, decompressor
+from end2end.connectors.http_timing import HttpTimings, pool_size
+from end2end.connectors.payload import EventTemplate, parse_sizes
+from end2end.connectors.stream import Cursors, LineFramer, parse_line, extract_cursor, parse_timestamp, \
+    consumer_lag
 from end2end.security import get_token
 
-STREAM_SEPARATOR = '\n'.encode('UTF-8')
-
-READ_TIMEOUT = 20
+READ_TIMEOUT = 40
 
 CONNECT_TIMEOUT = 1
 
-ZERO_DELTA = timedelta(0)
-
+STREAM_TIMEOUT = 600
 
-class UtcTimeZone(tzinfo):
-    def utcoffset(self, dt):
-        return ZERO_DELTA
+MIN_BACKOFF = 0.5
 
-    def tzname(self, dt):
-        return "UTC"
+MAX_BACKOFF = 30
 
-    def dst(self, dt):
-        return ZERO_DELTA
+# Interval of resizing adaptive http client pool, seconds
+POOL_RESIZE_INTERVAL = 5
 
 
-UTC_INSTANCE = UtcTimeZone()
+ROUND_ROBIN = 'round_robin'
 
 
-def _create_event_type_description(topic):
+def _create_event_type_description(topic, partition_strategy='random'):
     return {
         'name': topic,
         'owning_application': 'end2end_monitor',
         'category': 'business',
         'enrichment_strategies': ['metadata_enrichment'],
+        'partition_strategy': partition_strategy,
         'schema': {
             'type': 'json_schema',
             'schema': json.dumps({
@@ -69,59 +67,176 @@ def _create_event_type_description(topic):
     }
 
 
-def stream_events(base_url, topic_name, verify, cursors_, instance_id, value_callback):
-    streaming_cursors = json.loads(json.dumps(cursors_))
-    thread_def = {
-        'stopped': False
-    }
+class EventStreamReceiver(object):
+    """
+    Non-blocking receiver, that is streaming events from nakadi using IOLoop. All the receivers are multiplexed over
+    one event loop, stream is reconnected with exponential backoff on failures. If encoding is set, compressed stream
+    is requested and decompressed chunk by chunk.
+    """
+
+    def __init__(self, rt, topic_name, cursors_, instance_id, value_callback, receiver_id=0, encoding=None,
+                 stats=None):
+        self.rt = rt
+        self.receiver_id = receiver_id
+        self.topic_name = topic_name
+        self.cursors = cursors_.copy()
+        self.instance_id = instance_id
+        self.value_callback = value_callback
+        self.stopped = False
+        self.backoff = MIN_BACKOFF
+        self._framer = LineFramer(self._on_line, _instance_marker(instance_id))
+        self._received = False
+        self._received_at = None
+        self._curl = None
+        # Status code of the current response, curl doesn't allow to get it in write callback
+        self._status = None
+        self.encoding = encoding
+        self.stats = stats
+        self._decompress = None
+
+    def start(self):
+        self._connect()
+        return self
+
+    def stop(self):
+        # Transfer is aborted from write callback, when the next chunk (at least keep-alive batch) arrives
+        self.stopped = True
+
+    def _connect(self):
+        if self.stopped:
+            return
+        self._framer.reset()
+        self._received = False
+        self._decompress = None
+        self._status = None
+        headers = self._stream_headers()
+        if self.encoding:
+            headers['Accept-Encoding'] = self.encoding
+        self.rt.stream(
+            self._stream_url(),
+            self._on_chunk,
+            self._on_complete,
+            method='GET',
+            headers=headers,
+            connect_timeout=CONNECT_TIMEOUT,
+            request_timeout=STREAM_TIMEOUT + READ_TIMEOUT,
+            # Stream is decompressed by receiver, so bytes on the wire and decompression time could be measured
+            decompress_response=not self.encoding,
+            prepare_curl_callback=self._prepare_curl)
+
+    def _stream_url(self):
+        return '/event-types/{}/events?batch_limit=1&stream_timeout={}'.format(self.topic_name, STREAM_TIMEOUT)
+
+    def _stream_headers(self):
+        return {
+            'Accept': 'application/json',
+            'X-nakadi-cursors': self.cursors.serialize()
+        }
 
-    def _stream_internal():
-        while not thread_def['stopped']:
-            try:
-                headers = {
-                    'Accept': 'application/json',
-                    'X-nakadi-cursors': json.dumps(streaming_cursors),
-                    'Authorization': 'Bearer {}'.format(get_token())
-                }
-                headers.update(_generate_authorization())
-                response = requests.get(
-                    '{}/event-types/{}/events?batch_limit=1'.format(base_url, topic_name),
-                    headers=headers,
-                    verify=verify,
-                    timeout=(1, 40),
-                    stream=True)
-                with closing(response) as r:
-                    if r.status_code == 200:
-                        for line in r.iter_lines(chunk_size=1):
-                            batch = json.loads(line.decode('utf-8'))
-                            update_cursors(streaming_cursors, batch['cursor'])
-                            for evt in [x for x in batch.get('events', []) if x['instance_id'] == instance_id]:
-                                value_callback(evt['value'])
-                            if thread_def['stopped']:
-                                logging.info('Breaking because thread for {} stopped'.format(topic_name))
-                    else:
-                        logging.error('Streaming for {} returned status code {}'.format(topic_name, r.status_code))
-            except Exception as e:
-                logging.error("Failed to process events", exc_info=e)
-
-    t = threading.Thread(target=_stream_internal)
-    t.setDaemon(True)
-    t.start()
-    return thread_def
-
-
-def update_cursors(cursors_list, cursor):
-    [c.update(cursor) for c in cursors_list if c['partition'] == cursor['partition']]
-
-
-def _generate_authorization():
-    return {'Authorization': 'Bearer {}'.format(get_token())}
+    def _on_cursor(self, cursor):
+        self.cursors.update(cursor)
+
+    def offsets(self):
+        """
+        Returns offsets (partition -> offset) of the last received batches
+        """
+        return {p: self.cursors.offset(p) for p in self.cursors.partitions()}
+
+    def _prepare_curl(self, curl):
+        # Processing data directly in curl callback allows to abort transfer once receiver is stopped
+        self._curl = curl
+        curl.setopt(pycurl.WRITEFUNCTION, self._on_curl_write)
+        curl.setopt(pycurl.HEADERFUNCTION, self._on_header)
+        curl.setopt(pycurl.LOW_SPEED_LIMIT, 1)
+        curl.setopt(pycurl.LOW_SPEED_TIME, READ_TIMEOUT)
+
+    def _on_header(self, line):
+        if line.startswith(b'HTTP/'):
+            # Status line of every response (there could be several of them, e.g. 100 Continue)
+            self._decompress = None
+            parts = line.split()
+            self._status = int(parts[1]) if len(parts) > 1 and parts[1].isdigit() else None
+            return
+        name, _, value = line.decode('latin1').partition(':')
+        if self.encoding and name.strip().lower() == 'content-encoding':
+            value = value.strip().lower()
+            self._decompress = decompressor(value)
+            if self._decompress is None and value != 'identity':
+                logging.error('Stream for {} is compressed with unsupported {}'.format(self.topic_name, value))
+
+    def _on_curl_write(self, chunk):
+        if self.stopped:
+            return 0
+        if self._status == 200:
+            if self.stats:
+                chunk = self.stats.decompress(self._decompress, chunk)
+            self._on_chunk(chunk)
+
+    @timed('receive')
+    def _on_chunk(self, chunk):
+        self._received_at = time.time()
+        self._framer.feed(chunk)
+        self._received = True
+
+    def _on_line(self, line, has_instance_events):
+        try:
+            if not has_instance_events:
+                # Batch contains only keep-alive or events of other instances, only cursor is needed
+                return self._on_cursor(extract_cursor(line))
+            batch = parse_line(line)
+            self._on_cursor(batch['cursor'])
+            for evt in [x for x in batch.get('events', []) if x['instance_id'] == self.instance_id]:
+                self.value_callback(evt['value'], self.receiver_id, self._received_at, evt.get('metadata'))
+        except Exception as e:
+            logging.error('Failed to process batch for {}'.format(self.topic_name), exc_info=e)
+
+    def _on_complete(self, r):
+        # Curl handle is returned to the pool and could be used by another request
+        self._curl = None
+        if self.stopped:
+            return logging.info('Stream for {} stopped'.format(self.topic_name))
+        if r.code == 200 or self._received:
+            # Stream was working, so it is just reconnect after timeout
+            self.backoff = MIN_BACKOFF
+            return IOLoop.instance().add_callback(self._connect)
+        logging.error('Streaming for {} returned status code {}, reconnecting in {} seconds'.format(
+            self.topic_name, r.code, self.backoff))
+        IOLoop.instance().call_later(self.backoff, self._connect)
+        self.backoff = min(self.backoff * 2, MAX_BACKOFF)
+
+
+def _instance_marker(instance_id):
+    return '"{}"'.format(instance_id).encode('utf-8')
+
+
+class _DefaultHeaders(object):
+    """
+    Default headers for all the requests, rebuilt only when token changes
+    """
+
+    def __init__(self):
+        self._token = None
+        self._headers = None
+
+    def get(self):
+        token = get_token()
+        if self._headers is None or token != self._token:
+            self._token = token
+            self._headers = {
+                'Authorization': 'Bearer {}'.format(token),
+                'Accept-Encoding': 'gzip;q=0,deflate'
+            }
+        return self._headers
+
+
+_DEFAULT_HEADERS = _DefaultHeaders()
 
 
 def _prepare_defaults(params):
-    h = params.get('headers', {})
-    h.update(_generate_authorization())
-    h['Accept-Encoding'] = 'gzip;q=0,deflate'
+    # Headers passed by caller could be shared between requests, defaults (token) are added to the copy
+    h = dict(params.get('headers') or {})
+    for k, v in _DEFAULT_HEADERS.get().items():
+        h.setdefault(k, v)
     params['headers'] = h
     if 'connect_timeout' not in params:
         params['connect_timeout'] = 5
@@ -129,26 +244,159 @@ def _prepare_defaults(params):
         params['request_timeout'] = 5
 
 
+class _CurlHTTPClient(CurlAsyncHTTPClient):
+    """
+    Curl client, that sets timings not reported by tornado (tls handshake and number of new connections) on response
+    as connection_info.
+    """
+
+    @staticmethod
+    def _keep_connection_info(info, connection_info):
+        # Response is created by tornado inside _finish from unwrapped request, so values are set by callback
+        callback = info['callback']
+
+        def _callback(response):
+            response.connection_info = connection_info
+            return callback(response)
+
+        info['callback'] = _callback
+
+    def _finish(self, curl, curl_error=None, curl_message=None):
+        if curl.info is not None:
+            try:
+                self._keep_connection_info(
+                    curl.info, (curl.getinfo(pycurl.APPCONNECT_TIME), curl.getinfo(pycurl.NUM_CONNECTS)))
+            except pycurl.error:
+                pass
+        super(_CurlHTTPClient, self)._finish(curl, curl_error, curl_message)
+
+
+class _AdaptiveCurlHTTPClient(_CurlHTTPClient):
+    """
+    Curl client, that is used only for publishing. Number of curl handles is resized every POOL_RESIZE_INTERVAL
+    seconds by peak number of requests (running and queued) and max time requests were waiting in queue for free
+    handle. Every connector creates its own instance (force_instance), so other requests (sync reads, commits, event
+    type checks) are not counted, as they are made with shared _CurlHTTPClient.
+    """
+
+    def initialize(self, io_loop, max_clients=10, defaults=None):
+        super(_AdaptiveCurlHTTPClient, self).initialize(io_loop, max_clients, defaults)
+        self.max_clients = max_clients
+        self._peak_demand = 0
+        self._max_queue_wait = 0.
+        self._last_resize = time.time()
+
+    def pool_stats(self):
+        return {
+            'size': len(self._curls),
+            'busy': len(self._curls) - len(self._free_list),
+            'queued': len(self._requests)
+        }
+
+    def _demand(self):
+        return len(self._curls) - len(self._free_list) + len(self._requests)
+
+    def fetch_impl(self, request, callback):
+        super(_AdaptiveCurlHTTPClient, self).fetch_impl(request, callback)
+        self._peak_demand = max(self._peak_demand, self._demand())
+
+    def resize(self, size):
+        """
+        Changes number of curl handles. Busy handles over the size are closed once their requests are finished
+        """
+        if size != self.max_clients:
+            logging.info('Resizing http client pool from {} to {}'.format(self.max_clients, size))
+        self.max_clients = size
+        while len(self._curls) < size:
+            curl = self._curl_create()
+            self._curls.append(curl)
+            self._free_list.append(curl)
+        self._release_extra()
+        self._process_queue()
+
+    def _release_extra(self):
+        while len(self._curls) > self.max_clients and self._free_list:
+            curl = self._free_list.pop()
+            self._curls.remove(curl)
+            curl.close()
+
+    def _adapt(self):
+        now = time.time()
+        if now - self._last_resize < POOL_RESIZE_INTERVAL:
+            return
+        self.resize(pool_size(self.max_clients, self._peak_demand, self._max_queue_wait))
+        self._last_resize = now
+        self._peak_demand = self._demand()
+        self._max_queue_wait = 0.
+
+    def _finish(self, curl, curl_error=None, curl_message=None):
+        if curl.info is not None:
+            self._max_queue_wait = max(self._max_queue_wait,
+                                       curl.info['curl_start_time'] - curl.info['request'].start_time)
+        super(_AdaptiveCurlHTTPClient, self)._finish(curl, curl_error, curl_message)
+        self._release_extra()
+        self._adapt()
+
+
 class RT(object):
-    def __init__(self, base_url, max_clients, verify=True):
-        self.http_client = CurlAsyncHTTPClient(IOLoop.instance(), max_clients=max_clients)
+    def __init__(self, base_url, max_clients, verify=True, force_instance=False, timings=None, adaptive=False):
+        client_class = _AdaptiveCurlHTTPClient if adaptive else _CurlHTTPClient
+        self.http_client = client_class(IOLoop.instance(), max_clients=max_clients, force_instance=force_instance)
         self.base_url = base_url
         self.verify = verify
+        self.timings = timings
+        # Client could be closed only when no requests are running, otherwise curl fails on the next socket event
+        self._running = 0
+        self._closed = False
+
+    def _tracked(self, callback):
+        self._running += 1
+
+        def _callback(r):
+            self._running -= 1
+            try:
+                return callback(r)
+            finally:
+                if self._closed and not self._running:
+                    self.http_client.close()
 
-    def fetch(self, url, callback, **kwargs):
+        return _callback
+
+    def _timed(self, endpoint, callback):
+        def _callback(r):
+            appconnect, num_connects = getattr(r, 'connection_info', (0., None))
+            self.timings.on_response(endpoint, r.time_info, appconnect, num_connects)
+            return callback(r)
+
+        return _callback
+
+    def fetch(self, url, callback, endpoint='other', **kwargs):
         kwargs['request_timeout'] = 60
         _prepare_defaults(kwargs)
         kwargs['validate_cert'] = self.verify
-        return self.http_client.fetch('{}{}'.format(self.base_url, url), callback=callback, **kwargs)
-
-    def stream(self, url, cb, complete_cb, **kwargs):
-        kwargs['request_timeout'] = 60
+        if self.timings:
+            callback = self._timed(endpoint, callback)
+        return self.http_client.fetch('{}{}'.format(self.base_url, url), callback=self._tracked(callback), **kwargs)
+
+    def close(self):
+        """
+        Closes http client with all its connections once running requests are finished, only clients created with
+        force_instance should be closed
+        """
+        self._closed = True
+        if not self._running:
+            self.http_client.close()
+
+    def stream(self, url, cb, complete_cb, endpoint='stream', **kwargs):
+        kwargs.setdefault('request_timeout', 60)
         kwargs['validate_cert'] = self.verify
         _prepare_defaults(kwargs)
+        if self.timings:
+            complete_cb = self._timed(endpoint, complete_cb)
 
         return self.http_client.fetch(
             '{}{}'.format(self.base_url, url),
-            callback=complete_cb,
+            callback=self._tracked(complete_cb),
             streaming_callback=cb,
             **kwargs)
 
@@ -163,22 +411,88 @@ class NakadiConnector(Connector):
         self.topic = kwargs['topic']
         self.receivers = int(kwargs.get('receivers', 1))
         self.initialized_receivers = [None for i in range(0, self.receivers)]
-        self.r = RT(kwargs['host'], int(5 + 5 / self.interval), kwargs['verify'])
+        self.http_timings = HttpTimings(self.name)
+        self.r = RT(kwargs['host'], int(5 + 5 / self.interval), kwargs['verify'], timings=self.http_timings)
+        # Publish client is dedicated to the connector, its pool is resized by observed publish concurrency
+        self.publish_r = RT(kwargs['host'], int(5 + 5 / self.interval), kwargs['verify'], force_instance=True,
+                            timings=self.http_timings, adaptive=True)
+        self.pool_gauge = metric.instance().create_gauge(
+            'connector.{}.http.pool'.format(self.name), self.publish_r.http_client.pool_stats)
+        # Streams are long-living, so they are using separate client in order not to block publishing
+        self.stream_r = RT(kwargs['host'], max(self.receivers, 1), kwargs['verify'], force_instance=True,
+                           timings=self.http_timings)
         self.instance_id = str(uuid.uuid4())
-        self.trash = _generate_trash(kwargs['trash-size'])
-        self.async_callbacks = {}
-        self.sync_callbacks = {}
+        # With trash-sizes connector cycles through payload sizes, latency is reported per size
+        self.sizes = parse_sizes(kwargs['trash-sizes'] if 'trash-sizes' in kwargs else kwargs['trash-size'])
+        self.sweep = 'trash-sizes' in kwargs
+        self._next_size = 0
+        self.trashes = [_generate_trash(size) for size in self.sizes]
+        # With round robin strategy probes are sent to every partition in turn (user_defined partitioning is used)
+        self.round_robin = kwargs.get('partition_strategy') == ROUND_ROBIN
+        self._next_partition = 0
+        self.event_templates = self._create_templates()
+        self._publish_headers = {'Content-Type': 'application/json', 'Accept': 'application/json'}
+        self.compression = check_encoding(kwargs['compression']) if kwargs.get('compression') else None
+        if self.compression:
+            self._publish_headers['Content-Encoding'] = self.compression
+        self.compression_stats = CompressionStats()
+        self.compression_gauge = metric.instance().create_gauge(
+            'connector.{}.compression'.format(self.name), lambda: dict(self.compression_stats.values))
+        self.expected_receipts = self.receivers
         self.init_callback = None
         self.cursors = None
-        self.guard = threading.Condition()
+        self.receiver_metrics = [
+            metric.instance().create_metric('connector.{}.receiver.{}'.format(self.name, i), 60. / self.interval)
+            for i in range(0, self.receivers)]
         self.status_counter = metric.instance().create_status_counter('connector.{}.publish'.format(self.name))
+        # Time publish requests were waiting for free handle of http client (included into send latency)
+        self.queue_wait_metric = metric.instance().create_metric(
+            'connector.{}.queue_wait'.format(self.name), 60. / self.interval)
+        self.producer_to_broker_metric = metric.instance().create_metric(
+            'connector.{}.producer_to_broker'.format(self.name), 60. / self.interval)
+        self.broker_to_consumer_metric = metric.instance().create_metric(
+            'connector.{}.broker_to_consumer'.format(self.name), 60. / self.interval)
+        # Values are growing in send order, so delivery is out of order if receiver got value lower than seen before
+        self._last_values = [None] * self.receivers
+        self._delivery_order = {'in_order': 0, 'out_of_order': 0}
+        self.delivery_order_gauge = metric.instance().create_gauge(
+            'connector.{}.delivery_order'.format(self.name), lambda: dict(self._delivery_order))
+        self.partition_metrics = {}
+        self.size_metrics = {}
+        # Partition stats are polled using own client without timings (requests are coalesced by poller, so one
+        # connection is enough), it is closed on deinitialize
+        self.stats_r = RT(kwargs['host'], 1, kwargs['verify'], force_instance=True)
+        self._receiver_lag = {}
+        self._partition_lag = {}
+        self.receiver_lag_gauge = metric.instance().create_gauge(
+            'connector.{}.lag.receiver'.format(self.name), lambda: dict(self._receiver_lag))
+        self.partition_lag_gauge = metric.instance().create_gauge(
+            'connector.{}.lag.partition'.format(self.name), lambda: dict(self._partition_lag))
 
     def deinitialize(self):
         if self.init_callback is not None:
             return IOLoop.instance().call_later(1, self.deinitialize)
         for t in self.initialized_receivers:
-            t['stopped'] = True
+            if t is not None:
+                t.stop()
+        self.stream_r.close()
+        self.publish_r.close()
+        partition_stats.instance().unsubscribe(self.stats_r, self.topic, self._on_partition_stats)
+        self.stats_r.close()
+        self.http_timings.delete()
+        metric.instance().delete(self.pool_gauge)
         metric.instance().delete(self.status_counter)
+        metric.instance().delete(self.queue_wait_metric)
+        metric.instance().delete(self.producer_to_broker_metric)
+        metric.instance().delete(self.broker_to_consumer_metric)
+        metric.instance().delete(self.delivery_order_gauge)
+        metric.instance().delete(self.compression_gauge)
+        metric.instance().delete(self.receiver_lag_gauge)
+        metric.instance().delete(self.partition_lag_gauge)
+        for m in list(self.partition_metrics.values()) + list(self.size_metrics.values()):
+            metric.instance().delete(m)
+        for m in self.receiver_metrics:
+            metric.instance().delete(m)
         super(NakadiConnector, self).deinitialize()
 
     def initialize(self, init_callback):
@@ -191,12 +505,14 @@ class NakadiConnector(Connector):
                 if r.code == 404:
                     return _create_event_type()
                 elif r.code == 200:
-                    return _prepare_cursors()
+                    self._check_partition_strategy(json.loads(r.body.decode('utf-8')))
+                    return self._prepare_consumption(_on_prepared)
                 else:
                     logging.error('Failed to check for event type ({} {}), retrying'.format(r.code, r.body))
                     return _ensure_event_type_exists()
 
-            return self.r.fetch('/event-types/{}'.format(self.topic), _on_event_type, method='GET')
+            return self.r.fetch('/event-types/{}'.format(self.topic), _on_event_type, endpoint='event_type',
+                                method='GET')
 
         def _create_event_type():
             logging.debug('Creating event type {}'.format(self.topic))
@@ -204,7 +520,7 @@ class NakadiConnector(Connector):
             def _on_event_type_created(r):
                 if r.code == 201:
                     logging.info('Created event type {}'.format(self.topic))
-                    return _prepare_cursors()
+                    return self._prepare_consumption(_on_prepared)
                 else:
                     logging.error('Failed to create event type {}, code: {}, message: {}, retrying'.format(
                         self.topic, r.code, r.body))
@@ -213,88 +529,137 @@ class NakadiConnector(Connector):
             self.r.fetch(
                 '/event-types',
                 _on_event_type_created,
+                endpoint='event_types',
                 method='POST',
                 headers={'Content-Type': 'application/json', 'Accept': 'application/json'},
-                body=json.dumps(_create_event_type_description(self.topic))
+                body=json.dumps(_create_event_type_description(
+                    self.topic, 'user_defined' if self.round_robin else 'random'))
             )
 
-        def _prepare_cursors():
-            def _on_cursors_fetched(r):
-                if r.code == 200:
-                    self.cursors = [{
-                                        'partition': p['partition'],
-                                        'offset': p['newest_available_offset']
-                                    } for p in json.loads(r.body.decode('UTF-8'))]
-
-                    self.start_streaming()
-                    self.init_callback = None
-                    return init_callback()
-                else:
-                    logging.error('Failed to read partitions info for {}. Status code: {}, content: {}'.format(
-                        self.topic, r.code, r.body))
-                    return _prepare_cursors()
-
-            return self.r.fetch(
-                '/event-types/{}/partitions'.format(self.topic),
-                _on_cursors_fetched,
-                method='GET',
-                headers={'Content-Type': 'application/json', 'Accept': 'application/json'},
-            )
+        def _on_prepared():
+            self.start_streaming()
+            partition_stats.instance().subscribe(self.stats_r, self.topic, self._on_partition_stats)
+            self.init_callback = None
+            return init_callback()
 
         _ensure_event_type_exists()
 
-    def start_streaming(self):
-        for i in range(0, self.receivers):
-            self.initialized_receivers[i] = stream_events(
-                self.r.base_url, self.topic, self.r.verify, self.cursors, self.instance_id, self.value_callback)
+    def _create_templates(self):
+        return [EventTemplate(self.topic, partitioned=self.round_robin, instance_id=self.instance_id, trash=trash)
+                for trash in self.trashes]
 
-    def send_and_receive(self, data: DataToSend, use_sync: bool):
-        super(NakadiConnector, self).send_and_receive(data, use_sync)
-        self.register_async_callback(data.value, data.on_async_received, data.on_async_max_received)
-        if use_sync:
-            self.sync_callbacks[data.value] = data.on_sync_received
+    def _check_partition_strategy(self, event_type):
+        if self.round_robin and event_type.get('partition_strategy') != 'user_defined':
+            logging.warning('Event type {} has {} partition strategy, round robin probing is disabled'.format(
+                self.topic, event_type.get('partition_strategy')))
+            self.round_robin = False
+            self.event_templates = self._create_templates()
 
+    def _prepare_consumption(self, callback):
+        """
+        Prepares everything that is needed for streaming once event type exists, calls callback when done
+        """
+
+        def _on_cursors_fetched(r):
+            if r.code == 200:
+                self.cursors = Cursors({
+                                           'partition': p['partition'],
+                                           'offset': p['newest_available_offset']
+                                       } for p in json.loads(r.body.decode('UTF-8')))
+                return callback()
+            else:
+                logging.error('Failed to read partitions info for {}. Status code: {}, content: {}'.format(
+                    self.topic, r.code, r.body))
+                return self._prepare_consumption(callback)
+
+        return self.r.fetch(
+            '/event-types/{}/partitions'.format(self.topic),
+            _on_cursors_fetched,
+            endpoint='partitions',
+            method='GET',
+            headers={'Content-Type': 'application/json', 'Accept': 'application/json'},
+        )
+
+    def _create_receiver(self, receiver_id):
+        return EventStreamReceiver(
+            self.stream_r, self.topic, self.cursors, self.instance_id, self.value_callback, receiver_id,
+            self.compression, self.compression_stats)
+
+    def start_streaming(self):
+        for i in range(0, self.receivers):
+            self.initialized_receivers[i] = self._create_receiver(i).start()
+
+    def _assign_partitions(self, count):
+        partitions = self.cursors.partitions()
+        result = [partitions[(self._next_partition + i) % len(partitions)] for i in range(count)]
+        self._next_partition = (self._next_partition + count) % len(partitions)
+        return result
+
+    def send_and_receive(self, batch: list, use_sync: bool):
+        super(NakadiConnector, self).send_and_receive(batch, use_sync)
+        sync_data = batch[0] if use_sync else None
+        partitions = self._assign_partitions(len(batch)) if self.round_robin else None
+        template = self.event_templates[self._next_size]
+        if self.sweep:
+            for data in batch:
+                data.payload_size = self.sizes[self._next_size]
+            self._next_size = (self._next_size + 1) % len(self.sizes)
+
+        @timed('publish_callback')
         def _on_event_pushed(r):
+            try:
+                _on_published(r)
+            finally:
+                self.on_publish_completed()
+
+        def _on_published(r):
             self.status_counter.on_new_status(r.code)
+            self.queue_wait_metric.on_value((r.time_info or {}).get('queue', 0.))
             if r.code == 200:
-                logging.info('successfully published event')
-                data.on_data_sent()
-                if use_sync:
-                    return self._receive(data.value)
+                completed_at = on_response(r)
+                if self.batch_send_metric:
+                    self.batch_send_metric.on_value(completed_at - batch[0].start_time)
+                for data_ in batch:
+                    data_.on_data_sent(received_at=completed_at)
+                if sync_data:
+                    return self._receive(sync_data.value, partitions[0] if partitions else None)
             else:
-                logging.error('Failed to publish event to {}, status code: {}, content: {}'.format(
-                    self.topic, r.code, r.body))
-                self.delete_async_callback(data.value)
+                # Events are left in flight, so they will be reported as timed out
+                logging.error('Failed to publish {} event(s) to {}, status code: {}, content: {}'.format(
+                    len(batch), self.topic, r.code, r.body))
 
-        self.r.fetch(
+        self.on_publish_started()
+        self.publish_r.fetch(
             '/event-types/{}/events'.format(self.topic),
             _on_event_pushed,
+            endpoint='publish',
             method='POST',
-            headers={'Content-Type': 'application/json', 'Accept': 'application/json'},
-            body=json.dumps([{
-                'metadata': {
-                    'eid': str(uuid.uuid4()),
-                    'event_type': self.topic,
-                    'occurred_at': datetime.now().replace(tzinfo=UTC_INSTANCE).isoformat()
-                },
-                'value': data.value,
-                'instance_id': self.instance_id,
-                'trash': self.trash}]).encode('utf-8')
+            headers=self._publish_headers,
+            body=self.compression_stats.compress(self.compression, template.render_batch(
+                [data.value for data in batch], partitions=partitions))
         )
 
-    def _receive(self, value):
+    def _receive(self, value, partition=None):
+        """
+        Reads value with new consumer. If partition of value is known, only this partition is read
+        """
         attempts_left = [5]
 
+        @timed('sync_callback')
         def _on_response(r):
             if r.code != 200:
                 logging.warning('status {} and body {} while fetching for value {}'.format(r.code, r.body, value))
                 return _fetch_again()
-            batch = json.loads(r.body.decode('UTF-8'))
-            update_cursors(self.cursors, batch['cursor'])
-            for e in [x for x in batch['events'] if x['instance_id'] == self.instance_id]:
-                if e['value'] in self.sync_callbacks:
-                    self.sync_callbacks.pop(e['value'])()
-            if value in self.sync_callbacks:
+            received_at = on_response(r)
+            if _instance_marker(self.instance_id) not in r.body:
+                self.cursors.update(extract_cursor(r.body))
+            else:
+                batch = parse_line(r.body)
+                self.cursors.update(batch['cursor'])
+                for e in [x for x in batch['events'] if x['instance_id'] == self.instance_id]:
+                    if self._is_sync_pending(e['value']):
+                        self.in_flight.get(e['value']).on_sync_received(received_at=received_at)
+            if self._is_sync_pending(value):
                 return _fetch_again()
 
         def _fetch_again():
@@ -304,42 +669,82 @@ class NakadiConnector(Connector):
             return self.r.fetch(
                 '/event-types/{}/events?batch_limit=1&stream_limit=1'.format(self.topic),
                 _on_response,
+                endpoint='sync',
                 request_timeout=20,
                 headers={
                     'Content-Type': 'application/json',
                     'Accept': 'application/json',
-                    'X-nakadi-cursors': json.dumps(self.cursors)
+                    'X-nakadi-cursors': self.cursors.serialize(partition)
                 }
             )
 
         _fetch_again()
 
-    def register_async_callback(self, value, async_callback, async_max_callback):
-        if self.receivers:
-            with self.guard:
-                self.async_callbacks[value] = self.receivers, async_callback, async_max_callback
-
-    def delete_async_callback(self, value):
-        if self.receivers:
-            with self.guard:
-                if value in self.async_callbacks:
-                    del self.async_callbacks[value]
-
-    def value_callback(self, value):
-        async_max_callback = None
-        async_callback = None
-        with self.guard:
-            if value in self.async_callbacks:
-                count, async_callback, async_max_callback = self.async_callbacks.pop(value)
-                if count != self.receivers:
-                    async_callback = None
-                count -= 1
-                if count > 0:
-                    self.async_callbacks[value] = count, None, async_max_callback
-                    async_max_callback = None
-            else:
-                logging.error('Callback for instance {} and value {} is not found'.format(self.instance_id, value))
-        if async_callback:
-            IOLoop.instance().add_callback(async_callback)
-        if async_max_callback:
-            IOLoop.instance().add_callback(async_max_callback)
+    def _on_partition_stats(self, newest):
+        receivers = {str(t.receiver_id): t.offsets() for t in self.initialized_receivers if t is not None}
+        self._receiver_lag, self._partition_lag = consumer_lag(newest, receivers)
+
+    def _is_sync_pending(self, value):
+        data = self.in_flight.get(value)
+        return data is not None and data.sync_pending
+
+    def _on_delivery_order(self, value, receiver_id):
+        last = self._last_values[receiver_id]
+        if last is not None and value < last:
+            self._delivery_order['out_of_order'] += 1
+        else:
+            self._delivery_order['in_order'] += 1
+            self._last_values[receiver_id] = value
+
+    def _partition_metric(self, partition):
+        m = self.partition_metrics.get(partition)
+        if m is None:
+            m = self.partition_metrics[partition] = metric.instance().create_metric(
+                'connector.{}.partition.{}'.format(self.name, partition), 60. / self.interval)
+        return m
+
+    def _size_metric(self, size):
+        m = self.size_metrics.get(size)
+        if m is None:
+            m = self.size_metrics[size] = metric.instance().create_metric(
+                'connector.{}.size.{}'.format(self.name, size), 60. / self.interval)
+        return m
+
+    def _on_breakdown(self, metadata, received_at, first_arrival):
+        """
+        Splits latency using timestamps from event metadata: occurred_at is set on send, received_at is set by
+        nakadi. Clocks of checker and nakadi could differ, so segments are cut at zero.
+        """
+        try:
+            broker_received_at = parse_timestamp(metadata['received_at'])
+            if first_arrival:
+                self.producer_to_broker_metric.on_value(
+                    max(broker_received_at - parse_timestamp(metadata['occurred_at']), 0.))
+            self.broker_to_consumer_metric.on_value(max(received_at - broker_received_at, 0.))
+        except (KeyError, ValueError) as e:
+            logging.debug('Failed to get latency breakdown from {}: {}'.format(metadata, e))
+
+    def value_callback(self, value, receiver_id, received_at, metadata=None):
+        """
+        Called by receivers on IOLoop thread, so no locking is needed. Arrival time is captured by receiver
+        """
+        data = self.in_flight.get(value)
+        if data is None:
+            return logging.error('Callback for instance {} and value {} is not found'.format(self.instance_id, value))
+        if not data.on_arrival(receiver_id, received_at):
+            # Message was replayed to the same receiver (after reconnect)
+            return
+        self.receiver_metrics[receiver_id].on_value(received_at - data.intended_time)
+        self._on_delivery_order(value, receiver_id)
+        count = self.in_flight.decrement(value)
+        if data.payload_size is not None and count == self.expected_receipts - 1:
+            self._size_metric(data.payload_size).on_value(received_at - data.intended_time)
+        if metadata:
+            first_arrival = count == self.expected_receipts - 1
+            self._on_breakdown(metadata, received_at, first_arrival)
+            if first_arrival and 'partition' in metadata:
+                self._partition_metric(metadata['partition']).on_value(received_at - data.intended_time)
+        if count == self.expected_receipts - 1:
+            data.on_async_received(received_at=received_at)
+        if count == 0:
+            data.on_async_max_received(received_at=received_at)
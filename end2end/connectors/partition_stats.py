@@ -0,0 +1,94 @@
+import json
+import logging
+import os
+
+from tornado.ioloop import PeriodicCallback
+
+# Interval of polling partition stats, seconds
+PARTITION_STATS_INTERVAL = float(os.getenv('PARTITION_STATS_INTERVAL', 10))
+
+
+class _HostPoller(object):
+    """
+    Polls partitions of all the event types, that are subscribed on one host. Every event type is requested once per
+    interval, no matter how many connectors are subscribed to it, request is skipped if previous one is not finished.
+    Requests are made using rt of the earliest active subscription, as rt is closed by connector after unsubscribing
+    """
+
+    def __init__(self, interval):
+        self.rts = []
+        self.subscribers = {}
+        self._pending = set()
+        self._callback = PeriodicCallback(self._poll, interval * 1000)
+
+    def start(self):
+        self._callback.start()
+
+    def stop(self):
+        self._callback.stop()
+
+    def _poll(self):
+        for topic in list(self.subscribers.keys()):
+            if topic not in self._pending:
+                self._pending.add(topic)
+                self._fetch(topic)
+
+    def _fetch(self, topic):
+        def _on_partitions(r):
+            self._pending.discard(topic)
+            if r.code != 200:
+                logging.warning('Failed to poll partitions of {}. Status code: {}, content: {}'.format(
+                    topic, r.code, r.body))
+                return
+            newest = {p['partition']: p['newest_available_offset'] for p in json.loads(r.body.decode('UTF-8'))}
+            for callback in list(self.subscribers.get(topic, ())):
+                callback(newest)
+
+        self.rts[0].fetch(
+            '/event-types/{}/partitions'.format(topic),
+            _on_partitions,
+            endpoint='partitions',
+            method='GET',
+            headers={'Content-Type': 'application/json', 'Accept': 'application/json'},
+        )
+
+
+class PartitionStatsPoller(object):
+    """
+    Periodically fetches newest offsets of partitions, requests are coalesced for connectors sharing host and topic
+    """
+
+    def __init__(self, interval=PARTITION_STATS_INTERVAL):
+        self.interval = interval
+        self._hosts = {}
+
+    def subscribe(self, rt, topic, callback):
+        """
+        Calls callback with newest offsets (partition -> offset) of topic every interval. Requests are made using rt
+        of the first connector subscribed on the host
+        """
+        poller = self._hosts.get(rt.base_url)
+        if poller is None:
+            poller = self._hosts[rt.base_url] = _HostPoller(self.interval)
+            poller.start()
+        poller.rts.append(rt)
+        poller.subscribers.setdefault(topic, []).append(callback)
+
+    def unsubscribe(self, rt, topic, callback):
+        poller = self._hosts.get(rt.base_url)
+        if poller is None or callback not in poller.subscribers.get(topic, ()):
+            return
+        poller.subscribers[topic].remove(callback)
+        poller.rts.remove(rt)
+        if not poller.subscribers[topic]:
+            del poller.subscribers[topic]
+        if not poller.subscribers:
+            poller.stop()
+            del self._hosts[rt.base_url]
+
+
+__POLLER = PartitionStatsPoller()
+
+
+def instance():
+    return __POLLER
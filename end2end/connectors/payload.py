@@ -0,0 +1,97 @@
+import json
+import time
+import uuid
+
+_EID = '\x00eid\x00'
+_OCCURRED_AT = '\x00occurred_at\x00'
+_VALUE = '\x00value\x00'
+_PARTITION = '\x00partition\x00'
+
+
+def parse_sizes(value):
+    """
+    Parses list of payload sizes: list, comma-separated string or range as start:stop:step (stop is included)
+    """
+    if isinstance(value, int):
+        return [value]
+    if isinstance(value, (list, tuple)):
+        return [int(x) for x in value]
+    value = str(value)
+    if ':' in value:
+        start, stop, step = (int(x) for x in value.split(':'))
+        return list(range(start, stop + 1, step))
+    return [int(x) for x in value.split(',') if x.strip()]
+
+
+class EventTemplate(object):
+    """
+    Pre-serialized event. Event (with trash) is serialized once, on render only eid, occurred_at and value are
+    spliced into serialized bytes. If partitioned, partition is spliced into metadata as well (for event types with
+    user_defined partition strategy).
+    """
+
+    def __init__(self, event_type, partitioned=False, **fields):
+        event = {
+            'metadata': {
+                'eid': _EID,
+                'event_type': event_type,
+                'occurred_at': _OCCURRED_AT
+            },
+            'value': _VALUE
+        }
+        if partitioned:
+            event['metadata']['partition'] = _PARTITION
+        event.update(fields)
+        serialized = json.dumps(event)
+        markers = sorted((serialized.index(json.dumps(m)), m) for m in (_EID, _OCCURRED_AT, _VALUE, _PARTITION)
+                         if json.dumps(m) in serialized)
+        self._parts = []
+        self._fields = []
+        pos = 0
+        for idx, marker in markers:
+            prefix = serialized[pos:idx]
+            if marker == _VALUE:
+                pos = idx + len(json.dumps(marker))
+            else:
+                # Quotes are kept in template, eid, timestamp and partition don't need escaping
+                prefix += '"'
+                pos = idx + len(json.dumps(marker)) - 1
+            self._parts.append(prefix.encode('utf-8'))
+            self._fields.append(marker)
+        self._tail = serialized[pos:].encode('utf-8')
+        # eid is generated as base uuid with counter in the last group, that is cheaper than uuid4 for every event
+        self._eid_base = str(uuid.uuid4())[:24]
+        self._eid_counter = 0
+        self._second = None
+        self._second_prefix = None
+
+    def _next_eid(self):
+        self._eid_counter = (self._eid_counter + 1) & 0xffffffffffff
+        return '{}{:012x}'.format(self._eid_base, self._eid_counter)
+
+    def _timestamp(self, now):
+        second = int(now)
+        if second != self._second:
+            self._second = second
+            self._second_prefix = time.strftime('%Y-%m-%dT%H:%M:%S', time.gmtime(second))
+        return '{}.{:06d}+00:00'.format(self._second_prefix, int((now - second) * 1000000))
+
+    def render(self, value, now=None, partition=None):
+        values = {
+            _EID: self._next_eid(),
+            _OCCURRED_AT: self._timestamp(time.time() if now is None else now),
+            _VALUE: json.dumps(value),
+            _PARTITION: partition
+        }
+        result = bytearray()
+        for part, field in zip(self._parts, self._fields):
+            result += part
+            result += values[field].encode('utf-8')
+        result += self._tail
+        return bytes(result)
+
+    def render_batch(self, values, now=None, partitions=None):
+        now = time.time() if now is None else now
+        if partitions is None:
+            return b'[' + b','.join(self.render(v, now) for v in values) + b']'
+        return b'[' + b','.join(self.render(v, now, p) for v, p in zip(values, partitions)) + b']'
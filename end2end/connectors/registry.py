@@ -1,66 +1,124 @@
-import functools
 import logging
 import time
 from functools import partial
 
-from tornado.ioloop import IOLoop
+from tornado.ioloop import IOLoop, PeriodicCallback
 
-from end2end import metric
+from end2end import metric, tracing
 from end2end.connectors import Connector
+from end2end.inflight import TimingWheel
+from end2end.instrumentation import timed
+from end2end.scheduler import RateSchedule
 
 
-def run_once(name):
-    def _tmp(func):
-        def _call(self_, *args, **kwargs):
-            if not hasattr(self_, '_calls'):
-                self_._calls = {}
-            if name not in self_._calls:
-                self_._calls[name] = func(self_, *args, **kwargs)
-            return self_._calls[name]
+SENT = 1
+ASYNC_RECEIVED = 2
+ASYNC_MAX_RECEIVED = 4
+SYNC_RECEIVED = 8
 
-        return _call
+TIMEOUT_TICK = 0.5
 
-    return _tmp
+TIMEOUT_SLOTS = 256
 
-
-def _log_with_warning(message, timeout):
-    if timeout:
-        logging.warning('Timed out for {}'.format(message))
-    else:
-        logging.info(message)
+_PHASES = ((SENT, 'send'), (ASYNC_RECEIVED, 'async'), (ASYNC_MAX_RECEIVED, 'async_max'), (SYNC_RECEIVED, 'sync'))
 
 
 class DataToSend(object):
-    def __init__(self, value: int, connector: Connector):
+    """
+    Message that is tracked till all the receipts are received. Latencies of phases are kept in memory and are
+    written as one trace on completion, only if message is selected by tracer.
+    """
+    __slots__ = ('value', 'connector', 'start_time', 'intended_time', 'sync_used', 'arrivals', 'latencies',
+                 'payload_size', '_expected', '_done', '_timed_out')
+
+    def __init__(self, value: int, connector: Connector, intended_time: float = None, sync_used: bool = False):
         self.value = value
         self.connector = connector
         self.start_time = time.time()
-
-    @run_once('data_sent')
-    def on_data_sent(self, timeout=False):
-        _log_with_warning('Send callback for {}, {}'.format(self.connector.name, self.value), timeout)
-        self.connector.send_metric.on_value(time.time() - self.start_time)
-
-    @run_once('async_received')
-    def on_async_received(self, timeout=False):
-        _log_with_warning('Async callback for {}, {}'.format(self.connector.name, self.value), timeout)
-        self.connector.async_metric.on_value(time.time() - self.start_time)
-
-    @run_once('async_max_received')
-    def on_async_max_received(self, timeout=False):
-        _log_with_warning('Async max callback for {}, {}'.format(self.connector.name, self.value), timeout)
-        self.connector.async_max_metric.on_value(time.time() - self.start_time)
-
-    @run_once('sync_received')
-    def on_sync_received(self, timeout=False):
-        _log_with_warning('Sync callback for {}, {}'.format(self.connector.name, self.value), timeout)
-        self.connector.sync_metric.on_value(time.time() - self.start_time)
-
-    def on_timeout_passed(self, sync_used):
+        # Latencies are measured from the time send was scheduled for (coordinated omission correction)
+        self.intended_time = self.start_time if intended_time is None else intended_time
+        self.sync_used = sync_used
+        self._expected = SENT | ASYNC_RECEIVED | ASYNC_MAX_RECEIVED | (SYNC_RECEIVED if sync_used else 0)
+        self._done = 0
+        self._timed_out = 0
+        self.arrivals = None
+        self.latencies = {}
+        # Set by connectors, that are sending payloads of different sizes
+        self.payload_size = None
+
+    def _complete(self, phase, timeout, received_at):
+        """
+        Marks phase as completed and returns its latency or None if phase was already completed
+        """
+        if self._done & phase:
+            return None
+        self._done |= phase
+        latency = (received_at or time.time()) - self.intended_time
+        self.latencies[phase] = latency
+        if timeout:
+            self._timed_out |= phase
+        if self._done == self._expected:
+            self.connector.untrack(self)
+            self._trace()
+        return latency
+
+    def _trace(self):
+        tracer = tracing.instance()
+        reason = tracer.reason(self.connector.async_metric, self.latencies.get(ASYNC_RECEIVED), self._timed_out)
+        if reason is None:
+            return
+        trace = {
+            'connector': self.connector.name,
+            'value': self.value,
+            'intended_time': self.intended_time,
+            'start_delay': self.start_time - self.intended_time,
+            'timed_out': [name for phase, name in _PHASES if self._timed_out & phase],
+        }
+        trace.update((name, self.latencies[phase]) for phase, name in _PHASES if phase in self.latencies)
+        if self.arrivals:
+            trace['arrivals'] = [None if x is None else x - self.intended_time for x in self.arrivals]
+        tracer.emit(reason, trace)
+
+    @property
+    def sync_pending(self):
+        return self.sync_used and not self._done & SYNC_RECEIVED
+
+    def on_data_sent(self, timeout=False, received_at=None):
+        latency = self._complete(SENT, timeout, received_at)
+        if latency is not None:
+            self.connector.send_metric.on_value(latency)
+
+    def on_arrival(self, receiver, received_at):
+        """
+        Registers arrival of message to receiver, returns False if message already arrived to this receiver
+        """
+        if self.arrivals is None:
+            self.arrivals = [None] * self.connector.receivers
+        if self.arrivals[receiver] is not None:
+            return False
+        self.arrivals[receiver] = received_at
+        return True
+
+    def on_async_received(self, timeout=False, received_at=None):
+        latency = self._complete(ASYNC_RECEIVED, timeout, received_at)
+        if latency is not None:
+            self.connector.async_metric.on_value(latency)
+
+    def on_async_max_received(self, timeout=False, received_at=None):
+        latency = self._complete(ASYNC_MAX_RECEIVED, timeout, received_at)
+        if latency is not None:
+            self.connector.async_max_metric.on_value(latency)
+
+    def on_sync_received(self, timeout=False, received_at=None):
+        latency = self._complete(SYNC_RECEIVED, timeout, received_at)
+        if latency is not None:
+            self.connector.sync_metric.on_value(latency)
+
+    def on_timeout_passed(self):
         self.on_data_sent(True)
         self.on_async_received(True)
         self.on_async_max_received(True)
-        if sync_used:
+        if self.sync_used:
             self.on_sync_received(True)
 
 
@@ -69,38 +127,111 @@ class _Registry(object):
         self._connectors = []
         self.value = int(time.time())
         self.rps = metric.instance().create_call_counter('RPS')
+        self._timeouts = TimingWheel(TIMEOUT_TICK, TIMEOUT_SLOTS, time.time())
+        self._timeouts_checker = None
 
     def items(self):
         return tuple(self._connectors)
 
     def set_items(self, connectors):
+        """
+        Replaces all the connectors, see set_config for applying only changes of configuration
+        """
         for c in self._connectors:
             c.deinitialize()
         self._connectors.clear()
         for c in connectors:
-            self._connectors.append(c)
-            c.initialize(partial(self._register_invocation, c))
+            self._add(c)
+
+    def _add(self, connector):
+        self._connectors.append(connector)
+        connector.initialize(partial(self._register_invocation, connector))
+
+    def set_config(self, config):
+        """
+        Applies configuration of connectors. Only changed connectors are touched: unchanged ones keep their streams
+        and metrics, changes of reconfigurable options are applied in place, others are recreated.
+        """
+        from end2end.connectors.factory import load_connector, validate_connectors
+        validate_connectors(config)
+        current = {c.name: c for c in self._connectors}
+        self._connectors = [c for c in self._connectors if c.name in config and c.config == config[c.name]]
+        for name, spec in config.items():
+            c = current.pop(name, None)
+            if c is not None and c.config == spec:
+                continue
+            if c is not None and c.reconfigure(spec):
+                logging.info('Connector {} is reconfigured in place'.format(name))
+                self._connectors.append(c)
+                if c.schedule is not None:
+                    self._register_invocation(c)
+                continue
+            if c is not None:
+                logging.info('Connector {} is recreated'.format(name))
+                c.deinitialize()
+            else:
+                logging.info('Connector {} is added'.format(name))
+            self._add(load_connector(name, spec))
+        for c in current.values():
+            logging.info('Connector {} is removed'.format(c.name))
+            c.deinitialize()
+        self._update_scheduled_rps()
 
     def _on_connector_called(self):
         pass
 
-    def _register_invocation(self, connector):
-        use_sync_calculator = connector.interval >= 2.
+    @timed('timeouts')
+    def _expire_timeouts(self):
+        for connector, value in self._timeouts.advance(time.time()):
+            data = connector.in_flight.remove(value)
+            if data is not None:
+                data.on_timeout_passed()
+
+    def _update_scheduled_rps(self):
+        self.rps.scheduled = sum(c.send_rpm.scheduled for c in self._connectors)
 
-        def _invoke():
+    def _register_invocation(self, connector):
+        use_sync_calculator = connector.supports_sync and connector.interval >= 2.
+        schedule = RateSchedule(connector.interval, IOLoop.instance().time())
+        # Ticks of previous schedule (if connector was reconfigured) are stopped by this
+        connector.schedule = schedule
+        connector.send_rpm.scheduled = schedule.rate * connector.batch_size
+        self._update_scheduled_rps()
+        if self._timeouts_checker is None:
+            self._timeouts_checker = PeriodicCallback(self._expire_timeouts, TIMEOUT_TICK * 1000)
+            self._timeouts_checker.start()
+
+        def _invoke(intended_time):
+            batch = []
+            for i in range(connector.batch_size):
+                self.value += 1
+                # Sync receive is checked only for the first event in batch
+                data = DataToSend(self.value, connector, intended_time, use_sync_calculator and i == 0)
+                connector.track(data)
+                self._timeouts.schedule(data.start_time + connector.max_wait, (connector, data.value))
+                batch.append(data)
+                self.rps.on_call()
+            connector.schedule_lag_metric.on_value(batch[0].start_time - intended_time)
+            connector.send_and_receive(batch, use_sync_calculator)
+
+        @timed('tick')
+        def _tick():
             if not connector.active:
+                return self._update_scheduled_rps()
+            if connector.schedule is not schedule:
                 return
-            self.value += 1
-
-            data = DataToSend(self.value, connector)
-
-            connector.send_and_receive(data, use_sync_calculator)
-            IOLoop.instance().call_later(connector.interval, _invoke)
-            IOLoop.instance().call_later(connector.max_wait,
-                                         functools.partial(data.on_timeout_passed, use_sync_calculator))
-            self.rps.on_call()
-
-        IOLoop.instance().add_callback(_invoke)
+            loop = IOLoop.instance()
+            now = loop.time()
+            skipped = schedule.skipped
+            wall_clock_offset = time.time() - now
+            for deadline in schedule.due(now):
+                connector.admit(deadline + wall_clock_offset, _invoke)
+            if schedule.skipped != skipped:
+                logging.warning('Skipped {} invocations for {}, loop is too busy'.format(
+                    schedule.skipped - skipped, connector.name))
+            loop.call_at(schedule.next_deadline, _tick)
+
+        IOLoop.instance().add_callback(_tick)
 
 
 __REGISTRY = _Registry()
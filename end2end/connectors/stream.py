@@ -0,0 +1,210 @@
+import calendar
+import json
+import time
+
+STREAM_SEPARATOR = b'\n'
+
+_CURSOR_KEY = b'"cursor"'
+_EVENTS_KEY = b'"events"'
+
+# Nakadi writes cursor in the beginning of the batch, so only line prefix is copied for cursor lookup
+_CURSOR_PREFIX_SIZE = 512
+
+
+class LineFramer(object):
+    """
+    Incremental line framer for nakadi streams. Chunks are appended to a single reusable buffer, complete lines are
+    passed to callback as memoryview slices of this buffer (without copying), tail is kept till next chunk arrives.
+    If marker is set, callback receives flag whether line contains marker, search is made over raw bytes.
+    Memoryview passed to callback is released right after callback returns, so it must not be kept.
+    """
+
+    def __init__(self, on_line, marker=None, separator=STREAM_SEPARATOR):
+        self.on_line = on_line
+        self.marker = marker
+        self.separator = separator
+        self._buffer = bytearray()
+
+    def reset(self):
+        del self._buffer[:]
+
+    def feed(self, chunk):
+        buf = self._buffer
+        # Previous tail doesn't contain separator, no need to scan it again
+        scan_from = max(len(buf) - len(self.separator) + 1, 0)
+        buf += chunk
+        start = 0
+        view = memoryview(buf)
+        try:
+            idx = buf.find(self.separator, scan_from)
+            while idx != -1:
+                if idx > start:
+                    self._emit(buf, view, start, idx)
+                start = idx + len(self.separator)
+                idx = buf.find(self.separator, start)
+        finally:
+            view.release()
+        if start:
+            del buf[:start]
+
+    def _emit(self, buf, view, start, end):
+        line = view[start:end]
+        try:
+            if self.marker is None:
+                self.on_line(line)
+            else:
+                self.on_line(line, buf.find(self.marker, start, end) != -1)
+        finally:
+            line.release()
+
+
+def parse_line(line):
+    return json.loads(str(line, 'utf-8'))
+
+
+def extract_cursor(line):
+    """
+    Extracts cursor from raw batch line without parsing events. Cursor is a flat object, so it is enough to find
+    the first closing brace after "cursor" key. Falls back to full parsing if line has unexpected format.
+    """
+    raw = bytes(line[:_CURSOR_PREFIX_SIZE])
+    start = raw.find(_CURSOR_KEY)
+    if start != -1:
+        obj_start = raw.find(b'{', start)
+        obj_end = raw.find(b'}', obj_start)
+        if obj_start != -1 and obj_end != -1:
+            try:
+                return json.loads(raw[obj_start:obj_end + 1].decode('utf-8'))
+            except ValueError:
+                pass
+    return parse_line(line)['cursor']
+
+
+def is_keep_alive(line):
+    """
+    Checks if batch line has no events. Nakadi writes events right after cursor, so events key is looked up in line
+    prefix first, whole line is searched only for long batches without events in prefix (e.g. with debug info)
+    """
+    if _EVENTS_KEY in bytes(line[:_CURSOR_PREFIX_SIZE]):
+        return False
+    return len(line) <= _CURSOR_PREFIX_SIZE or _EVENTS_KEY not in bytes(line)
+
+
+_SECONDS_CACHE = {}
+
+
+def parse_timestamp(value):
+    """
+    Parses RFC 3339 timestamp (as used by nakadi: 2017-07-14T02:40:00.250Z or 2017-07-14T02:40:00.250+02:00) to
+    epoch seconds. Seconds part is cached, as timestamps of nearby events mostly share it.
+    """
+    prefix = value[:19]
+    seconds = _SECONDS_CACHE.get(prefix)
+    if seconds is None:
+        if len(_SECONDS_CACHE) > 1000:
+            _SECONDS_CACHE.clear()
+        seconds = _SECONDS_CACHE[prefix] = calendar.timegm(time.strptime(prefix, '%Y-%m-%dT%H:%M:%S'))
+    rest = value[19:]
+    fraction = 0.
+    if rest.startswith('.'):
+        end = 1
+        while end < len(rest) and rest[end].isdigit():
+            end += 1
+        fraction = float(rest[:end])
+        rest = rest[end:]
+    if rest and rest not in ('Z', 'z'):
+        sign = -1 if rest[0] == '-' else 1
+        hours, _, minutes = rest[1:].partition(':')
+        seconds -= sign * (int(hours) * 3600 + int(minutes or 0) * 60)
+    return seconds + fraction
+
+
+class Cursors(object):
+    """
+    Cursors indexed by partition. Serialized cursors (for X-nakadi-cursors header) are cached until they change
+    """
+
+    def __init__(self, cursors=()):
+        self._offsets = {c['partition']: c['offset'] for c in cursors}
+        self._serialized = None
+
+    def update(self, cursor):
+        """
+        Updates offset of known partition
+        """
+        partition = cursor['partition']
+        if partition in self._offsets and self._offsets[partition] != cursor['offset']:
+            self._offsets[partition] = cursor['offset']
+            self._serialized = None
+
+    def partitions(self):
+        return list(self._offsets)
+
+    def offset(self, partition):
+        return self._offsets[partition]
+
+    def serialize(self, partition=None):
+        """
+        Returns serialized cursors of all partitions or only of the given one
+        """
+        if partition is not None:
+            return json.dumps([{'partition': partition, 'offset': self._offsets[partition]}])
+        if self._serialized is None:
+            self._serialized = json.dumps([{'partition': k, 'offset': v} for k, v in self._offsets.items()])
+        return self._serialized
+
+    def copy(self):
+        result = Cursors()
+        result._offsets = dict(self._offsets)
+        result._serialized = self._serialized
+        return result
+
+    def __len__(self):
+        return len(self._offsets)
+
+
+BEGIN = 'BEGIN'
+
+
+def offset_position(offset):
+    """
+    Splits nakadi offset into timeline prefix and position: 000000000000000123 -> ('', 123),
+    001-0001-000000000000000123 -> ('001-0001', 123). BEGIN is position before the first event of any timeline
+    """
+    if offset == BEGIN:
+        return None, -1
+    prefix, _, position = offset.rpartition('-')
+    return prefix, int(position)
+
+
+def lag(newest, consumed):
+    """
+    Returns number of events between consumed and newest offsets or None if offsets are from different timelines
+    """
+    newest_prefix, newest_position = offset_position(newest)
+    consumed_prefix, consumed_position = offset_position(consumed)
+    if newest_prefix != consumed_prefix and None not in (newest_prefix, consumed_prefix):
+        return None
+    return max(newest_position - consumed_position, 0)
+
+
+def consumer_lag(newest, receivers):
+    """
+    Calculates lag for newest offsets (partition -> offset) and offsets of receivers (receiver id -> partition ->
+    offset). Returns lag per receiver (sum over its partitions) and per partition (max over receivers)
+    """
+    per_receiver = {}
+    per_partition = {}
+    for receiver_id, offsets in receivers.items():
+        total = None
+        for partition, offset in offsets.items():
+            if partition not in newest:
+                continue
+            value = lag(newest[partition], offset)
+            if value is None:
+                continue
+            total = (total or 0) + value
+            per_partition[partition] = max(per_partition.get(partition, 0), value)
+        if total is not None:
+            per_receiver[receiver_id] = total
+    return per_receiver, per_partition
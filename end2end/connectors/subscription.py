@@ -0,0 +1,176 @@
+import json
+import logging
+import time
+
+from tornado.ioloop import PeriodicCallback
+
+from end2end import metric
+from end2end.connectors.nakadi import NakadiConnector, EventStreamReceiver, STREAM_TIMEOUT
+from end2end.connectors.stream import Cursors, is_keep_alive
+
+STREAM_ID_HEADER = 'x-nakadi-streamid'
+
+
+class SubscriptionStreamReceiver(EventStreamReceiver):
+    """
+    Receiver that is consuming events using subscription. Cursors of received batches are committed in batches:
+    either when commit_batch batches are received or every commit_interval seconds.
+    """
+
+    def __init__(self, connector, receiver_id):
+        super(SubscriptionStreamReceiver, self).__init__(
+            connector.stream_r, connector.topic, Cursors(), connector.instance_id, connector.value_callback,
+            receiver_id, connector.compression, connector.compression_stats)
+        self.connector = connector
+        self.stream_id = None
+        self._uncommitted = {}
+        self._uncommitted_batches = 0
+        self._committed = {}
+        # Whether the batch being processed is keep-alive one (without events)
+        self._keep_alive = False
+        # Offsets of the last received batches, partitions are assigned to receiver by nakadi
+        self._offsets = {}
+        self._commit_in_progress = False
+        self._commit_checker = PeriodicCallback(self._commit, connector.commit_interval * 1000)
+
+    def start(self):
+        self._commit_checker.start()
+        return super(SubscriptionStreamReceiver, self).start()
+
+    def stop(self):
+        self._commit_checker.stop()
+        super(SubscriptionStreamReceiver, self).stop()
+
+    def _connect(self):
+        # Cursors can be committed only within the stream they were received from
+        self.stream_id = None
+        self._uncommitted.clear()
+        self._uncommitted_batches = 0
+        self._offsets.clear()
+        super(SubscriptionStreamReceiver, self)._connect()
+
+    def _stream_url(self):
+        return '/subscriptions/{}/events?batch_limit={}&batch_flush_timeout={}&max_uncommitted_events={}' \
+               '&stream_timeout={}'.format(self.connector.subscription_id, self.connector.batch_limit,
+                                           self.connector.batch_flush_timeout,
+                                           self.connector.max_uncommitted_events, STREAM_TIMEOUT)
+
+    def _stream_headers(self):
+        return {'Accept': 'application/json'}
+
+    def _on_header(self, line):
+        super(SubscriptionStreamReceiver, self)._on_header(line)
+        name, _, value = line.decode('latin1').partition(':')
+        if name.strip().lower() == STREAM_ID_HEADER:
+            self.stream_id = value.strip()
+
+    def _on_line(self, line, has_instance_events):
+        self._keep_alive = not has_instance_events and is_keep_alive(line)
+        super(SubscriptionStreamReceiver, self)._on_line(line, has_instance_events)
+
+    def _on_cursor(self, cursor):
+        partition = cursor['partition']
+        self._offsets[partition] = cursor['offset']
+        if self._keep_alive or self._committed.get(partition) == cursor['offset']:
+            # Keep-alive batch, nothing new to commit, it is not counted towards commit_batch as well
+            return
+        self._uncommitted[partition] = cursor
+        self._uncommitted_batches += 1
+        if self._uncommitted_batches >= self.connector.commit_batch:
+            self._commit()
+
+    def offsets(self):
+        return dict(self._offsets)
+
+    def _commit(self):
+        if not self._uncommitted or self.stream_id is None or self._commit_in_progress:
+            return
+        items = list(self._uncommitted.values())
+        self._uncommitted.clear()
+        self._uncommitted_batches = 0
+        self._commit_in_progress = True
+        start = time.time()
+
+        def _on_committed(r):
+            self._commit_in_progress = False
+            self.connector.commit_status.on_new_status(r.code)
+            if r.code in (200, 204):
+                self.connector.commit_metric.on_value(time.time() - start)
+                for item in items:
+                    self._committed[item['partition']] = item['offset']
+                    self.connector.commit_rps.on_call()
+            else:
+                logging.error('Failed to commit cursors for {}, status code: {}, content: {}'.format(
+                    self.connector.subscription_id, r.code, r.body))
+                for item in items:
+                    self._uncommitted.setdefault(item['partition'], item)
+
+        self.connector.r.fetch(
+            '/subscriptions/{}/cursors'.format(self.connector.subscription_id),
+            _on_committed,
+            endpoint='commit',
+            method='POST',
+            headers={
+                'Content-Type': 'application/json',
+                'X-Nakadi-StreamId': self.stream_id
+            },
+            body=json.dumps({'items': items})
+        )
+
+
+class NakadiSubscriptionConnector(NakadiConnector):
+    supports_sync = False
+
+    def __init__(self, name, **kwargs):
+        super(NakadiSubscriptionConnector, self).__init__(name, **kwargs)
+        self.consumer_group = kwargs.get('consumer_group', 'end2end_{}'.format(name))
+        self.batch_limit = int(kwargs.get('batch_limit', 1))
+        self.batch_flush_timeout = int(kwargs.get('batch_flush_timeout', 30))
+        self.max_uncommitted_events = int(kwargs.get('max_uncommitted_events', 10))
+        # Commit before nakadi stops sending because of uncommitted events limit
+        self.commit_batch = int(kwargs.get('commit_batch', max(self.max_uncommitted_events // 2, 1)))
+        self.commit_interval = float(kwargs.get('commit_interval', 1))
+        self.subscription_id = None
+        # Receivers are sharing subscription, so every event is delivered to only one of them
+        self.expected_receipts = 1
+        self.commit_metric = metric.instance().create_metric('connector.{}.commit'.format(name), 60. / self.interval)
+        self.commit_rps = metric.instance().create_call_counter('connector.{}.commit_rps'.format(name))
+        self.commit_status = metric.instance().create_status_counter('connector.{}.commit_status'.format(name))
+
+    def deinitialize(self):
+        if self.init_callback is None:
+            metric.instance().delete(self.commit_metric)
+            metric.instance().delete(self.commit_rps)
+            metric.instance().delete(self.commit_status)
+        super(NakadiSubscriptionConnector, self).deinitialize()
+
+    def _prepare_consumption(self, callback):
+        def _on_subscription(r):
+            if r.code in (200, 201):
+                self.subscription_id = json.loads(r.body.decode('UTF-8'))['id']
+                logging.info('Using subscription {} for {}'.format(self.subscription_id, self.topic))
+                if self.round_robin:
+                    # Partitions are needed to send probes to every partition in turn
+                    return super(NakadiSubscriptionConnector, self)._prepare_consumption(callback)
+                return callback()
+            else:
+                logging.error('Failed to create subscription for {}. Status code: {}, content: {}'.format(
+                    self.topic, r.code, r.body))
+                return self._prepare_consumption(callback)
+
+        return self.r.fetch(
+            '/subscriptions',
+            _on_subscription,
+            endpoint='subscription',
+            method='POST',
+            headers={'Content-Type': 'application/json', 'Accept': 'application/json'},
+            body=json.dumps({
+                'owning_application': 'end2end_monitor',
+                'event_types': [self.topic],
+                'consumer_group': self.consumer_group,
+                'read_from': 'end'
+            })
+        )
+
+    def _create_receiver(self, receiver_id):
+        return SubscriptionStreamReceiver(self, receiver_id)
@@ -0,0 +1,127 @@
+import math
+import re
+
+from end2end.metric import Metric, CallCounter, StatusCounter, Gauge
+
+CONTENT_TYPE = 'application/openmetrics-text; version=1.0.0; charset=utf-8'
+
+PREFIX = 'end2end_'
+
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1., 2.5, 5., 10., 30., 60.)
+
+_INVALID_CHARS = re.compile('[^a-zA-Z0-9_]')
+
+# Connector metrics, that are indexed by receiver, partition or payload size
+_INDEXED = ('receiver', 'partition', 'size')
+
+
+def _family_and_labels(name):
+    """
+    Converts metric name to family name and labels: connector.<name>.async -> end2end_connector_async{connector=<name>},
+    connector.<name>.size.<size> -> end2end_connector_size{connector=<name>,size=<size>}
+    """
+    parts = name.split('.')
+    labels = ()
+    if parts[0] == 'connector' and len(parts) > 2:
+        labels = (('connector', parts[1]),)
+        parts = [parts[0]] + parts[2:]
+        if len(parts) == 3 and parts[1] in _INDEXED:
+            labels += ((parts[1], parts[2]),)
+            parts = parts[:2]
+    return PREFIX + _INVALID_CHARS.sub('_', '_'.join(parts)).lower(), labels
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _format_labels(labels):
+    if not labels:
+        return ''
+    return '{' + ','.join('{}="{}"'.format(k, _escape(v)) for k, v in labels) + '}'
+
+
+def _format_value(value):
+    if value is None:
+        return 'NaN'
+    if isinstance(value, float) and math.isinf(value):
+        return '+Inf' if value > 0 else '-Inf'
+    return repr(value)
+
+
+def _sample(name, labels, value):
+    return '{}{} {}'.format(name, _format_labels(labels), _format_value(value))
+
+
+def _emas(family, labels, metric):
+    return family + '_ema', 'gauge', [
+        _sample(family + '_ema', labels + (('window', 'm{}'.format(k)),), v.value) for k, v in metric.emas.items()]
+
+
+def _render_metric(metric):
+    family, labels = _family_and_labels(metric.name)
+    if isinstance(metric, CallCounter):
+        return [
+            (family, 'counter', [_sample(family + '_total', labels, metric.calls)]),
+            (family + '_scheduled', 'gauge', [_sample(family + '_scheduled', labels, metric.scheduled)]),
+            _emas(family, labels, metric),
+        ]
+    if isinstance(metric, Metric):
+        h = metric.histogram
+        lines = [_sample(family + '_bucket', labels + (('le', repr(le)),), h.count_le(le)) for le in BUCKETS]
+        lines.append(_sample(family + '_bucket', labels + (('le', '+Inf'),), h.count))
+        lines.append(_sample(family + '_count', labels, h.count))
+        lines.append(_sample(family + '_sum', labels, h.total))
+        return [(family, 'histogram', lines), _emas(family, labels, metric)]
+    if isinstance(metric, StatusCounter):
+        return [(family, 'counter', [
+            _sample(family + '_total', labels + (('status', k),), v) for k, v in sorted(metric.counts.items())])]
+    if isinstance(metric, Gauge):
+        index = metric.name.rsplit('.', 1)[-1]
+        if metric.name.startswith('connector.') and index in _INDEXED:
+            # Gauge of values per index: connector.<name>.lag.receiver -> end2end_connector_lag{receiver=...}
+            family, labels = _family_and_labels(metric.name[:-len(index) - 1])
+            return [(family, 'gauge', [_sample(family, labels + ((index, k),), v)
+                                       for k, v in sorted(metric.dump().items())])]
+        return [(family + '_' + k, 'gauge', [_sample(family + '_' + k, labels, v)])
+                for k, v in sorted(metric.dump().items())]
+    return []
+
+
+class OpenMetricsRenderer(object):
+    """
+    Renders metrics registry in OpenMetrics text format. Rendered lines are cached per metric and are rebuilt only
+    for metrics that changed (version is different) since previous rendering.
+    """
+
+    def __init__(self, registry):
+        self.registry = registry
+        self._cache = {}
+
+    def _render_cached(self, name, metric):
+        cached = self._cache.get(name)
+        if metric.volatile or cached is None or cached[0] is not metric or cached[1] != metric.version:
+            cached = metric, metric.version, _render_metric(metric)
+            self._cache[name] = cached
+        return cached[2]
+
+    def render(self):
+        families = {}
+        order = []
+        items = self.registry.items()
+        for name, metric in items:
+            for family, type_, lines in self._render_cached(name, metric):
+                if family not in families:
+                    families[family] = type_, []
+                    order.append(family)
+                families[family][1].extend(lines)
+        if len(self._cache) > len(items):
+            names = set(x[0] for x in items)
+            self._cache = {k: v for k, v in self._cache.items() if k in names}
+        result = []
+        for family in sorted(order):
+            type_, lines = families[family]
+            result.append('# TYPE {} {}'.format(family, type_))
+            result.extend(lines)
+        result.append('# EOF\n')
+        return '\n'.join(result)
@@ -0,0 +1,313 @@
+import json
+import logging
+import uuid
+from datetime import timedelta
+
+import click
+from tornado import gen
+from tornado.ioloop import IOLoop
+from tornado.iostream import StreamClosedError
+from tornado.locks import Condition
+from tornado.web import RequestHandler, Application, url
+
+from end2end.connectors.compression import decompressor
+from end2end.fake.store import EventTypeStore, format_batch, parse_offset
+
+
+class FakeNakadi(object):
+    """
+    In-process stand-in for nakadi, implementing endpoints used by connectors. Latency could be injected for
+    publishing (publish_latency - delay before response) and for consumption (stream_latency - delay before event
+    becomes visible to consumers).
+    """
+
+    def __init__(self, partitions=1, publish_latency=0., stream_latency=0., fanout=0):
+        self.partitions = partitions
+        self.publish_latency = publish_latency
+        self.stream_latency = stream_latency
+        self.fanout = fanout
+        self.event_types = {}
+        self.subscriptions = {}
+        self.new_events = Condition()
+
+    def create_event_type(self, name, partition_strategy='random'):
+        if name not in self.event_types:
+            self.event_types[name] = EventTypeStore(name, self.partitions, partition_strategy=partition_strategy)
+        return self.event_types[name]
+
+    def create_subscription(self, event_type, consumer_group, read_from='end'):
+        """
+        Returns subscription of consumer group to event type and whether it was created
+        """
+        for subscription in self.subscriptions.values():
+            if (subscription.event_type, subscription.consumer_group) == (event_type, consumer_group):
+                return subscription, False
+        partitions = self.event_types[event_type].partitions
+        committed = {p.name: p.newest if read_from == 'end' else p.base - 1 for p in partitions}
+        subscription = FakeSubscription(str(uuid.uuid4()), event_type, consumer_group, committed)
+        self.subscriptions[subscription.id] = subscription
+        return subscription, True
+
+    def publish(self, name, events):
+        def _publish():
+            self.event_types[name].publish(events, self.fanout)
+            self.new_events.notify_all()
+
+        if self.stream_latency:
+            IOLoop.instance().call_later(self.stream_latency, _publish)
+        else:
+            _publish()
+
+
+class FakeSubscription(object):
+    """
+    Subscription of consumer group to one event type. Every partition is assigned to one stream at most, partitions
+    are not rebalanced when new stream is connected
+    """
+
+    def __init__(self, id_, event_type, consumer_group, committed):
+        self.id = id_
+        self.event_type = event_type
+        self.consumer_group = consumer_group
+        # Partition -> index of the last committed event
+        self.committed = committed
+        # Stream id -> partitions assigned to the stream
+        self.streams = {}
+
+    def free_partitions(self):
+        assigned = set(p for partitions in self.streams.values() for p in partitions)
+        return sorted(p for p in self.committed if p not in assigned)
+
+    def commit(self, partition, idx):
+        self.committed[partition] = max(self.committed[partition], idx)
+
+
+class _Handler(RequestHandler):
+    def initialize(self, nakadi):
+        self.nakadi = nakadi
+
+    def _event_type(self, name):
+        store = self.nakadi.event_types.get(name)
+        if store is None:
+            self.set_status(404)
+            self.write({'title': 'Not Found', 'status': 404, 'detail': 'EventType "{}" does not exist.'.format(name)})
+        return store
+
+    def _subscription(self, id_):
+        subscription = self.nakadi.subscriptions.get(id_)
+        if subscription is None:
+            self.set_status(404)
+            self.write({'title': 'Not Found', 'status': 404,
+                        'detail': 'Subscription with id "{}" does not exist'.format(id_)})
+        return subscription
+
+
+class EventTypesHandler(_Handler):
+    def post(self):
+        description = json.loads(self.request.body.decode('utf-8'))
+        self.nakadi.create_event_type(description['name'], description.get('partition_strategy', 'random'))
+        self.set_status(201)
+
+
+class EventTypeHandler(_Handler):
+    def get(self, name):
+        store = self._event_type(name)
+        if store:
+            self.write({'name': name, 'partition_strategy': store.partition_strategy})
+
+
+class PartitionsHandler(_Handler):
+    def get(self, name):
+        store = self._event_type(name)
+        if store:
+            self.set_header('Content-Type', 'application/json')
+            self.write(json.dumps(store.stats()))
+
+
+class _StreamHandler(_Handler):
+    def initialize(self, nakadi):
+        super(_StreamHandler, self).initialize(nakadi)
+        self._closed = False
+
+    def on_connection_close(self):
+        self._closed = True
+        self.nakadi.new_events.notify_all()
+
+    @gen.coroutine
+    def _stream(self, store, positions, window=None, **cursor):
+        """
+        Streams events after positions (partition -> index of the last sent event) according to request arguments.
+        window returns number of events, that could be sent at the moment. Extra cursor fields are added to cursors
+        """
+        batch_limit = int(self.get_argument('batch_limit', 1))
+        stream_limit = int(self.get_argument('stream_limit', 0))
+        stream_timeout = float(self.get_argument('stream_timeout', 0))
+        flush_timeout = float(self.get_argument('batch_flush_timeout', 30))
+        loop = IOLoop.instance()
+        deadline = loop.time() + stream_timeout if stream_timeout else None
+        last_flush = loop.time()
+        sent = 0
+        self.set_header('Content-Type', 'application/x-json-stream')
+        try:
+            while not self._closed:
+                wrote = False
+                for partition, after in positions.items():
+                    limit = min(batch_limit, stream_limit - sent) if stream_limit else batch_limit
+                    if window:
+                        limit = min(limit, window())
+                    events, last = store.read(partition, after, limit)
+                    if events:
+                        self.write(format_batch(partition, last, events, **cursor))
+                        positions[partition] = last
+                        sent += len(events)
+                        wrote = True
+                    if stream_limit and sent >= stream_limit:
+                        break
+                now = loop.time()
+                if not wrote and now - last_flush >= flush_timeout:
+                    for partition, after in positions.items():
+                        self.write(format_batch(partition, after, **cursor))
+                    wrote = True
+                if wrote:
+                    yield self.flush()
+                    last_flush = now
+                if (stream_limit and sent >= stream_limit) or (deadline and now >= deadline):
+                    break
+                if not wrote:
+                    wait_until = last_flush + flush_timeout
+                    if deadline:
+                        wait_until = min(wait_until, deadline)
+                    yield self.nakadi.new_events.wait(timeout=timedelta(seconds=max(wait_until - now, 0)))
+        except StreamClosedError:
+            return
+        if not self._closed:
+            self.finish()
+
+
+class EventsHandler(_StreamHandler):
+    @gen.coroutine
+    def post(self, name):
+        if not self._event_type(name):
+            return
+        body = self.request.body
+        encoding = self.request.headers.get('Content-Encoding')
+        if encoding:
+            decompress = decompressor(encoding)
+            if decompress is None:
+                self.set_status(415)
+                return self.write({'title': 'Unsupported Media Type', 'status': 415})
+            body = decompress(body)
+        events = json.loads(body.decode('utf-8'))
+        if self.nakadi.publish_latency:
+            yield gen.sleep(self.nakadi.publish_latency)
+        self.nakadi.publish(name, events)
+
+    @gen.coroutine
+    def get(self, name):
+        store = self._event_type(name)
+        if not store:
+            return
+        cursors_header = self.request.headers.get('X-nakadi-cursors')
+        if cursors_header:
+            positions = {c['partition']: parse_offset(c['offset']) for c in json.loads(cursors_header)}
+        else:
+            positions = {p.name: p.newest for p in store.partitions}
+        yield self._stream(store, positions)
+
+
+class SubscriptionsHandler(_Handler):
+    def post(self):
+        description = json.loads(self.request.body.decode('utf-8'))
+        missing = [x for x in description['event_types'] if x not in self.nakadi.event_types]
+        if missing:
+            self.set_status(422)
+            return self.write({'title': 'Unprocessable Entity', 'status': 422,
+                               'detail': 'Failed to create subscription, event type(s) not found: {}'.format(
+                                   ', '.join(missing))})
+        # Only one event type per subscription is supported
+        subscription, created = self.nakadi.create_subscription(
+            description['event_types'][0], description.get('consumer_group', 'default'),
+            description.get('read_from', 'end'))
+        self.set_status(201 if created else 200)
+        self.write({
+            'id': subscription.id,
+            'owning_application': description.get('owning_application'),
+            'event_types': [subscription.event_type],
+            'consumer_group': subscription.consumer_group,
+        })
+
+
+class SubscriptionEventsHandler(_StreamHandler):
+    @gen.coroutine
+    def get(self, id_):
+        subscription = self._subscription(id_)
+        if not subscription:
+            return
+        partitions = subscription.free_partitions()
+        if not partitions:
+            self.set_status(409)
+            return self.write({'title': 'Conflict', 'status': 409, 'detail': 'No free slots for streaming available.'})
+        stream_id = str(uuid.uuid4())
+        subscription.streams[stream_id] = partitions
+        positions = {p: subscription.committed[p] for p in partitions}
+        max_uncommitted = int(self.get_argument('max_uncommitted_events', 10))
+
+        def _window():
+            return max_uncommitted - sum(max(positions[p] - subscription.committed[p], 0) for p in positions)
+
+        self.set_header('X-Nakadi-StreamId', stream_id)
+        try:
+            yield self._stream(self.nakadi.event_types[subscription.event_type], positions, _window,
+                               event_type=subscription.event_type, cursor_token=stream_id)
+        finally:
+            del subscription.streams[stream_id]
+
+
+class SubscriptionCursorsHandler(_Handler):
+    def post(self, id_):
+        subscription = self._subscription(id_)
+        if not subscription:
+            return
+        if self.request.headers.get('X-Nakadi-StreamId') not in subscription.streams:
+            self.set_status(422)
+            return self.write({'title': 'Unprocessable Entity', 'status': 422,
+                               'detail': 'Session with stream id not found'})
+        for cursor in json.loads(self.request.body.decode('utf-8'))['items']:
+            subscription.commit(cursor['partition'], parse_offset(cursor['offset']))
+        # Streams, that have reached max_uncommitted_events, could continue
+        self.nakadi.new_events.notify_all()
+        self.set_status(204)
+
+
+def create_application(nakadi):
+    return Application([
+        url(r'/event-types', EventTypesHandler, dict(nakadi=nakadi)),
+        url(r'/event-types/([^/]+)', EventTypeHandler, dict(nakadi=nakadi)),
+        url(r'/event-types/([^/]+)/partitions', PartitionsHandler, dict(nakadi=nakadi)),
+        url(r'/event-types/([^/]+)/events', EventsHandler, dict(nakadi=nakadi)),
+        url(r'/subscriptions', SubscriptionsHandler, dict(nakadi=nakadi)),
+        url(r'/subscriptions/([^/]+)/events', SubscriptionEventsHandler, dict(nakadi=nakadi)),
+        url(r'/subscriptions/([^/]+)/cursors', SubscriptionCursorsHandler, dict(nakadi=nakadi)),
+    ])
+
+
+def run(port, partitions=1, publish_latency=0., stream_latency=0., fanout=0):
+    nakadi = FakeNakadi(partitions, publish_latency, stream_latency, fanout)
+    create_application(nakadi).listen(port, address='127.0.0.1')
+    logging.info('Fake nakadi is listening on port {}'.format(port))
+    IOLoop.instance().start()
+
+
+@click.command()
+@click.option('--port', type=int, default=8080, help='Port to listen on')
+@click.option('--partitions', type=int, default=1, help='Number of partitions for every event type')
+@click.option('--publish-latency', type=float, default=0., help='Delay (seconds) before responding to publishing')
+@click.option('--stream-latency', type=float, default=0., help='Delay (seconds) before event becomes visible')
+@click.option('--fanout', type=int, default=0, help='Number of foreign events stored for every published one')
+def start(port, partitions, publish_latency, stream_latency, fanout):
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s\t%(levelname)s\t%(message)s')
+    run(port, partitions, publish_latency, stream_latency, fanout)
+
+
+if __name__ == '__main__':
+    start()
@@ -0,0 +1,109 @@
+import json
+import time
+
+BEGIN = 'BEGIN'
+
+FANOUT_INSTANCE_ID = 'fanout'
+
+
+def format_offset(idx):
+    return BEGIN if idx < 0 else '{:018d}'.format(idx)
+
+
+def parse_offset(offset):
+    return -1 if offset == BEGIN else int(offset)
+
+
+def format_timestamp(now):
+    return time.strftime('%Y-%m-%dT%H:%M:%S', time.gmtime(now)) + '.{:03d}Z'.format(int((now % 1) * 1000))
+
+
+def format_batch(partition, idx, events=None, **extra):
+    """
+    Formats stream batch line. If events is None, keep-alive batch (without events) is formatted. Extra fields are
+    added to cursor (subscription cursors also contain event_type and cursor_token)
+    """
+    cursor = json.dumps(dict(extra, partition=partition, offset=format_offset(idx))).encode('utf-8')
+    if events is None:
+        return b'{"cursor":' + cursor + b'}\n'
+    return b'{"cursor":' + cursor + b',"events":[' + b','.join(events) + b']}\n'
+
+
+class _Partition(object):
+    def __init__(self, name):
+        self.name = name
+        # Offset of the first event in events list
+        self.base = 0
+        self.events = []
+
+    @property
+    def newest(self):
+        return self.base + len(self.events) - 1
+
+    def append(self, event, retention):
+        self.events.append(event)
+        if len(self.events) > retention:
+            drop = len(self.events) // 2
+            del self.events[:drop]
+            self.base += drop
+
+    def read(self, after, limit):
+        start = max(after + 1, self.base)
+        events = self.events[start - self.base:start - self.base + limit]
+        return events, start + len(events) - 1
+
+
+class EventTypeStore(object):
+    """
+    In-memory storage of events of one event type. Events are distributed over partitions in round-robin manner (or
+    by metadata.partition for user_defined partition strategy) and enriched with metadata the same way nakadi does it.
+    Only last retention events are kept in every partition.
+    """
+
+    def __init__(self, name, partitions=1, retention=100000, partition_strategy='random'):
+        self.name = name
+        self.partition_strategy = partition_strategy
+        self.retention = retention
+        self.partitions = [_Partition(str(i)) for i in range(partitions)]
+        self._next = 0
+
+    def partition(self, name):
+        return self.partitions[int(name)]
+
+    def stats(self):
+        return [{
+            'partition': p.name,
+            'oldest_available_offset': format_offset(p.base),
+            'newest_available_offset': format_offset(p.newest)
+        } for p in self.partitions]
+
+    def publish(self, events, fanout=0, now=None):
+        """
+        Stores events, for every event fanout more events of other instance are stored to simulate traffic
+        """
+        now = time.time() if now is None else now
+        received_at = format_timestamp(now)
+        for event in events:
+            self._store(event, received_at)
+            for i in range(fanout):
+                foreign = dict(event)
+                foreign['metadata'] = dict(event.get('metadata', {}))
+                foreign['instance_id'] = FANOUT_INSTANCE_ID
+                self._store(foreign, received_at)
+
+    def _store(self, event, received_at):
+        metadata = event.setdefault('metadata', {})
+        if self.partition_strategy == 'user_defined' and 'partition' in metadata:
+            partition = self.partition(metadata['partition'])
+        else:
+            partition = self.partitions[self._next % len(self.partitions)]
+            self._next += 1
+        metadata['received_at'] = received_at
+        metadata['partition'] = partition.name
+        partition.append(json.dumps(event).encode('utf-8'), self.retention)
+
+    def read(self, partition, after, limit):
+        """
+        Returns events (serialized) of partition after offset index after and index of last returned event
+        """
+        return self.partition(partition).read(after, limit)
@@ -0,0 +1,52 @@
+import time
+
+from tornado.ioloop import IOLoop
+from tornado.testing import AsyncHTTPTestCase
+
+from end2end import security
+from end2end.fake.server import FakeNakadi, create_application
+
+
+class FakeNakadiTestCase(AsyncHTTPTestCase):
+    """
+    Test case with fake nakadi listening on local port. Connectors and receivers are using IOLoop.instance(), so
+    fake nakadi is run on it as well.
+    """
+    partitions = 1
+
+    def get_new_ioloop(self):
+        return IOLoop.instance()
+
+    def get_app(self):
+        self.nakadi = FakeNakadi(self.partitions)
+        return create_application(self.nakadi)
+
+    def setUp(self):
+        super(FakeNakadiTestCase, self).setUp()
+        security.use_static_token('test')
+
+    def host(self):
+        return 'http://127.0.0.1:{}'.format(self.get_http_port())
+
+    def publish(self, topic, *events):
+        self.nakadi.publish(topic, [dict(e, metadata={'eid': str(i), 'occurred_at': '2017-07-14T02:40:00Z'})
+                                    for i, e in enumerate(events)])
+
+    def wait_for(self, condition, timeout=5.):
+        """
+        Runs IOLoop till condition is true, fails if it is not true in timeout seconds
+        """
+        deadline = time.time() + timeout
+
+        def _check():
+            if condition() or time.time() > deadline:
+                return self.stop()
+            self.io_loop.call_later(0.01, _check)
+
+        self.io_loop.add_callback(_check)
+        self.wait(timeout=timeout + 1)
+        self.assertTrue(condition())
+
+    def run_for(self, seconds):
+        self.io_loop.call_later(seconds, self.stop)
+        self.wait(timeout=seconds + 1)
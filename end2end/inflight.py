@@ -0,0 +1,103 @@
+import math
+import sys
+
+
+class InFlightTable(object):
+    """
+    Table of messages that are waiting for receipts. Messages are stored in slots (parallel arrays), slots of
+    completed messages are reused, value is mapped to slot using index.
+    """
+
+    def __init__(self):
+        self._index = {}
+        self._data = []
+        self._pending = []
+        self._free = []
+
+    def add(self, value, data, pending):
+        if self._free:
+            slot = self._free.pop()
+            self._data[slot] = data
+            self._pending[slot] = pending
+        else:
+            slot = len(self._data)
+            self._data.append(data)
+            self._pending.append(pending)
+        self._index[value] = slot
+        return slot
+
+    def get(self, value):
+        slot = self._index.get(value)
+        return None if slot is None else self._data[slot]
+
+    def decrement(self, value):
+        """
+        Decrements number of pending receipts for value, returns new number or None if value is not in table
+        """
+        slot = self._index.get(value)
+        if slot is None:
+            return None
+        self._pending[slot] -= 1
+        return self._pending[slot]
+
+    def remove(self, value):
+        slot = self._index.pop(value, None)
+        if slot is None:
+            return None
+        data = self._data[slot]
+        self._data[slot] = None
+        self._free.append(slot)
+        return data
+
+    def __len__(self):
+        return len(self._index)
+
+    def __contains__(self, value):
+        return value in self._index
+
+    def memory(self):
+        """
+        Approximate memory (bytes) used by table, including stored objects
+        """
+        result = sum(sys.getsizeof(x) for x in (self._index, self._data, self._pending, self._free))
+        if self._index:
+            result += len(self._index) * sys.getsizeof(self._data[next(iter(self._index.values()))])
+        return result
+
+
+class TimingWheel(object):
+    """
+    Hashed timing wheel. Item is placed to slot (deadline tick modulo number of slots), on advance only slots for
+    passed ticks are checked, so expiration is made in batches. Items are not cancelled, owner should ignore expired
+    items that are already completed.
+    """
+
+    def __init__(self, tick, slots, start):
+        self.tick = float(tick)
+        self._slots = [[] for _ in range(slots)]
+        self._current = int(math.floor(start / self.tick))
+        self.size = 0
+
+    def schedule(self, deadline, item):
+        deadline_tick = max(int(math.ceil(deadline / self.tick)), self._current + 1)
+        self._slots[deadline_tick % len(self._slots)].append((deadline_tick, item))
+        self.size += 1
+
+    def advance(self, now):
+        """
+        Returns list of items with deadline not later than now
+        """
+        target = int(math.floor(now / self.tick))
+        expired = []
+        for t in range(self._current + 1, min(target, self._current + len(self._slots)) + 1):
+            idx = t % len(self._slots)
+            slot = self._slots[idx]
+            if not slot:
+                continue
+            left = [x for x in slot if x[0] > target]
+            if len(left) != len(slot):
+                expired.extend(x[1] for x in slot if x[0] <= target)
+                self._slots[idx] = left
+        self._current = max(self._current, target)
+        self.size -= len(expired)
+        return expired
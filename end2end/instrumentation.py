@@ -0,0 +1,71 @@
+import functools
+import time
+
+from tornado.ioloop import IOLoop
+
+from end2end import metric
+
+LAG_PROBE_INTERVAL = 0.5
+
+
+class LoopLagProbe(object):
+    """
+    Measures event loop lag: difference between the time probe was scheduled for and the time it was called
+    """
+
+    def __init__(self, interval=LAG_PROBE_INTERVAL):
+        self.interval = interval
+        self.metric = metric.instance().create_metric('loop.lag', 60. / interval)
+        self._expected = None
+
+    def start(self):
+        self._schedule()
+        return self
+
+    def _schedule(self):
+        self._expected = IOLoop.instance().time() + self.interval
+        IOLoop.instance().call_at(self._expected, self._on_probe)
+
+    def _on_probe(self):
+        self.metric.on_value(max(IOLoop.instance().time() - self._expected, 0.))
+        self._schedule()
+
+
+_METRICS = {}
+
+
+def _metric(name):
+    m = _METRICS.get(name)
+    if m is None:
+        m = _METRICS[name] = metric.instance().create_metric('loop.{}'.format(name), 60.)
+    return m
+
+
+def timed(name):
+    """
+    Decorator, that reports execution time of handler as loop.handler.<name> metric
+    """
+
+    def _decorator(func):
+        @functools.wraps(func)
+        def _wrapper(*args, **kwargs):
+            started = time.time()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                _metric('handler.{}'.format(name)).on_value(time.time() - started)
+
+        return _wrapper
+
+    return _decorator
+
+
+def on_response(response):
+    """
+    Returns the time response was completed by http client and reports delay between completion and the time
+    callback was called as loop.callback_delay metric
+    """
+    completed_at = response.request.start_time + (response.time_info or {}).get('queue', 0.) + \
+        (response.request_time or 0.)
+    _metric('callback_delay').on_value(max(time.time() - completed_at, 0.))
+    return completed_at
@@ -1,34 +1,63 @@
+import atexit
 import logging
+import os
+import queue
+from logging.handlers import QueueHandler, QueueListener
 
 import yaml
 import click
 from tornado.ioloop import IOLoop
 
 from end2end.connectors import registry
-from end2end.connectors.factory import load_connectors
+from end2end.connectors.factory import validate_connectors
+from end2end.instrumentation import LoopLagProbe
 from end2end.server import start_http_server
+from end2end.supervisor import Supervisor
 from end2end import security
 
 
+def configure_logging():
+    """
+    Log records are put to queue and written by background thread, so logging I/O is not made on IOLoop
+    """
+    handler = logging.StreamHandler()
+    handler.setFormatter(logging.Formatter('%(asctime)s\t%(process)d\t%(levelname)s\t%(message)s'))
+    records = queue.Queue()
+    listener = QueueListener(records, handler)
+    root = logging.getLogger()
+    root.setLevel(os.getenv('LOG_LEVEL', 'INFO'))
+    root.addHandler(QueueHandler(records))
+    logging.getLogger('tornado.curl_httpclient').setLevel(logging.WARN)
+    listener.start()
+    atexit.register(listener.stop)
+
+
 @click.command()
 @click.option('--config', help='Configuration file name')
 @click.option('--port', help='Port to listen on')
 @click.option('--token', help='Token to use. By default berry token is used')
-def start(config, port, token):
-    logging.basicConfig(level=logging.DEBUG, format='%(asctime)s\t%(levelname)s\t%(message)s')
-    logging.getLogger('tornado.curl_httpclient').setLevel(logging.WARN)
+@click.option('--workers', type=int, default=0,
+              help='Number of worker processes to run connectors in. By default connectors are run in main process')
+def start(config, port, token, workers):
+    configure_logging()
     logging.info('Reading configuration from {}'.format(config))
     with open(config, 'r') as f:
         items = yaml.load(f)
-        connectors = load_connectors(items.get('connectors', {}))
-    if not connectors:
+    if not items.get('connectors'):
         raise Exception('No connectors information found in {}'.format(config))
+    if workers > 0:
+        supervisor = Supervisor(workers, token)
+        supervisor.start(items['connectors'])
+        start_http_server(port, supervisor)
+        return IOLoop.instance().start()
+    validate_connectors(items['connectors'])
     if token:
         security.use_static_token(token)
     else:
         security.use_berry_token('end2end_nakadi')
     start_http_server(port)
-    registry.instance().set_items(connectors)
+    LoopLagProbe().start()
+    registry.instance().set_config(items['connectors'])
     IOLoop.instance().start()
 
 
@@ -1,7 +1,9 @@
+import copy
 import math
 
 import time
 import os
+from array import array
 
 
 class EMA(object):
@@ -16,51 +18,380 @@ class EMA(object):
             self.value = value * self.alfa + (1 - self.alfa) * self.value
 
 
-class Percentile(object):
-    def __init__(self, sample_size):
-        self.sample_size = sample_size
-        self.sample = []
-        self.p95 = None
-        self.p98 = None
-        self.p99 = None
+DEFAULT_RELATIVE_ERROR = float(os.getenv('PERCENTILE_RELATIVE_ERROR', 0.01))
 
-    def add(self, value):
-        self.sample.append(value)
-        size = len(self.sample)
-        if size == self.sample_size:
-            sorted_sample = sorted(self.sample);
-            self.p95 = sorted_sample[int(math.ceil((size * 95) / 100)) - 1]
-            self.p98 = sorted_sample[int(math.ceil((size * 98) / 100)) - 1]
-            self.p99 = sorted_sample[int(math.ceil((size * 99) / 100)) - 1]
-            del self.sample[0]
+DEFAULT_SAMPLE_SIZE = int(os.getenv('PERCENTILE_SAMPLE_SIZE', 1000))
+
+REPORTED_PERCENTILES = (50, 90, 95, 98, 99, 99.9)
+
+
+class Histogram(object):
+    """
+    Log-bucketed histogram (DDSketch-like). Every value is stored in the bucket ceil(log(value, gamma)), so any
+    quantile is returned with relative error not greater than relative_error. Insert is O(1), memory is bounded by
+    max_buckets (lowest buckets are collapsed when limit is reached). Histograms with the same relative error could
+    be merged.
+    """
+    MIN_VALUE = 1e-9
+
+    def __init__(self, relative_error=DEFAULT_RELATIVE_ERROR, max_buckets=2048):
+        self.relative_error = relative_error
+        self.gamma = (1. + relative_error) / (1. - relative_error)
+        self._log_gamma = math.log(self.gamma)
+        self.max_buckets = max_buckets
+        self.buckets = {}
+        self.zero_count = 0
+        self.count = 0
+        self.total = 0.
+        self.min = None
+        self.max = None
+
+    def _key(self, value):
+        return int(math.ceil(math.log(value) / self._log_gamma))
+
+    def _bucket_value(self, key):
+        return 2. * math.pow(self.gamma, key) / (self.gamma + 1.)
+
+    def add(self, value, count=1):
+        if value < self.MIN_VALUE:
+            self.zero_count += count
+        else:
+            key = self._key(value)
+            self.buckets[key] = self.buckets.get(key, 0) + count
+            if len(self.buckets) > self.max_buckets:
+                self._collapse()
+        self.count += count
+        self.total += value * count
+        if self.min is None or value < self.min:
+            self.min = value
+        if self.max is None or value > self.max:
+            self.max = value
+
+    def _collapse(self):
+        keys = sorted(self.buckets.keys())
+        target = keys[len(keys) - self.max_buckets]
+        for k in keys[:len(keys) - self.max_buckets]:
+            self.buckets[target] += self.buckets.pop(k)
+
+    def merge(self, other):
+        if other.gamma != self.gamma:
+            raise ValueError('Can not merge histograms with different relative error ({} and {})'.format(
+                self.relative_error, other.relative_error))
+        for k, v in other.buckets.items():
+            self.buckets[k] = self.buckets.get(k, 0) + v
+        if len(self.buckets) > self.max_buckets:
+            self._collapse()
+        self.zero_count += other.zero_count
+        self.count += other.count
+        self.total += other.total
+        if other.min is not None and (self.min is None or other.min < self.min):
+            self.min = other.min
+        if other.max is not None and (self.max is None or other.max > self.max):
+            self.max = other.max
+        return self
+
+    def difference(self, earlier):
+        """
+        Returns histogram of values, that were added after earlier copy of this histogram was made. Min and max are
+        not known for difference, so they are taken from this histogram.
+        """
+        result = Histogram(self.relative_error, self.max_buckets)
+        for k, v in self.buckets.items():
+            v -= earlier.buckets.get(k, 0)
+            if v > 0:
+                result.buckets[k] = v
+        result.zero_count = self.zero_count - earlier.zero_count
+        result.count = self.count - earlier.count
+        result.total = self.total - earlier.total
+        if result.count:
+            result.min, result.max = self.min, self.max
+        return result
+
+    def quantile(self, q):
+        """
+        Returns value for quantile q (0 <= q <= 1) or None if histogram is empty
+        """
+        if self.count == 0:
+            return None
+        rank = int(math.ceil(q * self.count))
+        if rank <= self.zero_count:
+            return 0. if self.zero_count else self.min
+        seen = self.zero_count
+        for key in sorted(self.buckets.keys()):
+            seen += self.buckets[key]
+            if seen >= rank:
+                return min(max(self._bucket_value(key), self.min), self.max)
+        return self.max
+
+    def percentile(self, p):
+        return self.quantile(p / 100.)
+
+    def count_le(self, value):
+        """
+        Returns (approximate) number of values that are less or equal to value
+        """
+        if value < self.MIN_VALUE:
+            return self.zero_count
+        key = self._key(value)
+        return self.zero_count + sum(v for k, v in self.buckets.items() if k <= key)
+
+
+class Percentile(object):
+    """
+    Percentiles over (approximately) last sample_size values. Values are collected into a histogram, that is rotated
+    every sample_size values, so quantiles are calculated over last sample_size..2*sample_size values.
+    """
+
+    def __init__(self, sample_size=DEFAULT_SAMPLE_SIZE, relative_error=DEFAULT_RELATIVE_ERROR):
+        self.sample_size = int(sample_size)
+        self.relative_error = relative_error
+        self._current = Histogram(relative_error)
+        self._previous = None
+
+    def add(self, value, count=1):
+        self._current.add(value, count)
+        if self._current.count >= self.sample_size:
+            self._previous = self._current
+            self._current = Histogram(self.relative_error)
+
+    def merge(self, other):
+        if other._previous is not None:
+            if self._previous is None:
+                self._previous = Histogram(self.relative_error)
+            self._previous.merge(other._previous)
+        self._current.merge(other._current)
+        return self
+
+    def histogram(self):
+        result = Histogram(self.relative_error)
+        if self._previous is not None:
+            result.merge(self._previous)
+        return result.merge(self._current)
+
+    def percentile(self, p):
+        return self.histogram().percentile(p)
+
+    def percentiles(self, ps=REPORTED_PERCENTILES):
+        h = self.histogram()
+        return {p: h.percentile(p) for p in ps}
+
+    @property
+    def p95(self):
+        return self.percentile(95)
+
+    @property
+    def p98(self):
+        return self.percentile(98)
+
+    @property
+    def p99(self):
+        return self.percentile(99)
+
+
+def _parse_levels(value):
+    return tuple(tuple(int(x) for x in level.split(':')) for level in value.split(',') if level)
+
+
+# Levels of history as step (seconds) and number of slots, every level is rolled into the next one. Every slot takes
+# 80 bytes, so history with default levels takes about 160 KB per metric
+HISTORY_LEVELS = _parse_levels(os.getenv('HISTORY_LEVELS', '1:600,60:1440'))
+
+HISTORY_RELATIVE_ERROR = float(os.getenv('HISTORY_RELATIVE_ERROR', 0.02))
+
+
+class _HistoryLevel(object):
+    """
+    Ring of fixed size time buckets. Closed buckets are kept as summary (count, sum, max and percentiles) in arrays,
+    histogram is kept only for the bucket that is currently filled.
+    """
+
+    def __init__(self, step, slots, relative_error):
+        self.step = step
+        self.slots = slots
+        self.relative_error = relative_error
+        self.times = array('q', [-1]) * slots
+        self.counts = array('q', [0]) * slots
+        self.sums = array('d', [0.]) * slots
+        self.maxs = array('d', [0.]) * slots
+        self.percentiles = {p: array('d', [0.]) * slots for p in REPORTED_PERCENTILES}
+        self.current = None
+        self.live = Histogram(relative_error)
+
+    def store(self):
+        idx = (self.current // self.step) % self.slots
+        h = self.live
+        self.times[idx] = self.current
+        self.counts[idx] = h.count
+        self.sums[idx] = h.total
+        self.maxs[idx] = h.max
+        for p, values in self.percentiles.items():
+            values[idx] = h.percentile(p)
+
+    def reset(self, start):
+        self.current = start
+        self.live = Histogram(self.relative_error)
+
+    def stored(self, start, end):
+        """
+        Yields summaries of closed buckets in [start, end)
+        """
+        oldest = end - end % self.step - self.step * self.slots
+        for t in range(max(start - start % self.step, oldest), end, self.step):
+            idx = (t // self.step) % self.slots
+            if self.times[idx] == t and t != self.current:
+                yield t, self.counts[idx], self.sums[idx], self.maxs[idx], \
+                    {p: v[idx] for p, v in self.percentiles.items()}
+
+
+def _summary(t, h):
+    return t, h.count, h.total, h.max, {p: h.percentile(p) for p in REPORTED_PERCENTILES}
+
+
+class History(object):
+    """
+    Memory-bounded history of values. Values are collected into buckets of the first level (one second by default),
+    closed buckets are rolled into buckets of the next level (one minute by default) and so on.
+    """
+
+    def __init__(self, levels=HISTORY_LEVELS, relative_error=HISTORY_RELATIVE_ERROR):
+        self.levels = [_HistoryLevel(step, slots, relative_error) for step, slots in levels]
+
+    def add(self, value, now=None):
+        level = self.levels[0]
+        now = int(time.time() if now is None else now)
+        start = now - now % level.step
+        # Late values are added to the current bucket
+        if level.current is None or start > level.current:
+            self._close(0, start)
+        level.live.add(value)
+
+    def _close(self, i, start):
+        level = self.levels[i]
+        if level.current is not None and level.live.count:
+            level.store()
+            if i + 1 < len(self.levels):
+                upper = self.levels[i + 1]
+                upper_start = level.current - level.current % upper.step
+                if upper.current != upper_start:
+                    self._close(i + 1, upper_start)
+                upper.live.merge(level.live)
+        level.reset(start)
+
+    def query(self, start, end, step):
+        """
+        Returns list of points (time, count, sum, max and percentiles) with the given step over [start, end). Data
+        is taken from the finest level, that covers start. Percentiles of merged buckets are their maximum.
+        """
+        start, end = int(start), int(end)
+        levels = [x for x in self.levels if end - x.step * x.slots <= start] or self.levels[-1:]
+        level = levels[0]
+        step = max(int(step), level.step)
+        step -= step % level.step
+        # Buckets that are not closed yet are not rolled into level, so they are taken from all the levels below
+        live = {}
+        for lower in self.levels[:self.levels.index(level) + 1]:
+            if lower.current is not None and lower.live.count:
+                t = lower.current - lower.current % level.step
+                live.setdefault(t, Histogram(level.relative_error)).merge(lower.live)
+        summaries = list(level.stored(start, end)) + [_summary(t, h) for t, h in live.items()]
+        buckets = {}
+        for t, count, total, max_, percentiles in summaries:
+            if not count or not start <= t < end:
+                continue
+            key = t - t % step
+            b = buckets.get(key)
+            if b is None:
+                buckets[key] = [count, total, max_, dict(percentiles)]
+            else:
+                b[0] += count
+                b[1] += total
+                b[2] = max(b[2], max_)
+                b[3] = {p: max(v, percentiles[p]) for p, v in b[3].items()}
+        result = []
+        for t in sorted(buckets):
+            count, total, max_, percentiles = buckets[t]
+            point = {'time': t, 'count': count, 'sum': total, 'mean': total / count, 'max': max_}
+            point.update({'p{}'.format(p): v for p, v in percentiles.items()})
+            result.append(point)
+        return step, result
 
 
 class Named(object):
+    # Volatile metrics are calculated on dump, so their dumps can't be cached
+    volatile = False
+
     def __init__(self, name):
         self.name = name
+        # Incremented on every change, used to cache dumps
+        self.version = 0
 
 
 class Metric(Named):
-    def __init__(self, name, rpm):
+    def __init__(self, name, rpm, history=False):
         super(Metric, self).__init__(name)
         self.count = 0
         self.last = 0
         self.emas = {str(i): EMA(rpm, i) for i in (1, 5, 15)}
-        self.percentile = Percentile(os.getenv('PERCENTILE_SAMPLE_SIZE', 1000))
+        self.percentile = Percentile()
+        # Histogram of all the values since start, used for exposition of cumulative buckets
+        self.histogram = Histogram()
+        # History takes much more memory than other values, so it is kept only for selected metrics
+        self.history = History() if history else None
 
-    def on_value(self, secs):
+    def on_value(self, secs, now=None):
         [ema.add(secs) for ema in self.emas.values()]
         self.last = secs
         self.count += 1
         self.percentile.add(secs)
+        self.histogram.add(secs)
+        if self.history is not None:
+            self.history.add(secs, now)
+        self.version += 1
+
+    def on_repeated_value(self, secs, count):
+        """
+        Same as calling on_value count times, but in O(1). Value is not added to history
+        """
+        for ema in self.emas.values():
+            if ema.value is None:
+                ema.value = secs
+            else:
+                ema.value = secs + (ema.value - secs) * math.pow(1. - ema.alfa, count)
+        self.last = secs
+        self.count += count
+        self.percentile.add(secs, count)
+        self.histogram.add(secs, count)
+        self.version += 1
+
+    def merge(self, other):
+        total = self.count + other.count
+        for k, ema in self.emas.items():
+            value = other.emas[k].value
+            if value is None:
+                continue
+            if ema.value is None or not total:
+                ema.value = value
+            else:
+                ema.value = (ema.value * self.count + value * other.count) / total
+        if other.count:
+            self.last = other.last
+        self.count = total
+        self.percentile.merge(other.percentile)
+        self.histogram.merge(other.histogram)
+        self.version += 1
+        return self
+
+    def __getstate__(self):
+        # History is local to process, it is too big to be sent with every snapshot
+        state = dict(self.__dict__)
+        state['history'] = None
+        return state
 
     def dump(self):
         r = {'m{}'.format(k): v.value for k, v in self.emas.items()}
         r['count'] = self.count
         r['last'] = self.last
-        r['p95'] = self.percentile.p95
-        r['p98'] = self.percentile.p98
-        r['p99'] = self.percentile.p99
+        r.update({'p{}'.format(k): v for k, v in self.percentile.percentiles().items()})
         return r
 
     def __str__(self):
@@ -68,20 +399,57 @@ class Metric(Named):
 
 
 class CallCounter(Metric):
-    def __init__(self, name):
-        super(CallCounter, self).__init__(name, 60)
+    def __init__(self, name, history=False):
+        super(CallCounter, self).__init__(name, 60, history)
         self.last_update = int(time.time())
         self._counter = 0
+        self.calls = 0
+        self._scheduled = 0.
+
+    @property
+    def scheduled(self):
+        return self._scheduled
+
+    @scheduled.setter
+    def scheduled(self, value):
+        self._scheduled = value
+        self.version += 1
 
     def _check_time(self):
-        for i in range(0, int(time.time() - self.last_update)):
-            self.on_value(self._counter)
-            self._counter = 0
-            self.last_update += 1
+        elapsed = int(time.time() - self.last_update)
+        if elapsed <= 0:
+            return
+        self.on_value(self._counter, self.last_update)
+        if elapsed > 1:
+            # Seconds without calls
+            self.on_repeated_value(0, elapsed - 1)
+        self._counter = 0
+        self.last_update += elapsed
 
     def on_call(self):
         self._check_time()
         self._counter += 1
+        self.calls += 1
+
+    def merge(self, other):
+        # Rates from different processes are summed up
+        for k, ema in self.emas.items():
+            if other.emas[k].value is not None:
+                ema.value = other.emas[k].value + (ema.value or 0)
+        self.count = max(self.count, other.count)
+        self.last += other.last
+        self.calls += other.calls
+        self._scheduled += other.scheduled
+        self.percentile.merge(other.percentile)
+        self.histogram.merge(other.histogram)
+        self.version += 1
+        return self
+
+    def dump(self):
+        r = super(CallCounter, self).dump()
+        r['scheduled'] = self.scheduled
+        r['achieved'] = self.emas['1'].value
+        return r
 
 
 class StatusCounter(Named):
@@ -95,41 +463,121 @@ class StatusCounter(Named):
             self.counts[status] = 1
         else:
             self.counts[status] += 1
+        self.version += 1
+
+    def merge(self, other):
+        for k, v in other.counts.items():
+            self.counts[k] = self.counts.get(k, 0) + v
+        self.version += 1
+        return self
 
     def dump(self):
         return {'status_{}'.format(k): v for k, v in self.counts.items()}
 
 
+class Gauge(Named):
+    volatile = True
+
+    def __init__(self, name, supplier):
+        super().__init__(name)
+        self.supplier = supplier
+
+    def dump(self):
+        return self.supplier()
+
+    def merge(self, other):
+        values = self.dump()
+        for k, v in other.dump().items():
+            values[k] = values.get(k, 0) + v
+        self.supplier = _StaticValues(values)
+        return self
+
+    def __getstate__(self):
+        # Supplier could not be pickled, so values are pickled instead
+        state = self.__dict__.copy()
+        state['supplier'] = _StaticValues(self.supplier())
+        return state
+
+
+class _StaticValues(object):
+    def __init__(self, values):
+        self.values = values
+
+    def __call__(self):
+        return dict(self.values)
+
+
 class MetricsRegistry(object):
     def __init__(self):
         self._metrics = {}
+        self._paths = {}
+        self._dumps = {}
 
     def _register(self, metric):
         self._metrics[metric.name] = metric
+        self._paths[metric.name] = metric.name.split('.')
+        self._dumps.pop(metric.name, None)
         return metric
 
-    def create_metric(self, name, rpm):
-        return self._register(Metric(name, rpm))
+    def create_metric(self, name, rpm, history=False):
+        return self._register(Metric(name, rpm, history))
 
     def create_status_counter(self, name):
         return self._register(StatusCounter(name))
 
-    def create_call_counter(self, name):
-        return self._register(CallCounter(name))
+    def create_call_counter(self, name, history=False):
+        return self._register(CallCounter(name, history))
+
+    def create_gauge(self, name, supplier):
+        return self._register(Gauge(name, supplier))
 
     def delete(self, metric):
         if metric.name in self._metrics and self._metrics[metric.name] == metric:
             del self._metrics[metric.name]
+            del self._paths[metric.name]
+            self._dumps.pop(metric.name, None)
+
+    def items(self):
+        return tuple(self._metrics.items())
+
+    def history(self, name, start, end, step):
+        """
+        Returns step and points of history for metric or None if history is not available
+        """
+        m = self._metrics.get(name)
+        if not isinstance(m, Metric) or m.history is None:
+            return None
+        return m.history.query(start, end, step)
+
+    def merge(self, items):
+        """
+        Merges metrics (for example, received from another process) into this registry. Metrics are not modified,
+        metrics with the same name are merged into a copy.
+        """
+        for name, m in items:
+            existing = self._metrics.get(name)
+            if existing is None:
+                self._register(m)
+            elif type(existing) is type(m):
+                self._register(copy.deepcopy(existing).merge(m))
+        return self
+
+    def _dump_metric(self, name, metric):
+        cached = self._dumps.get(name)
+        if metric.volatile or cached is None or cached[0] != metric.version:
+            cached = metric.version, metric.dump()
+            self._dumps[name] = cached
+        return cached[1]
 
     def dump(self):
         result = {}
         for k, v in self._metrics.items():
             x = result
-            for i in k.split('.'):
+            for i in self._paths[k]:
                 if i not in x:
                     x[i] = {}
                 x = x[i]
-            x.update(v.dump())
+            x.update(self._dump_metric(k, v))
         return result
 
 
@@ -0,0 +1,227 @@
+import json
+import os
+import random
+import sys
+import time
+
+import click
+
+from end2end import metric
+from end2end.connectors.nakadi import EventStreamReceiver, NakadiConnector
+from end2end.connectors.payload import EventTemplate
+from end2end.connectors.registry import DataToSend
+from end2end.connectors.stream import Cursors
+
+# Part of slowdown against baseline, that is not considered as regression
+DEFAULT_TOLERANCE = 0.2
+
+_BENCHMARKS = []
+
+
+def _benchmark(name):
+    """
+    Registers benchmark setup. Setup returns function, that makes some operations, and number of these operations
+    """
+
+    def _decorator(setup):
+        _BENCHMARKS.append((name, setup))
+        return setup
+
+    return _decorator
+
+
+def _latencies(count):
+    rnd = random.Random(42)
+    return [rnd.expovariate(10.) for _ in range(count)]
+
+
+@_benchmark('percentile.add')
+def _percentile_add():
+    percentile = metric.Percentile()
+    values = _latencies(10000)
+
+    def _run():
+        for v in values:
+            percentile.add(v)
+
+    return _run, len(values)
+
+
+@_benchmark('metric.on_value')
+def _metric_on_value():
+    m = metric.Metric('bench', 60.)
+    values = _latencies(10000)
+
+    def _run():
+        for v in values:
+            m.on_value(v)
+
+    return _run, len(values)
+
+
+@_benchmark('registry.dump')
+def _registry_dump():
+    registry = metric.MetricsRegistry()
+    metrics = [registry.create_metric('connector.c{}.m{}'.format(i // 10, i % 10), 60.) for i in range(5000)]
+    for m in metrics:
+        m.on_value(0.1)
+    changed = metrics[::10]
+
+    def _run():
+        # Usually only part of metrics is changed between scrapes
+        for m in changed:
+            m.on_value(0.1)
+        registry.dump()
+
+    return _run, 1
+
+
+@_benchmark('connector.value_callback')
+def _value_callback():
+    receivers = 5
+    connector = NakadiConnector('bench', topic='bench', host='http://localhost', verify=False, receivers=receivers,
+                                **{'trash-size': 16})
+    connector.cursors = Cursors()
+    metadata = {'occurred_at': '2017-07-14T02:40:00.000Z', 'received_at': '2017-07-14T02:40:00.010Z',
+                'partition': '0'}
+    state = {'value': 0}
+
+    def _run():
+        now = time.time()
+        values = range(state['value'], state['value'] + 1000)
+        state['value'] += 1000
+        for value in values:
+            data = DataToSend(value, connector, now)
+            connector.track(data)
+            data.on_data_sent(received_at=now)
+        # Receipts of every message are delivered to all the receivers
+        for receiver_id in range(receivers):
+            for value in values:
+                connector.value_callback(value, receiver_id, now, metadata)
+
+    return _run, 1000 * receivers
+
+
+@_benchmark('stream.lines')
+def _stream_lines():
+    instance_id = 'bench-instance'
+    receiver = EventStreamReceiver(None, 'bench', Cursors([{'partition': '0', 'offset': 'BEGIN'}]), instance_id,
+                                   lambda *args: None)
+    trash = 'x' * 512
+    lines = []
+    for i in range(1000):
+        # Busy topic: only every 10th batch contains event of this instance
+        owner = instance_id if i % 10 == 0 else 'other'
+        lines.append(json.dumps({
+            'cursor': {'partition': '0', 'offset': '{:018d}'.format(i)},
+            'events': [{'metadata': {'occurred_at': '2017-07-14T02:40:00.000Z'}, 'value': i, 'instance_id': owner,
+                        'trash': trash}]}))
+    data = ('\n'.join(lines) + '\n').encode('utf-8')
+    chunks = [data[i:i + 16384] for i in range(0, len(data), 16384)]
+
+    def _run():
+        for chunk in chunks:
+            receiver._on_chunk(chunk)
+
+    return _run, len(lines)
+
+
+@_benchmark('cursors.update')
+def _cursors_update():
+    partitions = 1000
+    cursors = Cursors({'partition': str(p), 'offset': '{:018d}'.format(0)} for p in range(partitions))
+    updates = [{'partition': str(p), 'offset': '{:018d}'.format(i)} for i in range(1, 6) for p in range(partitions)]
+
+    def _run():
+        for cursor in updates:
+            cursors.update(cursor)
+        # Cursors are serialized on every reconnect and sync read
+        cursors.serialize()
+
+    return _run, len(updates)
+
+
+@_benchmark('payload.render_batch')
+def _payload_render():
+    template = EventTemplate('bench', instance_id='bench-instance', trash='x' * 512)
+    values = list(range(100))
+
+    def _run():
+        template.render_batch(values)
+
+    return _run, len(values)
+
+
+def measure(run, ops, repeat, min_time=0.2):
+    """
+    Returns the best time per operation (microseconds) over repeat rounds, every round lasts at least min_time
+    """
+    run()
+    best = None
+    for _ in range(repeat):
+        calls = 0
+        started = time.perf_counter()
+        elapsed = 0.
+        while elapsed < min_time:
+            run()
+            calls += 1
+            elapsed = time.perf_counter() - started
+        per_op = elapsed * 1e6 / (calls * ops)
+        best = per_op if best is None else min(best, per_op)
+    return best
+
+
+def load_baselines(path, save=False):
+    """
+    Returns stored baselines. Missing file is an error, unless baselines are going to be saved
+    """
+    if not os.path.exists(path):
+        if save:
+            return {}
+        raise click.ClickException('Baselines file {} is not found, run with --save to create it'.format(path))
+    with open(path) as f:
+        return json.load(f)
+
+
+def compare(results, baselines, tolerance):
+    """
+    Returns regressions: benchmarks, that are slower than baseline by more than tolerance
+    """
+    return {name: (value, baselines[name]) for name, value in results.items()
+            if name in baselines and value > baselines[name] * (1. + tolerance)}
+
+
+@click.command()
+@click.option('--baselines', default='microbench.json', help='File with stored baselines (microseconds per operation)')
+@click.option('--save', is_flag=True, help='Store results as new baselines')
+@click.option('--tolerance', type=float, default=DEFAULT_TOLERANCE, help='Allowed slowdown against baseline')
+@click.option('--repeat', type=int, default=5, help='Number of rounds, the best one is reported')
+@click.option('--only', help='Run only benchmarks with names starting with this prefix')
+def microbench(baselines, save, tolerance, repeat, only):
+    """
+    Runs micro-benchmarks of per-message code paths, fails if any of them regressed against stored baseline
+    """
+    stored = load_baselines(baselines, save)
+    results = {}
+    for name, setup in _BENCHMARKS:
+        if only and not name.startswith(only):
+            continue
+        results[name] = measure(*setup(), repeat=repeat)
+        baseline = stored.get(name)
+        click.echo('{:<26} {:>10.3f} us/op {:>12}'.format(
+            name, results[name], 'n/a' if baseline is None else '{:+.1f}%'.format(
+                100. * (results[name] / baseline - 1.))))
+    if save:
+        stored.update(results)
+        with open(baselines, 'w') as f:
+            json.dump(stored, f, indent=2, sort_keys=True)
+        return
+    regressions = compare(results, stored, tolerance)
+    for name, (value, baseline) in sorted(regressions.items()):
+        click.echo('Regression of {}: {:.3f} us/op, baseline {:.3f} us/op'.format(name, value, baseline), err=True)
+    if regressions:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    microbench()
@@ -0,0 +1,109 @@
+import copy
+import logging
+import time
+
+from tornado import gen
+
+from end2end.connectors import registry
+
+# Part of target rate that should be achieved by checker for step to be valid
+ACHIEVED_RATIO = 0.95
+
+
+def _snapshot(connector):
+    return copy.deepcopy(connector.async_metric.histogram), dict(connector.status_counter.counts), \
+        connector.send_rpm.calls, time.time()
+
+
+def _measure(rate, before, after):
+    histogram = after[0].difference(before[0])
+    statuses = {k: v - before[1].get(k, 0) for k, v in after[1].items()}
+    requests = sum(statuses.values())
+    errors = sum(v for k, v in statuses.items() if not 200 <= int(k) < 300)
+    return {
+        'rate': rate,
+        'achieved_rps': (after[2] - before[2]) / (after[3] - before[3]),
+        'async_p50': histogram.percentile(50),
+        'async_p99': histogram.percentile(99),
+        'error_rate': float(errors) / requests if requests else 0.,
+    }
+
+
+class SaturationProbe(object):
+    """
+    Raises publish rate of running connector step by step (every step is held for warmup + hold seconds) till p99 of
+    async latency is higher than slo or part of failed publish requests is higher than max_error_rate. Knee point
+    is the last step within thresholds. Configuration of connector is restored when probe is finished.
+    """
+
+    def __init__(self, connector, start_rate=1., factor=1.5, max_rate=1000., warmup=10., hold=60., slo=1.,
+                 max_error_rate=0.01):
+        self.connector = connector
+        self.start_rate = float(start_rate)
+        self.factor = float(factor)
+        self.max_rate = float(max_rate)
+        self.warmup = float(warmup)
+        self.hold = float(hold)
+        self.slo = float(slo)
+        self.max_error_rate = float(max_error_rate)
+        self.state = 'created'
+        self.reason = None
+        self.steps = []
+        self.knee = None
+
+    def status(self):
+        return {
+            'connector': self.connector,
+            'state': self.state,
+            'reason': self.reason,
+            'knee': self.knee,
+            'steps': self.steps,
+        }
+
+    def _breach(self, step):
+        if step['async_p99'] is None or step['async_p99'] > self.slo:
+            return 'latency'
+        if step['error_rate'] > self.max_error_rate:
+            return 'errors'
+        if step['achieved_rps'] < ACHIEVED_RATIO * step['rate']:
+            return 'rate_not_achieved'
+        return None
+
+    def _set_rate(self, spec, rate):
+        config = {c.name: c.config for c in registry.instance().items()}
+        if rate is not None:
+            spec = dict(spec)
+            spec['rate'] = rate
+        config[self.connector] = spec
+        registry.instance().set_config(config)
+        return next(c for c in registry.instance().items() if c.name == self.connector)
+
+    @gen.coroutine
+    def run(self):
+        original = next((c.config for c in registry.instance().items() if c.name == self.connector), None)
+        if original is None:
+            self.state, self.reason = 'failed', 'connector {} is not found'.format(self.connector)
+            return
+        self.state = 'running'
+        rate = self.start_rate
+        try:
+            while rate <= self.max_rate:
+                connector = self._set_rate(original, rate)
+                yield gen.sleep(self.warmup)
+                before = _snapshot(connector)
+                yield gen.sleep(self.hold)
+                step = _measure(rate, before, _snapshot(connector))
+                # Rate is set for publish requests, achieved one is counted in events
+                step['achieved_rps'] /= connector.batch_size
+                self.steps.append(step)
+                logging.info('Saturation probe of {}: {}'.format(self.connector, step))
+                self.reason = self._breach(step)
+                if self.reason:
+                    break
+                self.knee = step
+                rate *= self.factor
+            else:
+                self.reason = 'max_rate'
+        finally:
+            self._set_rate(original, None)
+            self.state = 'finished'
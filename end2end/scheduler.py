@@ -0,0 +1,42 @@
+import math
+
+MAX_CATCH_UP = 10
+
+
+class RateSchedule(object):
+    """
+    Open-loop schedule of invocations. Deadlines are calculated from the start time (start + n * interval), so
+    schedule doesn't drift when invocations are taking time. If invocations are late, all the missed deadlines are
+    returned at once (but not more than max_catch_up, the rest is skipped), in order not to hide latency when loop
+    is busy.
+    """
+
+    def __init__(self, interval, start, max_catch_up=MAX_CATCH_UP):
+        self.interval = float(interval)
+        self.start = start
+        self.max_catch_up = max_catch_up
+        self.issued = 0
+        self.skipped = 0
+
+    @property
+    def rate(self):
+        return 1. / self.interval
+
+    @property
+    def next_deadline(self):
+        return self.start + self.issued * self.interval
+
+    def due(self, now):
+        """
+        Returns list of intended invocation times (deadlines) that are not later than now
+        """
+        count = int(math.floor((now - self.start) / self.interval)) + 1 - self.issued
+        if count <= 0:
+            return []
+        if count > self.max_catch_up:
+            self.skipped += count - self.max_catch_up
+            self.issued += count - self.max_catch_up
+            count = self.max_catch_up
+        result = [self.start + (self.issued + i) * self.interval for i in range(count)]
+        self.issued += count
+        return result
@@ -1,16 +1,62 @@
 import json
+import time
 
+from tornado import gen
+from tornado.concurrent import is_future
 from tornado.httpserver import HTTPServer
+from tornado.ioloop import IOLoop
 from tornado.web import RequestHandler, Application, url
 
 from end2end import metric
+from end2end.exposition import OpenMetricsRenderer, CONTENT_TYPE as OPENMETRICS_CONTENT_TYPE
 from end2end.connectors import registry
-from end2end.connectors.factory import load_connectors
+from end2end.saturation import SaturationProbe
 
 
 class MetricsHandler(RequestHandler):
+    def initialize(self, metrics, renderer):
+        self.metrics = metrics
+        self.renderer = renderer
+
+    def get(self):
+        format_ = self.get_argument('format', None)
+        if format_ is None and 'application/openmetrics-text' in self.request.headers.get('Accept', ''):
+            format_ = 'openmetrics'
+        if format_ in ('openmetrics', 'prometheus'):
+            self.set_header('Content-Type', OPENMETRICS_CONTENT_TYPE)
+            return self.write(self.renderer.render())
+        return self.write(self.metrics.dump())
+
+
+class HistoryHandler(RequestHandler):
+    def initialize(self, metrics):
+        self.metrics = metrics
+
+    def _time_argument(self, name, default, now):
+        value = float(self.get_argument(name, default))
+        # Negative values are relative to now
+        return now + value if value <= 0 else value
+
+    @gen.coroutine
     def get(self):
-        return self.write(metric.instance().dump())
+        name = self.get_argument('metric')
+        now = time.time()
+        try:
+            start = self._time_argument('from', -600, now)
+            end = self._time_argument('to', 0, now) + 1
+            step = int(self.get_argument('step', 1))
+        except ValueError:
+            self.set_status(400)
+            return self.write({'error': 'Parameters from, to and step must be numbers'})
+        history = self.metrics.history(name, start, end, step)
+        if is_future(history):
+            # With workers history is kept by worker process running the connector
+            history = yield history
+        if history is None:
+            self.set_status(404)
+            return self.write({'error': 'History for metric {} is not available'.format(name)})
+        step, points = history
+        return self.write({'metric': name, 'step': step, 'points': points})
 
 
 class HealthHandler(RequestHandler):
@@ -19,18 +65,60 @@ class HealthHandler(RequestHandler):
 
 
 class ConnectorsHandler(RequestHandler):
+    def initialize(self, supervisor):
+        self.supervisor = supervisor
+
     def get(self):
+        if self.supervisor:
+            return self.write(self.supervisor.config())
         return self.write({c.name: c.config for c in registry.instance().items()})
 
     def post(self):
-        registry.instance().set_items(load_connectors(json.loads(self.request.body.decode('utf-8'))))
+        config = json.loads(self.request.body.decode('utf-8'))
+        if self.supervisor:
+            self.supervisor.set_config(config)
+        else:
+            registry.instance().set_config(config)
         return self.write('OK')
 
 
-def start_http_server(port):
-    application = Application([
+class SaturationHandler(RequestHandler):
+    probe = None
+
+    def initialize(self, supervisor):
+        self.supervisor = supervisor
+
+    def get(self):
+        if SaturationHandler.probe is None:
+            self.set_status(404)
+            return self.write({'error': 'Saturation probe was not started'})
+        return self.write(SaturationHandler.probe.status())
+
+    def post(self):
+        if self.supervisor:
+            self.set_status(501)
+            return self.write({'error': 'Saturation probe is not available when running with workers'})
+        if SaturationHandler.probe is not None and SaturationHandler.probe.state == 'running':
+            self.set_status(409)
+            return self.write({'error': 'Saturation probe is already running'})
+        SaturationHandler.probe = SaturationProbe(**json.loads(self.request.body.decode('utf-8')))
+        IOLoop.current().spawn_callback(SaturationHandler.probe.run)
+        return self.write(SaturationHandler.probe.status())
+
+
+def create_application(supervisor=None):
+    """
+    Creates application. If supervisor is passed, metrics and connectors are taken from worker processes
+    """
+    metrics = supervisor if supervisor else metric.instance()
+    return Application([
         url(r'/health', HealthHandler),
-        url(r'/metrics', MetricsHandler),
-        url(r'/connectors', ConnectorsHandler)
+        url(r'/metrics', MetricsHandler, dict(metrics=metrics, renderer=OpenMetricsRenderer(metrics))),
+        url(r'/metrics/history', HistoryHandler, dict(metrics=metrics)),
+        url(r'/connectors', ConnectorsHandler, dict(supervisor=supervisor)),
+        url(r'/saturation', SaturationHandler, dict(supervisor=supervisor))
     ])
-    HTTPServer(application).listen(port)
+
+
+def start_http_server(port, supervisor=None):
+    HTTPServer(create_application(supervisor)).listen(port)
@@ -0,0 +1,182 @@
+import functools
+import logging
+import multiprocessing
+import zlib
+
+from tornado.concurrent import Future
+from tornado.ioloop import IOLoop, PeriodicCallback
+
+from end2end import metric
+from end2end.connectors.factory import validate_connectors
+
+SNAPSHOT_INTERVAL = 1
+
+RESTART_DELAY = 1
+
+_CONNECTOR_PREFIX = 'connector.'
+
+
+def shard_of(name, workers):
+    return zlib.crc32(name.encode('utf-8')) % workers
+
+
+def _shard(config, idx, workers):
+    return {k: v for k, v in config.items() if shard_of(k, workers) == idx}
+
+
+def _run_worker(idx, workers, token, config, conn):
+    """
+    Entry point of worker process. Worker runs connectors of its shard on its own IOLoop and sends snapshots of
+    its metrics to supervisor every SNAPSHOT_INTERVAL seconds. New configuration and history queries are received
+    from supervisor, messages in both directions are (kind, payload) tuples.
+    """
+    from end2end import security
+    from end2end.connectors import registry
+    from end2end.instrumentation import LoopLagProbe
+    from end2end.main import configure_logging
+
+    configure_logging()
+    if token:
+        security.use_static_token(token)
+    else:
+        security.use_berry_token('end2end_nakadi')
+
+    def _set_config(config_):
+        logging.info('Worker {} is running connectors {}'.format(idx, ', '.join(_shard(config_, idx, workers))))
+        registry.instance().set_config(_shard(config_, idx, workers))
+
+    def _on_message(fd, events):
+        try:
+            while conn.poll():
+                kind, payload = conn.recv()
+                if kind == 'config':
+                    _set_config(payload)
+                elif kind == 'history':
+                    request_id, name, start, end, step = payload
+                    conn.send(('history', (request_id, metric.instance().history(name, start, end, step))))
+        except (EOFError, OSError):
+            logging.error('Supervisor connection is closed, stopping worker {}'.format(idx))
+            IOLoop.instance().stop()
+
+    def _send_snapshot():
+        try:
+            conn.send(('snapshot', metric.instance().items()))
+        except (EOFError, OSError):
+            IOLoop.instance().stop()
+
+    LoopLagProbe().start()
+    _set_config(config)
+    IOLoop.instance().add_handler(conn.fileno(), _on_message, IOLoop.READ)
+    PeriodicCallback(_send_snapshot, SNAPSHOT_INTERVAL * 1000).start()
+    IOLoop.instance().start()
+
+
+class Supervisor(object):
+    """
+    Runs connectors in a pool of worker processes (connector is assigned to worker by hash of its name). Metrics of
+    workers are received over pipes and merged on request, supervisor could be used instead of metrics registry.
+    History is not sent with snapshots, it is requested from the worker running the connector.
+    """
+
+    def __init__(self, workers, token=None):
+        self.workers = workers
+        self.token = token
+        self._config = {}
+        self._context = multiprocessing.get_context('spawn')
+        self._processes = [None] * workers
+        self._conns = [None] * workers
+        self._snapshots = [()] * workers
+        self._merged = None
+        self._merged_from = None
+        # Request id -> (worker, future) of history queries waiting for response
+        self._pending = {}
+        self._request_id = 0
+
+    def start(self, config):
+        self._config = validate_connectors(dict(config))
+        for i in range(self.workers):
+            self._start_worker(i)
+
+    def _start_worker(self, idx):
+        parent_conn, child_conn = self._context.Pipe()
+        process = self._context.Process(
+            target=_run_worker,
+            args=(idx, self.workers, self.token, self._config, child_conn),
+            name='end2end-worker-{}'.format(idx),
+            daemon=True)
+        process.start()
+        child_conn.close()
+        self._processes[idx] = process
+        self._conns[idx] = parent_conn
+        IOLoop.instance().add_handler(parent_conn.fileno(), functools.partial(self._on_message, idx), IOLoop.READ)
+        logging.info('Started worker {} with pid {}'.format(idx, process.pid))
+
+    def _on_message(self, idx, fd, events):
+        conn = self._conns[idx]
+        try:
+            while conn.poll():
+                kind, payload = conn.recv()
+                if kind == 'snapshot':
+                    self._snapshots[idx] = payload
+                elif kind == 'history':
+                    request_id, history = payload
+                    self._resolve(request_id, history)
+        except (EOFError, OSError):
+            logging.error('Worker {} died, restarting in {} seconds'.format(idx, RESTART_DELAY))
+            IOLoop.instance().remove_handler(fd)
+            conn.close()
+            self._processes[idx].join(0)
+            self._snapshots[idx] = ()
+            for request_id in [k for k, (worker, _) in self._pending.items() if worker == idx]:
+                self._resolve(request_id, None)
+            IOLoop.instance().call_later(RESTART_DELAY, functools.partial(self._start_worker, idx))
+
+    def config(self):
+        return self._config
+
+    def set_config(self, config):
+        self._config = validate_connectors(dict(config))
+        for conn in self._conns:
+            try:
+                conn.send(('config', self._config))
+            except (EOFError, OSError) as e:
+                logging.error('Failed to send configuration to worker', exc_info=e)
+
+    def _registry(self):
+        snapshots = tuple(self._snapshots)
+        if self._merged is None or any(x is not y for x, y in zip(snapshots, self._merged_from)):
+            merged = metric.MetricsRegistry()
+            for s in snapshots:
+                merged.merge(s)
+            self._merged, self._merged_from = merged, snapshots
+        return self._merged
+
+    def items(self):
+        return self._registry().items()
+
+    def dump(self):
+        return self._registry().dump()
+
+    def _resolve(self, request_id, history):
+        _, future = self._pending.pop(request_id, (None, None))
+        if future is not None:
+            future.set_result(history)
+
+    def history(self, name, start, end, step):
+        """
+        Returns future with history of connector metric, it is resolved by the worker running the connector (None if
+        history is not available)
+        """
+        future = Future()
+        if not name.startswith(_CONNECTOR_PREFIX):
+            future.set_result(None)
+            return future
+        idx = shard_of(name[len(_CONNECTOR_PREFIX):].rsplit('.', 1)[0], self.workers)
+        self._request_id += 1
+        self._pending[self._request_id] = (idx, future)
+        try:
+            self._conns[idx].send(('history', (self._request_id, name, start, end, step)))
+        except (EOFError, OSError) as e:
+            logging.error('Failed to request history from worker {}'.format(idx), exc_info=e)
+            self._resolve(self._request_id, None)
+        return future
@@ -0,0 +1,62 @@
+import json
+import logging
+import os
+import random
+import time
+import weakref
+
+# Messages with async latency above this percentile of connector's async latency are traced
+TRACE_PERCENTILE = float(os.getenv('TRACE_PERCENTILE', 99))
+
+# Part of other messages, that are traced
+TRACE_SAMPLE_RATE = float(os.getenv('TRACE_SAMPLE_RATE', 0.001))
+
+# Percentile thresholds are recalculated not more often than once per THRESHOLD_REFRESH seconds
+THRESHOLD_REFRESH = 1.
+
+_LOGGER = logging.getLogger('end2end.trace')
+
+
+class Tracer(object):
+    """
+    Emits structured trace of completed messages. Messages, that timed out or are slower than TRACE_PERCENTILE of
+    other messages of connector, are always traced, other ones are sampled with TRACE_SAMPLE_RATE.
+    """
+
+    def __init__(self, percentile=TRACE_PERCENTILE, sample_rate=TRACE_SAMPLE_RATE, logger=_LOGGER):
+        self.percentile = percentile
+        self.sample_rate = sample_rate
+        self.logger = logger
+        self._thresholds = weakref.WeakKeyDictionary()
+
+    def threshold(self, metric, now=None):
+        now = time.time() if now is None else now
+        cached = self._thresholds.get(metric)
+        if cached is None or now - cached[0] >= THRESHOLD_REFRESH:
+            cached = self._thresholds[metric] = now, metric.percentile.percentile(self.percentile)
+        return cached[1]
+
+    def reason(self, metric, latency, timed_out, now=None):
+        """
+        Returns reason for tracing the message or None if message shouldn't be traced
+        """
+        if timed_out:
+            return 'timeout'
+        if latency is not None:
+            threshold = self.threshold(metric, now)
+            if threshold is not None and latency > threshold:
+                return 'slow'
+        if random.random() < self.sample_rate:
+            return 'sampled'
+        return None
+
+    def emit(self, reason, trace):
+        trace['reason'] = reason
+        self.logger.log(logging.WARNING if reason == 'timeout' else logging.INFO, json.dumps(trace))
+
+
+__TRACER = Tracer()
+
+
+def instance():
+    return __TRACER
@@ -48,7 +48,10 @@ CLASSIFIERS = [
 ]
 
 CONSOLE_SCRIPTS = [
-    'end2end-daemon = end2end.main:start'
+    'end2end-daemon = end2end.main:start',
+    'end2end-benchmark = end2end.benchmark:benchmark',
+    'end2end-microbench = end2end.microbench:microbench',
+    'end2end-fake-nakadi = end2end.fake.server:start'
 ]
 
 
@@ -84,6 +87,7 @@ def setup_package():
         test_suite='tests',
         packages=setuptools.find_packages(exclude=['tests', 'tests.*']),
         install_requires=[req for req in read('requirements.txt').split('\\n') if req != ''],
+        extras_require={'zstd': ['zstandard']},
         cmdclass={'test': PyTest},
         tests_require=['pytest-cov', 'pytest'],
         command_options=command_options,
@@ -0,0 +1,72 @@
+import gzip
+import unittest
+import zlib
+
+from end2end import security
+from end2end.connectors.compression import CompressionStats, check_encoding, compress, decompressor
+from end2end.connectors.nakadi import NakadiConnector
+from end2end.connectors.registry import DataToSend
+from end2end.fake.testing import FakeNakadiTestCase
+
+
+class TestCompression(unittest.TestCase):
+    DATA = b'{"value": 1, "trash": "' + b'abc' * 1000 + b'"}\n'
+
+    def test_gzip(self):
+        self.assertEqual(self.DATA, gzip.decompress(compress('gzip', self.DATA)))
+
+    def test_deflate(self):
+        self.assertEqual(self.DATA, zlib.decompress(compress('deflate', self.DATA)))
+
+    def test_decompress_by_chunks(self):
+        for encoding in ('gzip', 'deflate'):
+            compressed = compress(encoding, self.DATA * 3)
+            decompress = decompressor(encoding)
+            result = b''.join(decompress(compressed[i:i + 7]) for i in range(0, len(compressed), 7))
+            self.assertEqual(self.DATA * 3, result)
+
+    def test_unsupported(self):
+        self.assertIsNone(decompressor('br'))
+        self.assertRaises(Exception, check_encoding, 'br')
+
+    def test_stats(self):
+        stats = CompressionStats()
+        compressed = stats.compress('gzip', self.DATA)
+        stats.decompress(decompressor('gzip'), compressed)
+        stats.decompress(None, b'abc')
+        self.assertEqual(len(self.DATA), stats.values['publish_raw_bytes'])
+        self.assertEqual(len(compressed), stats.values['publish_bytes'])
+        self.assertEqual(len(compressed) + 3, stats.values['receive_bytes'])
+        self.assertEqual(len(self.DATA) + 3, stats.values['receive_raw_bytes'])
+
+
+class TestPublishHeaders(FakeNakadiTestCase):
+    def get_app(self):
+        app = super(TestPublishHeaders, self).get_app()
+        self.requests = []
+        app.settings['log_function'] = lambda handler: self.requests.append(handler.request)
+        return app
+
+    def setUp(self):
+        super(TestPublishHeaders, self).setUp()
+        self.nakadi.create_event_type('test_headers')
+        self.connector = NakadiConnector('test_headers', topic='test_headers', host=self.host(), verify=False,
+                                         receivers=1, compression='gzip', **{'trash-size': 16})
+
+    def tearDown(self):
+        self.connector.deinitialize()
+        super(TestPublishHeaders, self).tearDown()
+
+    def _publish(self):
+        self.connector.send_and_receive([DataToSend(1, self.connector)], False)
+        self.wait_for(lambda: self.requests and self.requests[-1].method == 'POST')
+        return self.requests.pop().headers
+
+    def test_token_rotation(self):
+        security.use_static_token('old')
+        self.assertEqual('Bearer old', self._publish()['Authorization'])
+        security.use_static_token('new')
+        headers = self._publish()
+        self.assertEqual('Bearer new', headers['Authorization'])
+        self.assertEqual('gzip', headers['Content-Encoding'])
+        self.assertNotIn('Authorization', self.connector._publish_headers)
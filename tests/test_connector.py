@@ -0,0 +1,68 @@
+import time
+import unittest
+
+from end2end.connectors import Connector
+
+
+class TestReconfigure(unittest.TestCase):
+    def setUp(self):
+        self.connector = Connector('test_reconfigure', topic='a', interval=10, max_wait=60)
+
+    def tearDown(self):
+        self.connector.deinitialize()
+
+    def test_in_place(self):
+        self.assertTrue(self.connector.reconfigure({'topic': 'a', 'rate': 4, 'max_wait': 5}))
+        self.assertEqual(0.25, self.connector.interval)
+        self.assertEqual(5, self.connector.max_wait)
+        self.assertEqual({'topic': 'a', 'rate': 4, 'max_wait': 5}, self.connector.config)
+
+    def test_not_reconfigurable(self):
+        self.assertFalse(self.connector.reconfigure({'topic': 'b', 'interval': 10, 'max_wait': 60}))
+        self.assertEqual(10, self.connector.interval)
+        self.assertEqual('a', self.connector.config['topic'])
+
+
+class TestAdmission(unittest.TestCase):
+    def setUp(self):
+        self.connector = Connector('test_admission', topic='a', max_wait=60, max_publishes_in_flight=2)
+        self.sent = []
+
+    def tearDown(self):
+        self.connector.deinitialize()
+
+    def _send(self, intended_time):
+        self.connector.on_publish_started()
+        self.sent.append(intended_time)
+
+    def test_deferred_and_skipped(self):
+        now = time.time()
+        for i in range(5):
+            self.connector.admit(now + i, self._send)
+        self.assertEqual([now, now + 1], self.sent)
+        self.assertEqual({'deferred': 2, 'skipped': 1, 'in_flight': 2, 'waiting': 2},
+                         self.connector.admission_gauge.dump())
+        self.connector.on_publish_completed()
+        self.assertEqual([now, now + 1, now + 2], self.sent)
+        self.assertEqual(2, self.connector.publishes_in_flight)
+
+    def test_expired_deferred_skipped(self):
+        now = time.time()
+        self.connector.admit(now, self._send)
+        self.connector.admit(now, self._send)
+        self.connector.admit(now - 120, self._send)
+        self.connector.on_publish_completed()
+        self.assertEqual(2, len(self.sent))
+        self.assertEqual(1, self.connector.admission_gauge.dump()['skipped'])
+
+    def test_unlimited(self):
+        self.connector.reconfigure({'topic': 'a', 'max_wait': 60})
+        for i in range(5):
+            self.connector.admit(i, self._send)
+        self.assertEqual(5, len(self.sent))
+
+    def test_reconfigure_releases_deferred(self):
+        for i in range(4):
+            self.connector.admit(time.time(), self._send)
+        self.connector.reconfigure({'topic': 'a', 'max_wait': 60, 'max_publishes_in_flight': 4})
+        self.assertEqual(4, len(self.sent))
@@ -0,0 +1,65 @@
+import unittest
+
+from end2end.exposition import OpenMetricsRenderer
+from end2end.metric import MetricsRegistry
+
+
+class TestOpenMetricsRenderer(unittest.TestCase):
+    def setUp(self):
+        self.registry = MetricsRegistry()
+        self.renderer = OpenMetricsRenderer(self.registry)
+
+    def test_histogram(self):
+        m = self.registry.create_metric('connector.test.async', 60)
+        for x in (0.003, 0.2, 0.7, 100):
+            m.on_value(x)
+        result = self.renderer.render()
+        self.assertIn('# TYPE end2end_connector_async histogram', result)
+        self.assertIn('end2end_connector_async_bucket{connector="test",le="0.005"} 1', result)
+        self.assertIn('end2end_connector_async_bucket{connector="test",le="1.0"} 3', result)
+        self.assertIn('end2end_connector_async_bucket{connector="test",le="+Inf"} 4', result)
+        self.assertIn('end2end_connector_async_count{connector="test"} 4', result)
+        self.assertTrue(result.endswith('# EOF\n'))
+
+    def test_indexed(self):
+        self.registry.create_metric('connector.test.size.512', 60).on_value(0.1)
+        self.registry.create_metric('connector.test.size.1024', 60).on_value(0.2)
+        result = self.renderer.render()
+        self.assertEqual(1, result.count('# TYPE end2end_connector_size histogram'))
+        self.assertIn('end2end_connector_size_count{connector="test",size="512"} 1', result)
+        self.assertIn('end2end_connector_size_count{connector="test",size="1024"} 1', result)
+
+    def test_counters(self):
+        self.registry.create_status_counter('connector.test.publish').on_new_status(200)
+        self.registry.create_call_counter('RPS').on_call()
+        result = self.renderer.render()
+        self.assertIn('end2end_connector_publish_total{connector="test",status="200"} 1', result)
+        self.assertIn('end2end_rps_total 1', result)
+
+    def test_cache_invalidated_on_change(self):
+        counter = self.registry.create_status_counter('connector.test.publish')
+        counter.on_new_status(200)
+        first = self.renderer.render()
+        self.assertEqual(first, self.renderer.render())
+        counter.on_new_status(200)
+        self.assertIn('status="200"} 2', self.renderer.render())
+
+    def test_deleted_metric(self):
+        m = self.registry.create_metric('connector.test.sync', 60)
+        self.renderer.render()
+        self.registry.delete(m)
+        self.assertNotIn('connector_sync', self.renderer.render())
+
+    def test_json_dump_cached_by_version(self):
+        m = self.registry.create_metric('connector.test.sync', 60)
+        m.on_value(1)
+        self.assertEqual(1, self.registry.dump()['connector']['test']['sync']['count'])
+        m.on_value(1)
+        self.assertEqual(2, self.registry.dump()['connector']['test']['sync']['count'])
+
+    def test_indexed_gauge(self):
+        self.registry.create_gauge('connector.test.lag.partition', lambda: {'0': 3, '1': 0})
+        result = self.renderer.render()
+        self.assertIn('# TYPE end2end_connector_lag gauge', result)
+        self.assertIn('end2end_connector_lag{connector="test",partition="0"} 3', result)
+        self.assertIn('end2end_connector_lag{connector="test",partition="1"} 0', result)
@@ -0,0 +1,54 @@
+import json
+import unittest
+
+from end2end.connectors.stream import extract_cursor
+from end2end.fake.store import EventTypeStore, format_batch, format_offset, parse_offset
+
+
+class TestEventTypeStore(unittest.TestCase):
+    def test_round_robin(self):
+        store = EventTypeStore('test', partitions=2)
+        store.publish([{'value': i} for i in range(5)])
+        self.assertEqual(['000000000000000002', '000000000000000001'],
+                         [x['newest_available_offset'] for x in store.stats()])
+        events, last = store.read('1', -1, 10)
+        self.assertEqual([1, 3], [json.loads(e.decode('utf-8'))['value'] for e in events])
+        self.assertEqual('1', json.loads(events[0].decode('utf-8'))['metadata']['partition'])
+        self.assertEqual(1, last)
+
+    def test_user_defined(self):
+        store = EventTypeStore('test', partitions=2, partition_strategy='user_defined')
+        store.publish([{'value': i, 'metadata': {'partition': '1'}} for i in range(3)])
+        events, last = store.read('1', -1, 10)
+        self.assertEqual([0, 1, 2], [json.loads(e.decode('utf-8'))['value'] for e in events])
+
+    def test_read_after_offset(self):
+        store = EventTypeStore('test')
+        store.publish([{'value': i} for i in range(5)])
+        events, last = store.read('0', 2, 1)
+        self.assertEqual(3, json.loads(events[0].decode('utf-8'))['value'])
+        self.assertEqual(([], 4), store.read('0', 4, 1))
+
+    def test_empty_partition(self):
+        store = EventTypeStore('test')
+        self.assertEqual('BEGIN', store.stats()[0]['newest_available_offset'])
+        self.assertEqual(([], -1), store.read('0', parse_offset('BEGIN'), 1))
+
+    def test_retention(self):
+        store = EventTypeStore('test', retention=4)
+        store.publish([{'value': i} for i in range(10)])
+        events, last = store.read('0', -1, 100)
+        self.assertEqual(9, last)
+        self.assertLessEqual(len(events), 4)
+
+    def test_fanout(self):
+        store = EventTypeStore('test')
+        store.publish([{'value': 1, 'instance_id': 'me'}], fanout=3)
+        events, _ = store.read('0', -1, 100)
+        self.assertEqual(['me', 'fanout', 'fanout', 'fanout'],
+                         [json.loads(e.decode('utf-8'))['instance_id'] for e in events])
+
+    def test_format_batch(self):
+        line = format_batch('0', 5, [b'{"value":1}'])
+        self.assertEqual({'partition': '0', 'offset': format_offset(5)}, extract_cursor(line))
+        self.assertNotIn(b'events', format_batch('0', 5))
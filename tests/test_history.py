@@ -0,0 +1,82 @@
+import math
+import unittest
+
+from end2end.metric import History, CallCounter, Metric, MetricsRegistry
+
+
+class TestHistory(unittest.TestCase):
+    def test_second_buckets(self):
+        h = History(levels=((1, 10), (5, 10)))
+        for t in range(1000, 1004):
+            h.add(t - 999, now=t + 0.5)
+        step, points = h.query(1000, 1004, 1)
+        self.assertEqual(1, step)
+        self.assertEqual([1000, 1001, 1002, 1003], [x['time'] for x in points])
+        self.assertEqual([1, 2, 3, 4], [x['max'] for x in points])
+
+    def test_downsampling(self):
+        h = History(levels=((1, 10), (5, 10)))
+        for t in range(1000, 1010):
+            h.add(1., now=t)
+        step, points = h.query(1000, 1010, 3)
+        self.assertEqual(3, step)
+        self.assertEqual([999, 1002, 1005, 1008], [x['time'] for x in points])
+        self.assertEqual([2, 3, 3, 2], [x['count'] for x in points])
+
+    def test_rolled_into_upper_level(self):
+        h = History(levels=((1, 10), (5, 10)))
+        for t in range(1000, 1030):
+            h.add(t - 999, now=t)
+        # First seconds are not kept by the first level anymore
+        step, points = h.query(1000, 1030, 1)
+        self.assertEqual(5, step)
+        self.assertEqual(list(range(1000, 1030, 5)), [x['time'] for x in points])
+        self.assertEqual([5] * 6, [x['count'] for x in points])
+        self.assertEqual(sum(range(1, 31)), sum(x['sum'] for x in points))
+        self.assertAlmostEqual(30, points[-1]['p99'], delta=30 * 0.05)
+
+    def test_memory_bounded(self):
+        h = History(levels=((1, 10), (5, 10)))
+        for t in range(1000, 1200):
+            h.add(1., now=t)
+        step, points = h.query(0, 1200, 5)
+        self.assertEqual(10, len(points))
+        self.assertEqual(1150, points[0]['time'])
+
+    def test_late_value(self):
+        h = History(levels=((1, 10),))
+        h.add(1., now=1005)
+        h.add(2., now=1003)
+        step, points = h.query(1000, 1010, 1)
+        self.assertEqual([(1005, 2)], [(x['time'], x['count']) for x in points])
+
+
+class TestRepeatedValue(unittest.TestCase):
+    def test_same_as_loop(self):
+        expected, actual = Metric('a', 60), Metric('b', 60)
+        for m in (expected, actual):
+            m.on_value(5.)
+        for _ in range(100):
+            expected.on_value(0)
+        actual.on_repeated_value(0, 100)
+        for k, ema in expected.emas.items():
+            self.assertTrue(math.isclose(ema.value, actual.emas[k].value, rel_tol=1e-9))
+        self.assertEqual(expected.count, actual.count)
+        self.assertEqual(expected.dump()['p99'], actual.dump()['p99'])
+
+    def test_call_counter_idle(self):
+        counter = CallCounter('c')
+        counter.on_call()
+        counter.last_update -= 3600 * 24
+        counter.on_call()
+        self.assertIn(counter.count, (3600 * 24, 3600 * 24 + 1))
+        self.assertEqual(2, counter.calls)
+
+
+class TestMetricHistory(unittest.TestCase):
+    def test_only_selected_metrics(self):
+        registry = MetricsRegistry()
+        registry.create_metric('connector.test.async', 60, history=True).on_value(0.5, now=1000)
+        registry.create_metric('connector.test.receiver.0', 60).on_value(0.5, now=1000)
+        self.assertEqual([1000], [x['time'] for x in registry.history('connector.test.async', 1000, 1001, 1)[1]])
+        self.assertIsNone(registry.history('connector.test.receiver.0', 1000, 1001, 1))
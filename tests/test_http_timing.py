@@ -0,0 +1,57 @@
+import unittest
+
+from end2end import metric
+from end2end.connectors.http_timing import HttpTimings, phase_durations, pool_size
+
+_TIME_INFO = {'queue': 0.001, 'namelookup': 0.01, 'connect': 0.03, 'pretransfer': 0.1, 'starttransfer': 0.3,
+              'total': 0.31}
+
+
+class TestPhaseDurations(unittest.TestCase):
+    def test_new_tls_connection(self):
+        result = phase_durations(_TIME_INFO, appconnect=0.08)
+        self.assertEqual(['appconnect', 'connect', 'namelookup', 'pretransfer', 'starttransfer'], sorted(result))
+        self.assertAlmostEqual(0.01, result['namelookup'])
+        self.assertAlmostEqual(0.02, result['connect'])
+        self.assertAlmostEqual(0.05, result['appconnect'])
+        self.assertAlmostEqual(0.02, result['pretransfer'])
+        self.assertAlmostEqual(0.2, result['starttransfer'])
+
+    def test_plain_http(self):
+        result = phase_durations(_TIME_INFO)
+        self.assertNotIn('appconnect', result)
+        self.assertAlmostEqual(0.07, result['pretransfer'])
+
+    def test_reused_connection(self):
+        result = phase_durations(_TIME_INFO, appconnect=0.08, new_connection=False)
+        self.assertEqual(['pretransfer', 'starttransfer'], sorted(result))
+        self.assertAlmostEqual(0.02, result['pretransfer'])
+
+
+class TestHttpTimings(unittest.TestCase):
+    def test_counters_and_metrics(self):
+        timings = HttpTimings('test_http')
+        timings.on_response('publish', _TIME_INFO, appconnect=0.08, num_connects=1)
+        timings.on_response('publish', _TIME_INFO, appconnect=0.08, num_connects=0)
+        timings.on_response('publish', _TIME_INFO, num_connects=0)
+        self.assertEqual({'new': 1, 'reused': 2}, timings.connections_gauge.dump())
+        dump = metric.instance().dump()['connector']['test_http']['http']['publish']
+        self.assertEqual(3, dump['starttransfer']['count'])
+        self.assertEqual(1, dump['connect']['count'])
+        timings.delete()
+        self.assertNotIn('test_http', metric.instance().dump().get('connector', {}))
+
+
+
+class TestPoolSize(unittest.TestCase):
+    def test_grows_on_queue(self):
+        self.assertEqual(13, pool_size(10, 10, 0.05))
+        self.assertEqual(19, pool_size(10, 15, 0.))
+        self.assertEqual(100, pool_size(90, 200, 0.05))
+
+    def test_shrinks_when_idle(self):
+        self.assertEqual(5, pool_size(10, 4, 0.))
+        self.assertEqual(2, pool_size(10, 0, 0.))
+
+    def test_stable(self):
+        self.assertEqual(10, pool_size(10, 6, 0.001))
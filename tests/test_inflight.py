@@ -0,0 +1,45 @@
+import unittest
+
+from end2end.inflight import InFlightTable, TimingWheel
+
+
+class TestInFlightTable(unittest.TestCase):
+    def test_add_remove(self):
+        table = InFlightTable()
+        table.add(10, 'a', 2)
+        table.add(11, 'b', 2)
+        self.assertEqual('a', table.get(10))
+        self.assertEqual(1, table.decrement(10))
+        self.assertEqual(0, table.decrement(10))
+        self.assertIsNone(table.decrement(12))
+        self.assertEqual('a', table.remove(10))
+        self.assertIsNone(table.remove(10))
+        self.assertEqual(1, len(table))
+        self.assertNotIn(10, table)
+
+    def test_slots_reused(self):
+        table = InFlightTable()
+        slot = table.add(1, 'a', 1)
+        table.remove(1)
+        self.assertEqual(slot, table.add(2, 'b', 1))
+        self.assertEqual('b', table.get(2))
+
+
+class TestTimingWheel(unittest.TestCase):
+    def test_expire(self):
+        wheel = TimingWheel(1., 8, 0.)
+        wheel.schedule(2.5, 'a')
+        wheel.schedule(3., 'b')
+        wheel.schedule(20., 'c')
+        self.assertEqual([], wheel.advance(2.))
+        self.assertEqual(['a', 'b'], wheel.advance(3.))
+        self.assertEqual(1, wheel.size)
+        # Same slot as deadline 4, but next round
+        self.assertEqual([], wheel.advance(19.))
+        self.assertEqual(['c'], wheel.advance(25.))
+        self.assertEqual(0, wheel.size)
+
+    def test_deadline_in_past(self):
+        wheel = TimingWheel(0.5, 4, 10.)
+        wheel.schedule(1., 'a')
+        self.assertEqual(['a'], wheel.advance(10.5))
@@ -0,0 +1,41 @@
+import pickle
+import unittest
+
+from end2end.metric import MetricsRegistry, Named
+
+
+def _worker_registry(values, statuses, in_flight):
+    registry = MetricsRegistry()
+    m = registry.create_metric('connector.test.async', 60)
+    for v in values:
+        m.on_value(v)
+    s = registry.create_status_counter('connector.test.publish')
+    for x in statuses:
+        s.on_new_status(x)
+    registry.create_gauge('connector.test.in_flight', lambda: {'count': in_flight})
+    return pickle.loads(pickle.dumps(registry.items()))
+
+
+class TestMetricsMerge(unittest.TestCase):
+    def test_merge(self):
+        first = _worker_registry(range(1, 501), [200, 200], 3)
+        second = _worker_registry(range(501, 1001), [200, 500], 4)
+        merged = MetricsRegistry().merge(first).merge(second).dump()['connector']['test']
+        self.assertEqual(1000, merged['async']['count'])
+        self.assertAlmostEqual(990, merged['async']['p99'], delta=990 * 0.01)
+        self.assertEqual(3, merged['publish']['status_200'])
+        self.assertEqual(1, merged['publish']['status_500'])
+        self.assertEqual(7, merged['in_flight']['count'])
+
+    def test_snapshot_not_modified(self):
+        first = _worker_registry([1], [200], 1)
+        second = _worker_registry([2], [200], 1)
+        MetricsRegistry().merge(first).merge(second)
+        self.assertEqual(1, dict(first)['connector.test.async'].count)
+
+    def test_every_metric_type_is_mergeable(self):
+        types = Named.__subclasses__()
+        while types:
+            type_ = types.pop()
+            self.assertIn('merge', vars(type_), '{} must implement merge'.format(type_.__name__))
+            types.extend(type_.__subclasses__())
@@ -0,0 +1,34 @@
+import json
+import os
+import tempfile
+import unittest
+
+import click
+
+from end2end.microbench import compare, load_baselines
+
+
+class TestCompare(unittest.TestCase):
+    def test_regression(self):
+        self.assertEqual({'a': (13., 10.)}, compare({'a': 13., 'b': 5.}, {'a': 10., 'b': 10.}, 0.2))
+
+    def test_tolerance_boundary(self):
+        self.assertEqual({}, compare({'a': 12.}, {'a': 10.}, 0.2))
+        self.assertEqual({'a': (12.01, 10.)}, compare({'a': 12.01}, {'a': 10.}, 0.2))
+
+    def test_without_baseline(self):
+        self.assertEqual({}, compare({'a': 100.}, {}, 0.2))
+
+
+class TestLoadBaselines(unittest.TestCase):
+    def test_missing_file(self):
+        path = os.path.join(tempfile.mkdtemp(), 'missing.json')
+        with self.assertRaises(click.ClickException):
+            load_baselines(path)
+        self.assertEqual({}, load_baselines(path, save=True))
+
+    def test_stored(self):
+        with tempfile.NamedTemporaryFile('w', suffix='.json', delete=False) as f:
+            json.dump({'a': 1.5}, f)
+        self.assertEqual({'a': 1.5}, load_baselines(f.name))
+        os.remove(f.name)
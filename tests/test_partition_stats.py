@@ -0,0 +1,31 @@
+from end2end.connectors.nakadi import RT
+from end2end.connectors.partition_stats import PartitionStatsPoller
+from end2end.fake.testing import FakeNakadiTestCase
+
+
+class TestPartitionStatsPoller(FakeNakadiTestCase):
+    def setUp(self):
+        super(TestPartitionStatsPoller, self).setUp()
+        self.nakadi.create_event_type('test_stats')
+        self.poller = PartitionStatsPoller(interval=0.05)
+        self.first = RT(self.host(), 1, False, force_instance=True)
+        self.second = RT(self.host(), 1, False, force_instance=True)
+        self.stats = []
+
+    def tearDown(self):
+        self.poller.unsubscribe(self.second, 'test_stats', self.stats.append)
+        self.second.close()
+        super(TestPartitionStatsPoller, self).tearDown()
+
+    def test_closed_client_is_not_used(self):
+        ignored = []
+        self.poller.subscribe(self.first, 'test_stats', ignored.append)
+        self.poller.subscribe(self.second, 'test_stats', self.stats.append)
+        self.wait_for(lambda: self.stats)
+        self.poller.unsubscribe(self.first, 'test_stats', ignored.append)
+        self.assertEqual([self.second], self.poller._hosts[self.host()].rts)
+        self.first.close()
+        self.wait_for(lambda: self.first.http_client._closed)
+        count = len(self.stats)
+        self.wait_for(lambda: len(self.stats) > count + 1)
+        self.assertEqual({'0': 'BEGIN'}, self.stats[-1])
@@ -0,0 +1,36 @@
+import json
+import unittest
+
+from end2end.connectors.payload import EventTemplate, parse_sizes
+
+
+class TestEventTemplate(unittest.TestCase):
+    def test_render(self):
+        template = EventTemplate('test.topic', instance_id='abc', trash='xyz')
+        event = json.loads(template.render(42, 1500000000.25).decode('utf-8'))
+        self.assertEqual(42, event['value'])
+        self.assertEqual('abc', event['instance_id'])
+        self.assertEqual('xyz', event['trash'])
+        self.assertEqual('test.topic', event['metadata']['event_type'])
+        self.assertEqual('2017-07-14T02:40:00.250000+00:00', event['metadata']['occurred_at'])
+        self.assertRegex(event['metadata']['eid'], '^[0-9a-f]{8}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{12}$')
+
+    def test_render_batch(self):
+        template = EventTemplate('test.topic', instance_id='abc', trash='xyz')
+        events = json.loads(template.render_batch([1, 2, 3]).decode('utf-8'))
+        self.assertEqual([1, 2, 3], [e['value'] for e in events])
+        self.assertEqual(3, len(set(e['metadata']['eid'] for e in events)))
+
+    def test_render_partitioned(self):
+        template = EventTemplate('test.topic', partitioned=True, instance_id='abc', trash='xyz')
+        events = json.loads(template.render_batch([1, 2], partitions=['0', '3']).decode('utf-8'))
+        self.assertEqual(['0', '3'], [e['metadata']['partition'] for e in events])
+        self.assertEqual([1, 2], [e['value'] for e in events])
+
+
+class TestParseSizes(unittest.TestCase):
+    def test_formats(self):
+        self.assertEqual([512], parse_sizes(512))
+        self.assertEqual([512, 1024], parse_sizes([512, '1024']))
+        self.assertEqual([512, 1024, 4096], parse_sizes('512,1024,4096'))
+        self.assertEqual([1000, 2000, 3000], parse_sizes('1000:3000:1000'))
@@ -1,5 +1,6 @@
+import copy
 import unittest
-from end2end.metric import Percentile
+from end2end.metric import Percentile, Histogram
 
 
 class TestPercentile(unittest.TestCase):
@@ -7,6 +8,64 @@ class TestPercentile(unittest.TestCase):
         percentile = Percentile(1000)
         for x in range(1001):
             percentile.add(x)
-        self.assertEqual(950, percentile.p95)
-        self.assertEqual(980, percentile.p98)
-        self.assertEqual(990, percentile.p99)
+        self.assertAlmostEqual(950, percentile.p95, delta=950 * 0.01)
+        self.assertAlmostEqual(980, percentile.p98, delta=980 * 0.01)
+        self.assertAlmostEqual(990, percentile.p99, delta=990 * 0.01)
+
+    def test_percentile_window(self):
+        percentile = Percentile(100)
+        for x in range(1000):
+            percentile.add(x)
+        self.assertGreaterEqual(percentile.percentile(0), 800)
+
+
+class TestHistogram(unittest.TestCase):
+    def test_relative_error(self):
+        histogram = Histogram(0.01)
+        for x in range(1, 100001):
+            histogram.add(x / 1000.)
+        for p in (50, 90, 99, 99.9):
+            expected = p * 1000 / 1000.
+            self.assertAlmostEqual(expected, histogram.percentile(p), delta=expected * 0.01)
+
+    def test_empty(self):
+        self.assertIsNone(Histogram().percentile(99))
+
+    def test_zero_values(self):
+        histogram = Histogram()
+        for x in (0, 0, 0, 5):
+            histogram.add(x)
+        self.assertEqual(0, histogram.percentile(50))
+        self.assertAlmostEqual(5, histogram.percentile(100), delta=0.05)
+
+    def test_merge(self):
+        first, second, total = Histogram(), Histogram(), Histogram()
+        for x in range(1, 1001):
+            (first if x % 2 else second).add(x)
+            total.add(x)
+        first.merge(second)
+        self.assertEqual(total.count, first.count)
+        for p in (50, 90, 99.9):
+            self.assertEqual(total.percentile(p), first.percentile(p))
+
+    def test_merge_different_error(self):
+        self.assertRaises(ValueError, Histogram(0.01).merge, Histogram(0.02))
+
+    def test_bounded_buckets(self):
+        histogram = Histogram(0.01, max_buckets=10)
+        for x in range(1, 10000):
+            histogram.add(x)
+        self.assertLessEqual(len(histogram.buckets), 10)
+        self.assertAlmostEqual(9999, histogram.percentile(100), delta=9999 * 0.01)
+
+    def test_difference(self):
+        histogram = Histogram()
+        for x in range(1, 101):
+            histogram.add(x / 1000.)
+        earlier = copy.deepcopy(histogram)
+        for x in range(1, 101):
+            histogram.add(x)
+        difference = histogram.difference(earlier)
+        self.assertEqual(100, difference.count)
+        self.assertAlmostEqual(50, difference.percentile(50), delta=50 * 0.01)
+        self.assertEqual(0, histogram.difference(histogram).count)
@@ -0,0 +1,56 @@
+from end2end.connectors.nakadi import EventStreamReceiver, MIN_BACKOFF, RT
+from end2end.connectors.stream import Cursors
+from end2end.fake.testing import FakeNakadiTestCase
+
+
+class TestEventStreamReceiver(FakeNakadiTestCase):
+    def setUp(self):
+        super(TestEventStreamReceiver, self).setUp()
+        self.nakadi.create_event_type('test')
+        self.rt = RT(self.host(), 2, False, force_instance=True)
+        self.values = []
+        self.receivers = []
+
+    def tearDown(self):
+        for r in self.receivers:
+            r.stop()
+        self.rt.close()
+        super(TestEventStreamReceiver, self).tearDown()
+
+    def _receiver(self, topic='test'):
+        receiver = EventStreamReceiver(
+            self.rt, topic, Cursors([{'partition': '0', 'offset': 'BEGIN'}]), 'mine',
+            lambda value, receiver_id, received_at, metadata: self.values.append((value, metadata['partition'])))
+        self.receivers.append(receiver)
+        return receiver.start()
+
+    def test_receives_own_events(self):
+        receiver = self._receiver()
+        self.publish('test', {'value': 1, 'instance_id': 'other'}, {'value': 2, 'instance_id': 'mine'})
+        self.wait_for(lambda: self.values)
+        self.assertEqual([(2, '0')], self.values)
+        self.wait_for(lambda: receiver.cursors.offset('0') == '{:018d}'.format(1))
+
+    def test_error_status_is_not_parsed(self):
+        receiver = self._receiver('missing')
+        self.wait_for(lambda: receiver.backoff > MIN_BACKOFF)
+        self.assertEqual([], self.values)
+        self.assertEqual(404, receiver._status)
+
+    def test_stop_aborts_stream(self):
+        receiver = self._receiver()
+        self.wait_for(lambda: receiver._curl is not None)
+        receiver.stop()
+        # Stream is aborted on the next chunk, value is not passed to callback
+        self.publish('test', {'value': 1, 'instance_id': 'mine'})
+        self.wait_for(lambda: receiver._curl is None)
+        self.assertEqual([], self.values)
+
+    def test_close_waits_for_stream(self):
+        receiver = self._receiver()
+        self.wait_for(lambda: receiver._curl is not None)
+        receiver.stop()
+        self.rt.close()
+        self.assertFalse(self.rt.http_client._closed)
+        self.publish('test', {'value': 1, 'instance_id': 'mine'})
+        self.wait_for(lambda: self.rt.http_client._closed)
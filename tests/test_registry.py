@@ -0,0 +1,54 @@
+from end2end import metric
+from end2end.connectors import registry
+from end2end.fake.testing import FakeNakadiTestCase
+
+
+class TestSetConfig(FakeNakadiTestCase):
+    def setUp(self):
+        super(TestSetConfig, self).setUp()
+        self.registry = registry.instance()
+
+    def tearDown(self):
+        self.registry.set_items([])
+        super(TestSetConfig, self).tearDown()
+
+    def _spec(self, topic, rate):
+        return {'type': 'nakadi', 'host': self.host(), 'verify': False, 'topic': topic, 'receivers': 1,
+                'trash-size': 16, 'rate': rate, 'max_wait': 10}
+
+    def test_only_changed_connectors_are_touched(self):
+        config = {
+            'test_registry_kept': self._spec('test_registry_kept', 20),
+            'test_registry_changed': self._spec('test_registry_changed', 1),
+            'test_registry_removed': self._spec('test_registry_removed', 1),
+        }
+        self.registry.set_config(config)
+        connectors = {c.name: c for c in self.registry.items()}
+        kept = connectors['test_registry_kept']
+        self.wait_for(lambda: kept.async_metric.histogram.count)
+        receivers = list(kept.initialized_receivers)
+        cursors = receivers[0].cursors
+        offset = cursors.offset('0')
+        async_metric = kept.async_metric
+
+        config = dict(config, test_registry_changed=self._spec('test_registry_changed', 4))
+        del config['test_registry_removed']
+        self.registry.set_config(config)
+
+        self.assertEqual({'test_registry_kept', 'test_registry_changed'}, set(c.name for c in self.registry.items()))
+        self.assertIs(kept, [c for c in self.registry.items() if c.name == 'test_registry_kept'][0])
+        self.assertIs(connectors['test_registry_changed'],
+                      [c for c in self.registry.items() if c.name == 'test_registry_changed'][0])
+        self.assertEqual(0.25, connectors['test_registry_changed'].interval)
+        self.assertFalse(connectors['test_registry_removed'].active)
+        self.assertNotIn('connector.test_registry_removed.async', dict(metric.instance().items()))
+        self.assertNotIn('connector.test_registry_removed.http.pool', dict(metric.instance().items()))
+        self.assertIn('connector.test_registry_kept.http.pool', dict(metric.instance().items()))
+        # Streams, cursors and metrics of unchanged connector are kept
+        self.assertEqual(receivers, kept.initialized_receivers)
+        self.assertFalse(any(r.stopped for r in receivers))
+        self.assertIs(cursors, kept.initialized_receivers[0].cursors)
+        self.assertIs(async_metric, dict(metric.instance().items())['connector.test_registry_kept.async'])
+        count = async_metric.histogram.count
+        self.wait_for(lambda: async_metric.histogram.count > count)
+        self.assertGreater(int(cursors.offset('0')), int(offset))
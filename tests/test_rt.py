@@ -0,0 +1,55 @@
+from end2end import metric
+from end2end.connectors.http_timing import HttpTimings
+from end2end.connectors.nakadi import RT
+from end2end.fake.testing import FakeNakadiTestCase
+
+
+class TestRTTimings(FakeNakadiTestCase):
+    def setUp(self):
+        super(TestRTTimings, self).setUp()
+        self.nakadi.create_event_type('test')
+        self.timings = HttpTimings('test_rt')
+        self.rt = RT(self.host(), 1, False, force_instance=True, timings=self.timings)
+
+    def tearDown(self):
+        self.timings.delete()
+        self.rt.close()
+        super(TestRTTimings, self).tearDown()
+
+    def _fetch(self):
+        self.rt.fetch('/event-types/test/partitions', self.stop, endpoint='partitions', method='GET')
+        return self.wait()
+
+    def test_connection_reuse(self):
+        self.assertEqual(200, self._fetch().code)
+        response = self._fetch()
+        self.assertEqual(0, response.connection_info[1])
+        self.assertEqual({'new': 1, 'reused': 1}, self.timings.connections_gauge.dump())
+        dump = metric.instance().dump()['connector']['test_rt']['http']['partitions']
+        self.assertEqual(1, dump['connect']['count'])
+        self.assertEqual(2, dump['starttransfer']['count'])
+
+
+class TestPublishClient(FakeNakadiTestCase):
+    def setUp(self):
+        super(TestPublishClient, self).setUp()
+        self.nakadi.create_event_type('test')
+        self.responses = []
+
+    def _fetch(self, rt, count):
+        for _ in range(count):
+            rt.fetch('/event-types/test/partitions', self.responses.append, method='GET')
+
+    def test_only_publish_demand_is_counted(self):
+        shared = RT(self.host(), 5, False)
+        publish = RT(self.host(), 5, False, force_instance=True, adaptive=True)
+        self.addCleanup(publish.close)
+        self.assertIsNot(shared.http_client, publish.http_client)
+        client = publish.http_client
+        client._peak_demand = 0
+        self._fetch(shared, 3)
+        self.assertEqual(0, client._peak_demand)
+        self._fetch(publish, 3)
+        self.assertEqual(3, client._peak_demand)
+        self.wait_for(lambda: len(self.responses) == 6)
+        self.assertEqual({'size': 5, 'busy': 0, 'queued': 0}, client.pool_stats())
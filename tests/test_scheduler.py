@@ -0,0 +1,28 @@
+import unittest
+
+from end2end.scheduler import RateSchedule
+
+
+class TestRateSchedule(unittest.TestCase):
+    def test_no_drift(self):
+        schedule = RateSchedule(0.4, 100.)
+        self.assertEqual([100.], schedule.due(100.))
+        self.assertEqual([], schedule.due(100.3))
+        # Invocation is late, but next deadline is not shifted
+        self.assertEqual([100.4], schedule.due(100.5))
+        self.assertAlmostEqual(100.8, schedule.next_deadline)
+
+    def test_catch_up(self):
+        schedule = RateSchedule(1, 0.)
+        schedule.due(0.)
+        self.assertEqual([1., 2., 3.], schedule.due(3.5))
+        self.assertEqual(4., schedule.next_deadline)
+
+    def test_skip_when_too_late(self):
+        schedule = RateSchedule(1, 0., max_catch_up=2)
+        self.assertEqual([9., 10.], schedule.due(10.))
+        self.assertEqual(9, schedule.skipped)
+        self.assertEqual(11., schedule.next_deadline)
+
+    def test_rate(self):
+        self.assertEqual(2.5, RateSchedule(0.4, 0.).rate)
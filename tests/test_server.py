@@ -0,0 +1,34 @@
+import json
+
+from tornado.testing import AsyncHTTPTestCase
+
+from end2end import metric
+from end2end.server import create_application
+
+
+class TestHistoryHandler(AsyncHTTPTestCase):
+    def get_app(self):
+        return create_application()
+
+    def setUp(self):
+        super(TestHistoryHandler, self).setUp()
+        self.metric = metric.instance().create_metric('connector.test_server.async', 60, history=True)
+        self.metric.on_value(0.1)
+
+    def tearDown(self):
+        metric.instance().delete(self.metric)
+        super(TestHistoryHandler, self).tearDown()
+
+    def test_history(self):
+        response = self.fetch('/metrics/history?metric=connector.test_server.async&from=-10&step=5')
+        self.assertEqual(200, response.code)
+        self.assertEqual(5, json.loads(response.body.decode('utf-8'))['step'])
+
+    def test_not_a_number(self):
+        for query in ('from=abc', 'to=-1x', 'step=1.5'):
+            response = self.fetch('/metrics/history?metric=connector.test_server.async&' + query)
+            self.assertEqual(400, response.code)
+            self.assertIn('error', json.loads(response.body.decode('utf-8')))
+
+    def test_not_available(self):
+        self.assertEqual(404, self.fetch('/metrics/history?metric=connector.test_server.sync').code)
@@ -0,0 +1,128 @@
+import json
+import unittest
+
+from end2end.connectors.stream import Cursors, LineFramer, consumer_lag, extract_cursor, is_keep_alive, lag, \
+    offset_position, parse_line, parse_timestamp
+
+
+def _batch(partition, offset, *instances):
+    return json.dumps({
+        'cursor': {'partition': partition, 'offset': offset},
+        'events': [{'value': i, 'instance_id': x, 'trash': 'abc'} for i, x in enumerate(instances)]
+    }).encode('utf-8') + b'\n'
+
+
+class TestLineFramer(unittest.TestCase):
+    def test_split_chunks(self):
+        lines = []
+        framer = LineFramer(lambda line: lines.append(bytes(line)))
+        data = b'first\nsecond\n\nthird\n'
+        for i in range(len(data)):
+            framer.feed(data[i:i + 1])
+        self.assertEqual([b'first', b'second', b'third'], lines)
+
+    def test_keeps_tail(self):
+        lines = []
+        framer = LineFramer(lambda line: lines.append(bytes(line)))
+        framer.feed(b'first\nsec')
+        self.assertEqual([b'first'], lines)
+        framer.feed(b'ond\n')
+        self.assertEqual([b'first', b'second'], lines)
+
+    def test_marker(self):
+        result = []
+        framer = LineFramer(lambda line, matched: result.append((parse_line(line)['cursor']['offset'], matched)),
+                            b'"mine"')
+        framer.feed(_batch('0', '1', 'other') + _batch('0', '2', 'other', 'mine') + _batch('1', '3'))
+        self.assertEqual([('1', False), ('2', True), ('3', False)], result)
+
+
+class TestExtractCursor(unittest.TestCase):
+    def test_extract(self):
+        self.assertEqual({'partition': '1', 'offset': '0005'}, extract_cursor(_batch('1', '0005', 'other')))
+
+    def test_extract_from_memoryview(self):
+        self.assertEqual({'partition': '1', 'offset': '7'}, extract_cursor(memoryview(_batch('1', '7'))))
+
+    def test_cursor_after_events(self):
+        line = b'{"events":[{"value":1,"instance_id":"x"}],"cursor":{"partition":"2","offset":"9"}}'
+        self.assertEqual({'partition': '2', 'offset': '9'}, extract_cursor(line))
+
+    def test_keep_alive(self):
+        self.assertTrue(is_keep_alive(memoryview(b'{"cursor":{"partition":"0","offset":"5"}}')))
+        self.assertFalse(is_keep_alive(memoryview(_batch('0', '5', 'other'))))
+        info = b'{"cursor":{"partition":"0","offset":"5"},"info":{"debug":"' + b'x' * 1000 + b'"}}'
+        self.assertTrue(is_keep_alive(memoryview(info)))
+
+
+class TestParseTimestamp(unittest.TestCase):
+    def test_utc(self):
+        self.assertAlmostEqual(1500000000.25, parse_timestamp('2017-07-14T02:40:00.250Z'))
+
+    def test_offset(self):
+        self.assertAlmostEqual(1500000000.25, parse_timestamp('2017-07-14T04:40:00.25+02:00'))
+        self.assertAlmostEqual(1500000000.000001, parse_timestamp('2017-07-14T02:40:00.000001+00:00'))
+
+    def test_no_fraction(self):
+        self.assertEqual(1500000000, parse_timestamp('2017-07-14T02:40:00Z'))
+
+
+class TestCursors(unittest.TestCase):
+    def test_update(self):
+        cursors = Cursors([{'partition': '0', 'offset': '1'}, {'partition': '1', 'offset': '2'}])
+        cursors.update({'partition': '1', 'offset': '5'})
+        cursors.update({'partition': '7', 'offset': '5'})
+        self.assertEqual(['0', '1'], cursors.partitions())
+        self.assertEqual('5', cursors.offset('1'))
+        self.assertEqual([{'partition': '0', 'offset': '1'}, {'partition': '1', 'offset': '5'}],
+                         json.loads(cursors.serialize()))
+
+    def test_serialized_is_cached(self):
+        cursors = Cursors([{'partition': '0', 'offset': '1'}])
+        serialized = cursors.serialize()
+        cursors.update({'partition': '0', 'offset': '1'})
+        self.assertIs(serialized, cursors.serialize())
+        cursors.update({'partition': '0', 'offset': '2'})
+        self.assertEqual([{'partition': '0', 'offset': '2'}], json.loads(cursors.serialize()))
+
+    def test_single_partition(self):
+        cursors = Cursors([{'partition': '0', 'offset': '1'}, {'partition': '1', 'offset': '2'}])
+        self.assertEqual([{'partition': '1', 'offset': '2'}], json.loads(cursors.serialize('1')))
+
+    def test_copy(self):
+        cursors = Cursors([{'partition': '0', 'offset': '1'}])
+        copy = cursors.copy()
+        copy.update({'partition': '0', 'offset': '2'})
+        self.assertEqual('1', cursors.offset('0'))
+
+
+class TestLag(unittest.TestCase):
+    def test_offset_position(self):
+        self.assertEqual(('', 123), offset_position('000000000000000123'))
+        self.assertEqual(('001-0001', 123), offset_position('001-0001-000000000000000123'))
+        self.assertEqual((None, -1), offset_position('BEGIN'))
+
+    def test_lag(self):
+        self.assertEqual(5, lag('000000000000000010', '000000000000000005'))
+        self.assertEqual(11, lag('000000000000000010', 'BEGIN'))
+        self.assertEqual(0, lag('BEGIN', 'BEGIN'))
+        self.assertEqual(0, lag('000000000000000005', '000000000000000007'))
+
+    def test_different_timelines(self):
+        self.assertIsNone(lag('001-0002-000000000000000001', '001-0001-000000000000000100'))
+        self.assertEqual(2, lag('001-0002-000000000000000001', 'BEGIN'))
+
+
+class TestConsumerLag(unittest.TestCase):
+    def test_receivers_and_partitions(self):
+        newest = {'0': '000000000000000010', '1': '000000000000000020'}
+        receivers = {
+            '0': {'0': '000000000000000010', '1': '000000000000000015'},
+            '1': {'0': '000000000000000008', '1': '000000000000000020'},
+        }
+        self.assertEqual(({'0': 5, '1': 2}, {'0': 2, '1': 5}), consumer_lag(newest, receivers))
+
+    def test_unknown_partitions(self):
+        newest = {'0': '000000000000000010'}
+        receivers = {'0': {'1': '000000000000000001'}, '1': {}}
+        self.assertEqual(({}, {}), consumer_lag(newest, receivers))
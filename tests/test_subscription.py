@@ -0,0 +1,42 @@
+from end2end.connectors.registry import DataToSend
+from end2end.connectors.subscription import NakadiSubscriptionConnector
+from end2end.fake.testing import FakeNakadiTestCase
+
+
+class TestSubscriptionConnector(FakeNakadiTestCase):
+    def setUp(self):
+        super(TestSubscriptionConnector, self).setUp()
+        self.connector = NakadiSubscriptionConnector(
+            'test_subscription', topic='test_subscription', host=self.host(), verify=False, receivers=1,
+            batch_flush_timeout=1, commit_batch=2, commit_interval=60, **{'trash-size': 16})
+        self.connector.initialize(self.stop)
+        self.wait()
+        self.receiver = self.connector.initialized_receivers[0]
+        self.wait_for(lambda: self.receiver.stream_id is not None)
+        self.subscription = self.nakadi.subscriptions[self.connector.subscription_id]
+
+    def tearDown(self):
+        self.connector.deinitialize()
+        super(TestSubscriptionConnector, self).tearDown()
+
+    def test_receives_own_events(self):
+        data = DataToSend(1, self.connector)
+        self.connector.track(data)
+        self.connector.send_and_receive([data], False)
+        self.wait_for(lambda: self.connector.async_metric.histogram.count)
+        self.assertEqual(0, len(self.connector.in_flight))
+
+    def test_keep_alive_is_not_committed(self):
+        # Keep-alive batches are sent every batch_flush_timeout
+        self.run_for(2.5)
+        self.assertEqual(0, self.receiver._uncommitted_batches)
+        self.assertEqual(0, self.connector.commit_rps.calls)
+        self.publish('test_subscription', {'value': 1, 'instance_id': 'other'})
+        self.run_for(0.2)
+        self.assertEqual(1, self.receiver._uncommitted_batches)
+        self.assertEqual({'0': -1}, self.subscription.committed)
+        self.publish('test_subscription', {'value': 2, 'instance_id': 'other'})
+        self.wait_for(lambda: self.subscription.committed == {'0': 1})
+        self.assertEqual(0, self.receiver._uncommitted_batches)
+        self.assertEqual(1, self.connector.commit_rps.calls)
+
@@ -0,0 +1,37 @@
+import multiprocessing
+import unittest
+
+from end2end.supervisor import Supervisor, shard_of
+
+
+class TestSupervisorHistory(unittest.TestCase):
+    def setUp(self):
+        self.supervisor = Supervisor(2)
+        self.workers = []
+        for i in range(2):
+            parent, child = multiprocessing.Pipe()
+            self.supervisor._conns[i] = parent
+            self.workers.append(child)
+
+    def tearDown(self):
+        for conn in self.supervisor._conns + self.workers:
+            conn.close()
+
+    def test_history_is_requested_from_owning_worker(self):
+        future = self.supervisor.history('connector.test.async', 10, 20, 1)
+        idx = shard_of('test', 2)
+        kind, (request_id, name, start, end, step) = self.workers[idx].recv()
+        self.assertEqual(('history', 'connector.test.async', 10, 20, 1), (kind, name, start, end, step))
+        self.assertFalse(self.workers[1 - idx].poll())
+        self.assertFalse(future.done())
+
+        self.workers[idx].send(('snapshot', [('connector.test.async', None)]))
+        self.workers[idx].send(('history', (request_id, (1, [{'time': 10}]))))
+        self.supervisor._on_message(idx, None, None)
+        self.assertEqual((1, [{'time': 10}]), future.result())
+        self.assertEqual([('connector.test.async', None)], self.supervisor._snapshots[idx])
+        self.assertEqual({}, self.supervisor._pending)
+
+    def test_history_of_non_connector_metric(self):
+        self.assertIsNone(self.supervisor.history('http.pool', 10, 20, 1).result())
+        self.assertFalse(any(conn.poll() for conn in self.workers))
@@ -0,0 +1,45 @@
+import logging
+import unittest
+
+from end2end.metric import Metric
+from end2end.tracing import Tracer
+
+
+class _Records(logging.Handler):
+    def __init__(self):
+        super(_Records, self).__init__()
+        self.records = []
+
+    def emit(self, record):
+        self.records.append(record)
+
+
+class TestTracer(unittest.TestCase):
+    def setUp(self):
+        self.metric = Metric('test_tracing', 60)
+        for i in range(1, 101):
+            self.metric.on_value(i / 100.)
+
+    def test_reasons(self):
+        tracer = Tracer(percentile=99, sample_rate=0)
+        self.assertEqual('timeout', tracer.reason(self.metric, None, True))
+        self.assertEqual('slow', tracer.reason(self.metric, 2., False))
+        self.assertIsNone(tracer.reason(self.metric, 0.5, False))
+        self.assertEqual('sampled', Tracer(sample_rate=1).reason(self.metric, 0.5, False))
+
+    def test_threshold_is_cached(self):
+        tracer = Tracer(percentile=50)
+        threshold = tracer.threshold(self.metric, now=100)
+        for _ in range(1000):
+            self.metric.on_value(10.)
+        self.assertEqual(threshold, tracer.threshold(self.metric, now=100.5))
+        self.assertLess(threshold, tracer.threshold(self.metric, now=101))
+
+    def test_emit(self):
+        handler = _Records()
+        logger = logging.getLogger('test_tracing')
+        logger.addHandler(handler)
+        logger.setLevel(logging.INFO)
+        Tracer(logger=logger).emit('timeout', {'value': 1})
+        self.assertEqual(logging.WARNING, handler.records[0].levelno)
+        self.assertEqual('{"value": 1, "reason": "timeout"}', handler.records[0].getMessage())